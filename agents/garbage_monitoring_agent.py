@@ -75,14 +75,20 @@ class GarbageMonitoringAgent:
         """初始化MCP客户端和工具"""
         print("🔧 正在初始化MCP客户端...")
         
-        # 配置MCP服务器
-        self.mcp_client = MultiServerMCPClient({
-            "garbage_monitoring": {
+        # 配置MCP服务器：设置了GARBAGE_MCP_URL时连接共享的常驻服务器，否则以stdio子进程启动
+        server_url = os.getenv("GARBAGE_MCP_URL")
+        if server_url:
+            server = {
+                "url": server_url,
+                "transport": "sse" if server_url.rstrip("/").endswith("/sse") else "streamable_http",
+            }
+        else:
+            server = {
                 "command": "python",
                 "args": [MCP_SERVER_PATH],
                 "transport": "stdio",
             }
-        })
+        self.mcp_client = MultiServerMCPClient({"garbage_monitoring": server})
         
         # 获取工具
         self.tools = await self.mcp_client.get_tools()
@@ -361,10 +367,29 @@ WHERE load_time_str IS NOT NULL;
 6. check_data_quality - 检查数据质量
 7. get_available_date_range - 获取可用数据日期范围
 8. execute_any_sql_query - 执行自定义SQL查询
+9. execute_sql_batch - 一次执行多条自定义SQL查询
+10. time_series - 按小时/天/周/月统计清运、满溢、小包垃圾、装修预约的时间序列
+11. top_k - 查询清运量/事件数最多的K个街道、小区、垃圾房或车辆
+12. clearance_anomalies - 识别最近一天日清运量骤降/骤增的小区（可能漏收或误扫）
 
 ## 响应策略
 - **优先使用预定义工具**: 对于常见查询，优先使用1-7号工具
 - **自定义SQL场景**: 只有在预定义工具无法满足需求时才使用execute_any_sql_query
+- **长时间跨度统计**: 查询跨度一周以上的街道清运统计时，可传 approximate=true 用近似去重计数加速，
+  回答中说明涉及小区数/参与车辆数为近似值
+- **时间趋势**: 按小时/天/周/月看趋势时优先使用time_series，不要自己写strftime分组的SQL
+- **历史数据**: 几个月前已结束的记录会被归档，在线查询查不到时，调用execute_any_sql_query并传
+  include_history=true 合并查询归档数据
+- **大结果集**: 预计返回成百上千行（如明细列表、逾期问题很多）时，execute_any_sql_query和get_overdue_issues
+  传 response_mode="summary"，只取总行数、字段统计和代表性样本，据此分析；需要具体记录时再加条件或LIMIT查询
+- **结果句柄**: 自定义SQL结果行较多时只返回结果句柄和结果预览，完整结果保存在服务端；需要查看更多记录时
+  用fetch_result(handle, offset, limit)分页读取，用户要求导出或保存明细时用export_result(handle, "csv")，
+  不要分页读取全部结果再整理
+- **导出明细**: 用户要求导出、下载或保存某个条件下的全部明细时，直接用export_query(query, params, "csv")
+  由服务器把查询结果写入outputs目录，回复文件路径和行数，不要先查询出全部结果
+- **排行类问题**: "哪些小区/垃圾房最多"之类的问题优先使用top_k，不要写GROUP BY + ORDER BY + LIMIT的SQL
+- **合并多条查询**: 一个问题需要多次小查询（如日期范围、计数、TopN）时，用execute_sql_batch一次提交，
+  参数格式为 [{"query": "SQL语句", "params": [参数]}, ...]，结果按语句序号返回
 - **提供清晰分析**: 突出重要发现和趋势，用结构化方式展示结果
 - **数据洞察**: 提供有价值的业务建议和数据解读
 
@@ -542,7 +567,7 @@ async def continue_asking_node(state: AgentState) -> AgentState:
     
     return state
 
-def save_results_node(state: AgentState) -> AgentState:
+async def save_results_node(state: AgentState) -> AgentState:
     """节点3：保存结果为CSV和JSON文件"""
     print(f"\n💾 开始保存结果...")
     
@@ -577,7 +602,9 @@ def save_results_node(state: AgentState) -> AgentState:
         print(f"📄 已保存对话记录: {conversation_file}")
         
         # 尝试从消息中提取工具调用结果并保存为CSV
-        extract_and_save_tool_results(state["messages"], timestamp, saved_files)
+        handles = extract_and_save_tool_results(state["messages"], timestamp, saved_files)
+        # 保存在服务端的大结果由MCP服务器直接导出，结果行不经过本进程
+        await export_result_handles(state.get("agent_instance"), handles, timestamp, saved_files)
         
         # 保存简化的查询结果文本
         result_file = f"query_result_{timestamp}.txt"
@@ -612,8 +639,9 @@ def save_results_node(state: AgentState) -> AgentState:
     
     return state
 
-def extract_and_save_tool_results(messages: List[BaseMessage], timestamp: str, saved_files: list):
-    """从消息中提取工具调用结果并保存为CSV"""
+def extract_and_save_tool_results(messages: List[BaseMessage], timestamp: str, saved_files: list) -> List[str]:
+    """从消息中提取工具调用结果并保存为CSV，返回结果中出现的服务端结果句柄"""
+    handles = []
     try:
         tool_result_count = 0
         
@@ -632,17 +660,46 @@ def extract_and_save_tool_results(messages: List[BaseMessage], timestamp: str, s
                             key in result_data for key in [
                                 "查询日期", "查询时间段", "小包垃圾超时问题", 
                                 "预约数据", "状态统计", "数据质量检查", 
-                                "数据日期范围", "查询结果"
+                                "数据日期范围", "查询结果", "批量结果", "结果句柄"
                             ]
                         ):
                             tool_result_count += 1
                             save_tool_result_as_csv(result_data, f"tool_result_{tool_result_count}", timestamp, saved_files)
+                            handles.extend(find_result_handles(result_data))
                     
                     except json.JSONDecodeError:
                         continue
     
     except Exception as e:
         print(f"⚠️ 工具结果提取失败: {e}")
+    
+    return list(dict.fromkeys(handles))
+
+def find_result_handles(result_data: dict) -> List[str]:
+    """查找工具结果（包括批量查询的各条结果）中的服务端结果句柄"""
+    responses = [result_data, *result_data.get("批量结果", {}).values()]
+    return [r["结果句柄"] for r in responses if isinstance(r, dict) and r.get("结果句柄")]
+
+async def export_result_handles(agent_instance, handles: List[str], timestamp: str, saved_files: list):
+    """调用MCP工具export_result，由服务器把句柄对应的完整结果写入CSV"""
+    if not handles or not agent_instance or not agent_instance.tools:
+        return
+    export_tool = next((t for t in agent_instance.tools if t.name == "export_result"), None)
+    if export_tool is None:
+        return
+    for handle in handles:
+        try:
+            output = await export_tool.ainvoke({
+                "handle": handle, "format": "csv", "path": f"result_{handle}_{timestamp}.csv"
+            })
+            result = json.loads(output if isinstance(output, str) else output[0]["text"])
+            if result["执行状态"] != "成功":
+                print(f"⚠️ 结果句柄 {handle} 导出失败: {result['错误信息']}")
+                continue
+            saved_files.append(result["文件路径"])
+            print(f"📊 已导出: {os.path.basename(result['文件路径'])} ({result['行数']} 条记录)")
+        except Exception as e:
+            print(f"⚠️ 结果句柄 {handle} 导出失败: {e}")
 
 def save_tool_result_as_csv(result_data: dict, tool_name: str, timestamp: str, saved_files: list):
     """保存单个工具结果为CSV格式"""
@@ -656,8 +713,10 @@ def save_tool_result_as_csv(result_data: dict, tool_name: str, timestamp: str, s
         saved_files.append(str(json_filepath))
         print(f"📄 已保存: {json_filename}")
         
-        # 遍历结果数据，查找可以转换为CSV的列表数据
+        # 遍历结果数据，查找可以转换为CSV的列表数据（结果预览对应的完整结果由export_result导出）
         for key, value in result_data.items():
+            if key == "结果预览":
+                continue
             if isinstance(value, list) and value:
                 # 检查列表中是否包含字典（可以转为表格）
                 if isinstance(value[0], dict):
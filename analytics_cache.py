@@ -0,0 +1,378 @@
+"""
+干湿垃圾数据的内存列式分析缓存
+将garbage_data加载为NumPy列，分组/求和/计数类统计用向量化计算代替SQLite逐行聚合
+"""
+import logging
+import sqlite3
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# 时间戳缺失（无法解析的清运时间）时的取值，与NumPy的NaT一致
+MISSING_TIMESTAMP = np.iinfo(np.int64).min
+
+SECONDS_PER_DAY = 86400
+
+# 字符串比较与时间先后一致的清运时间格式；其他格式的行在SQL中按字符串比较，缓存无法等价计算
+CANONICAL_TIME_PATTERN = r"\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}"
+
+
+class AnalyticsCacheMemoryError(Exception):
+    """缓存数据超过内存预算"""
+
+
+class GarbageAnalyticsCache:
+    """
+    garbage_data的NumPy列式缓存
+
+    街道、垃圾类型、车辆和小区保存为分类编码（-1表示NULL），清运量为float64
+    （由SQLite执行CAST，NULL为NaN），清运时间为int64秒级时间戳。
+    刷新按rowid增量追加新行；表被重建或删除过行时整体重新加载。
+    清运时间不是规范格式（YYYY-MM-DD HH:MM:SS）的行保留原始字符串，
+    涉及这些行的统计由covers判断后交给SQL计算。
+    """
+
+    TABLE_NAME = "garbage_data"
+
+    # 缓存为分类编码的字段：列名 -> 结果中使用的中文名
+    CATEGORY_COLUMNS = {
+        "street_name": "街道",
+        "type_name": "垃圾类型",
+        "vehicle_license_num": "车牌号",
+        "community_name": "小区"
+    }
+
+    def __init__(self, connection: sqlite3.Connection, lock: threading.RLock,
+                 max_memory_mb: float = 256, fetch_batch_size: int = 50000):
+        """
+        初始化分析缓存（不立即加载数据）
+
+        Args:
+            connection: 数据库连接
+            lock: 保护该连接的锁
+            max_memory_mb: 缓存数据的内存预算（MB）
+            fetch_batch_size: 加载时每批读取的行数
+        """
+        self.connection = connection
+        self.lock = lock
+        self.max_memory_bytes = int(max_memory_mb * 1024 * 1024)
+        self.fetch_batch_size = fetch_batch_size
+        # 刷新与查询并发时，查询总是读到一份完整的列快照
+        self._state: Optional[Dict[str, Any]] = None
+        self._refresh_lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        """缓存是否已加载"""
+        return self._state is not None
+
+    def invalidate(self):
+        """丢弃缓存数据，下次刷新时整体重新加载"""
+        self._state = None
+
+    def refresh(self) -> Dict[str, Any]:
+        """
+        与数据库同步缓存
+
+        只读取rowid大于已加载最大rowid的新行；若已加载范围内的行数发生变化
+        （表被重建或删除过行），则整体重新加载。
+
+        Returns:
+            刷新信息，包括新增行数、缓存行数和内存占用
+
+        Raises:
+            AnalyticsCacheMemoryError: 缓存数据超过内存预算
+        """
+        with self._refresh_lock:
+            state = self._state
+            with self.lock:
+                cursor = self.connection.cursor()
+                if state is not None:
+                    cursor.execute(
+                        f'SELECT COUNT(*) FROM "{self.TABLE_NAME}" WHERE rowid <= ?',
+                        (state["max_rowid"],)
+                    )
+                    if cursor.fetchone()[0] != state["rows"]:
+                        logger.info("garbage_data已被重建，分析缓存整体重新加载")
+                        state = None
+
+                last_rowid = state["max_rowid"] if state is not None else 0
+                cursor.execute(f"""
+                SELECT rowid, street_name, type_name, vehicle_license_num, community_name,
+                       CAST(garbage_weight AS FLOAT), load_time_str
+                FROM "{self.TABLE_NAME}"
+                WHERE rowid > ?
+                ORDER BY rowid
+                """, (last_rowid,))
+                batches = []
+                while True:
+                    batch = cursor.fetchmany(self.fetch_batch_size)
+                    if not batch:
+                        break
+                    batches.append([tuple(row) for row in batch])
+
+            new_rows = [row for batch in batches for row in batch]
+            self._state = self._append(state, new_rows)
+            return {
+                "新增行数": len(new_rows),
+                "缓存行数": self._state["rows"],
+                "内存占用MB": round(self._state["nbytes"] / 1024 / 1024, 2)
+            }
+
+    def _append(self, state: Optional[Dict[str, Any]],
+                rows: List[Tuple]) -> Dict[str, Any]:
+        """在已有列快照之后追加新行，返回新的列快照"""
+        if state is None:
+            state = {
+                "rows": 0,
+                "max_rowid": 0,
+                "categories": {c: [] for c in self.CATEGORY_COLUMNS},
+                "codes": {c: np.empty(0, dtype=np.int32) for c in self.CATEGORY_COLUMNS},
+                "weight": np.empty(0, dtype=np.float64),
+                "timestamp": np.empty(0, dtype=np.int64),
+                "irregular_times": [],
+                "irregular_days": [],
+                "nbytes": 0
+            }
+        if not rows:
+            return state
+
+        frame = pd.DataFrame.from_records(
+            rows, columns=["rowid"] + list(self.CATEGORY_COLUMNS) + ["weight", "load_time_str"]
+        )
+
+        categories = {}
+        codes = {}
+        for column in self.CATEGORY_COLUMNS:
+            # 沿用已有编码，新出现的取值追加在末尾，保证增量刷新后编码稳定
+            known = state["categories"][column]
+            lookup = {value: code for code, value in enumerate(known)}
+            uniques = pd.unique(frame[column].dropna())
+            added = [value for value in uniques if value not in lookup]
+            for value in added:
+                lookup[value] = len(lookup)
+            categories[column] = known + added
+            new_codes = frame[column].map(lookup).fillna(-1).to_numpy(dtype=np.int32)
+            codes[column] = np.concatenate([state["codes"][column], new_codes])
+
+        weight = frame["weight"].to_numpy(dtype=np.float64, na_value=np.nan)
+        raw_time = frame["load_time_str"]
+        parsed = pd.to_datetime(raw_time, format="%Y-%m-%d %H:%M:%S", errors="coerce")
+        # strptime也接受不补零的月日，这类取值的字符串顺序与时间顺序不同，同样视为不规范
+        canonical = raw_time.astype("string").str.fullmatch(CANONICAL_TIME_PATTERN).fillna(False)
+        regular = canonical.to_numpy(dtype=bool) & parsed.notna().to_numpy()
+        timestamp = parsed.to_numpy(dtype="datetime64[s]").view(np.int64).copy()
+        timestamp[~regular] = MISSING_TIMESTAMP
+        irregular_times = [str(value) for value in raw_time[~regular & raw_time.notna().to_numpy()]]
+        irregular_days = self._sqlite_dates(irregular_times)
+
+        new_state = {
+            "rows": state["rows"] + len(frame),
+            "max_rowid": int(frame["rowid"].iloc[-1]),
+            "categories": categories,
+            "codes": codes,
+            "weight": np.concatenate([state["weight"], weight]),
+            "timestamp": np.concatenate([state["timestamp"], timestamp]),
+            "irregular_times": state["irregular_times"] + irregular_times,
+            "irregular_days": state["irregular_days"] + irregular_days
+        }
+        new_state["nbytes"] = (
+            sum(array.nbytes for array in new_state["codes"].values())
+            + new_state["weight"].nbytes
+            + new_state["timestamp"].nbytes
+            + sum(len(value.encode("utf-8")) + 56 for value in new_state["irregular_times"])
+            + sum(len(str(value).encode("utf-8")) + 56
+                  for values in categories.values() for value in values)
+        )
+        if new_state["nbytes"] > self.max_memory_bytes:
+            raise AnalyticsCacheMemoryError(
+                f"分析缓存需要 {new_state['nbytes'] / 1024 / 1024:.1f}MB，"
+                f"超过内存预算 {self.max_memory_bytes / 1024 / 1024:.1f}MB"
+            )
+        return new_state
+
+    @staticmethod
+    def _sqlite_dates(values: List[str]) -> List[Optional[str]]:
+        """由SQLite计算DATE(取值)，与SQL路径按日过滤的结果一致"""
+        if not values:
+            return []
+        connection = sqlite3.connect(":memory:")
+        try:
+            return [connection.execute("SELECT DATE(?)", (value,)).fetchone()[0] for value in values]
+        finally:
+            connection.close()
+
+    def covers(self, start: Optional[str] = None, end: Optional[str] = None,
+               day: Optional[str] = None) -> bool:
+        """
+        判断缓存能否得到与SQL一致的统计结果
+
+        清运时间不规范的行不进入缓存统计；若其中有行会被SQL条件
+        （load_time_str BETWEEN start AND end 或 DATE(load_time_str) = day）选中，
+        缓存结果就会少计这些行，此时应改用SQL计算。
+
+        Args:
+            start: 清运时间下界（含）
+            end: 清运时间上界
+            day: 只统计的日期（YYYY-MM-DD）
+
+        Returns:
+            缓存结果是否与SQL一致
+        """
+        state = self._state
+        if state is None:
+            return False
+        if day is not None and day in state["irregular_days"]:
+            return False
+        # SQLite按UTF-8字节比较文本，与Python的字符串比较顺序一致
+        return not any(
+            (start is None or value >= start) and (end is None or value <= end)
+            for value in state["irregular_times"]
+        )
+
+    @staticmethod
+    def parse_timestamp(value: str) -> int:
+        """将日期或日期时间字符串转换为秒级时间戳"""
+        return int(pd.Timestamp(value).to_datetime64().astype("datetime64[s]").view(np.int64))
+
+    def _time_mask(self, state: Dict[str, Any], start: Optional[str],
+                   end: Optional[str]) -> np.ndarray:
+        """
+        计算与 load_time_str BETWEEN start AND end 等价的行掩码
+
+        结束值只有日期时，字符串比较会排除当天带时分秒的记录，故取严格小于。
+        """
+        timestamp = state["timestamp"]
+        mask = timestamp != MISSING_TIMESTAMP
+        if start is not None:
+            mask &= timestamp >= self.parse_timestamp(start)
+        if end is not None:
+            if len(end.strip()) <= 10:
+                mask &= timestamp < self.parse_timestamp(end)
+            else:
+                mask &= timestamp <= self.parse_timestamp(end)
+        return mask
+
+    def aggregate(self, group_by: List[str], start: Optional[str] = None,
+                  end: Optional[str] = None, day: Optional[str] = None,
+                  filters: Optional[Dict[str, Any]] = None,
+                  distinct: Optional[List[str]] = None,
+                  by_day: bool = False) -> List[Dict[str, Any]]:
+        """
+        向量化的分组统计
+
+        Args:
+            group_by: 分组字段，取自CATEGORY_COLUMNS
+            start: 清运时间下界（含），与SQL的BETWEEN语义一致
+            end: 清运时间上界，与SQL的BETWEEN语义一致
+            day: 只统计该日（YYYY-MM-DD），等价于 DATE(load_time_str) = day
+            filters: 分类字段的等值过滤条件
+            distinct: 需要统计去重数量的分类字段
+            by_day: 是否额外按清运日期分组
+
+        Returns:
+            每组一条记录：分组字段取值、day（按日分组时）、trips、total_weight
+            （全为NULL时为None）、weighed_trips、各distinct字段的去重数和max_time
+        """
+        state = self._state
+        if state is None:
+            raise RuntimeError("分析缓存尚未加载")
+        distinct = distinct or []
+
+        mask = self._time_mask(state, start, end)
+        if day is not None:
+            day_start = self.parse_timestamp(day)
+            mask &= (state["timestamp"] >= day_start) & (
+                state["timestamp"] < day_start + SECONDS_PER_DAY)
+        for column, value in (filters or {}).items():
+            code = state["categories"][column].index(value) \
+                if value in state["categories"][column] else None
+            if code is None:
+                return []
+            mask &= state["codes"][column] == code
+
+        rows = np.flatnonzero(mask)
+        if rows.size == 0:
+            return []
+
+        # 各分组字段编码组合成一个整数键（NULL编码-1平移为0）
+        key = np.zeros(rows.size, dtype=np.int64)
+        radices = []
+        for column in group_by:
+            radix = len(state["categories"][column]) + 1
+            key = key * radix + (state["codes"][column][rows] + 1)
+            radices.append(radix)
+        if by_day:
+            days = state["timestamp"][rows] // SECONDS_PER_DAY
+            day_base = int(days.min())
+            radix = int(days.max()) - day_base + 1
+            key = key * radix + (days - day_base)
+            radices.append(radix)
+
+        groups, inverse = np.unique(key, return_inverse=True)
+        weight = state["weight"][rows]
+        weighed = ~np.isnan(weight)
+        trips = np.bincount(inverse)
+        weighed_trips = np.bincount(inverse, weights=weighed)
+        total_weight = np.bincount(inverse, weights=np.where(weighed, weight, 0.0))
+        max_time = np.full(groups.size, MISSING_TIMESTAMP, dtype=np.int64)
+        np.maximum.at(max_time, inverse, state["timestamp"][rows])
+
+        distinct_counts = {}
+        for column in distinct:
+            codes = state["codes"][column][rows]
+            present = codes >= 0
+            pairs = np.unique(
+                inverse[present].astype(np.int64) * (len(state["categories"][column]) + 1)
+                + codes[present]
+            )
+            distinct_counts[column] = np.bincount(
+                pairs // (len(state["categories"][column]) + 1), minlength=groups.size
+            )
+
+        # 拆分整数键还原各分组字段
+        parts = []
+        remainder = groups
+        for radix in reversed(radices):
+            parts.append(remainder % radix)
+            remainder = remainder // radix
+        parts.reverse()
+
+        results = []
+        for i in range(groups.size):
+            entry = {}
+            for column, part in zip(group_by, parts):
+                code = int(part[i]) - 1
+                entry[column] = state["categories"][column][code] if code >= 0 else None
+            if by_day:
+                entry["day"] = str(np.datetime64((int(parts[-1][i]) + day_base), "D"))
+            entry["trips"] = int(trips[i])
+            entry["weighed_trips"] = int(weighed_trips[i])
+            entry["total_weight"] = float(total_weight[i]) if weighed_trips[i] else None
+            for column in distinct:
+                entry[f"distinct_{column}"] = int(distinct_counts[column][i])
+            entry["max_time"] = (
+                str(np.datetime64(int(max_time[i]), "s")).replace("T", " ")
+                if max_time[i] != MISSING_TIMESTAMP else None
+            )
+            results.append(entry)
+        return results
+
+    def get_status(self) -> Dict[str, Any]:
+        """返回缓存状态"""
+        state = self._state
+        if state is None:
+            return {"已加载": False}
+        return {
+            "已加载": True,
+            "缓存行数": state["rows"],
+            "最大rowid": state["max_rowid"],
+            "内存占用MB": round(state["nbytes"] / 1024 / 1024, 2),
+            "清运时间不规范行数": len(state["irregular_times"]),
+            "内存预算MB": round(self.max_memory_bytes / 1024 / 1024, 2),
+            "分类数量": {c: len(v) for c, v in state["categories"].items()}
+        }
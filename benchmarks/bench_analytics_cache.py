@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+分析缓存与SQL路径的性能对比
+
+在数据库副本上把garbage_data按倍数放大，分别用SQL和NumPy分析缓存
+执行街道清运统计与实时清运概览，输出各自耗时。
+
+用法:
+    python benchmarks/bench_analytics_cache.py --db garbage_monitoring.db --scale 64
+"""
+import argparse
+import os
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlite_operations import GarbageMonitoringDB  # noqa: E402
+
+
+def make_scaled_copy(db_path: str, scale: int) -> str:
+    """复制数据库并将garbage_data放大到原来的scale倍"""
+    copy_path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    shutil.copy(db_path, copy_path)
+    with sqlite3.connect(copy_path) as connection:
+        doublings = max(scale.bit_length() - 1, 0)
+        for _ in range(doublings):
+            connection.execute("INSERT INTO garbage_data SELECT * FROM garbage_data")
+    return copy_path
+
+
+def timeit(func, repeat: int) -> float:
+    """返回多次执行的耗时中位数（毫秒）"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="分析缓存与SQL路径的性能对比")
+    parser.add_argument("--db", default="garbage_monitoring.db", help="数据库文件路径")
+    parser.add_argument("--scale", type=int, default=64, help="garbage_data放大倍数（按2的幂取整）")
+    parser.add_argument("--repeat", type=int, default=5, help="每个用例的执行次数")
+    args = parser.parse_args()
+
+    copy_path = make_scaled_copy(args.db, args.scale)
+    db = GarbageMonitoringDB(copy_path)
+    try:
+        catalog_range = db.get_available_date_range()["数据日期范围"].get("干湿垃圾数据", {})
+        start_date = catalog_range.get("min_date") or "2025-06-10"
+        end_date = catalog_range.get("max_date") or "2025-06-20"
+        cases = {
+            "街道清运统计（全部街道）":
+                lambda: db.get_street_clearance_statistics(start_date, end_date),
+            "街道清运统计（单个街道）":
+                lambda: db.get_street_clearance_statistics(start_date, end_date, "龙华街道"),
+            "实时清运数据（含明细）":
+                lambda: db.get_realtime_clearance_data(end_date),
+        }
+
+        sql_times = {name: timeit(func, args.repeat) for name, func in cases.items()}
+
+        start = time.perf_counter()
+        status = db.enable_analytics_cache()
+        load_ms = (time.perf_counter() - start) * 1000
+        cache_times = {name: timeit(func, args.repeat) for name, func in cases.items()}
+
+        row_count = db.execute_query("SELECT COUNT(*) AS n FROM garbage_data")[0]["n"]
+        print(f"garbage_data 行数: {row_count}")
+        print(f"缓存加载耗时: {load_ms:.1f}ms，内存占用: {status.get('内存占用MB')}MB")
+        print(f"{'用例':<20}{'SQL(ms)':>10}{'缓存(ms)':>10}{'加速比':>8}")
+        for name in cases:
+            print(f"{name:<20}{sql_times[name]:>10.1f}{cache_times[name]:>10.1f}"
+                  f"{sql_times[name] / cache_times[name]:>8.1f}x")
+    finally:
+        db.close()
+        shutil.rmtree(os.path.dirname(copy_path))
+
+
+if __name__ == "__main__":
+    main()
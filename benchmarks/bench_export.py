@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+查询结果导出的耗时和内存对比
+
+1. 原路径：结果行转换为dict并经JSON序列化/反序列化（工具响应进入消息再被解析），
+   由pandas DataFrame写出CSV（智能体的save_tool_result_as_csv）
+2. GarbageMonitoringDB.export_query：分批读取游标直接写出CSV/Parquet
+
+每种路径在单独的子进程中执行，报告耗时和进程的峰值内存（ru_maxrss）。
+导出行数不足时把garbage_data与一个小表做笛卡尔积补足。
+
+用法:
+    python benchmarks/bench_export.py --db garbage_monitoring.db --rows 1000000
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+
+def build_query(db_path: str, rows: int) -> str:
+    """生成返回指定行数的查询"""
+    from sqlite_operations import GarbageMonitoringDB
+
+    db = GarbageMonitoringDB(db_path, read_only=True)
+    try:
+        table_rows = db.get_table_row_count("garbage_data")
+    finally:
+        db.close()
+    copies = max(1, -(-rows // max(table_rows, 1)))
+    multiplier = " UNION ALL ".join(f"SELECT {i} AS copy" for i in range(copies))
+    return f"SELECT g.* FROM garbage_data g CROSS JOIN ({multiplier}) LIMIT {int(rows)}"
+
+
+def run_case(db_path: str, query: str, case: str, path: str) -> dict:
+    """在当前进程中执行一种导出路径"""
+    from sqlite_operations import GarbageMonitoringDB
+
+    db = GarbageMonitoringDB(db_path, read_only=True)
+    start = time.perf_counter()
+    try:
+        if case == "pandas":
+            import pandas as pd
+
+            records = json.loads(json.dumps(db.execute_query(query), ensure_ascii=False, default=str))
+            pd.DataFrame(records).to_csv(path, index=False, encoding="utf-8-sig")
+            row_count = len(records)
+        else:
+            row_count = db.export_query(query, path, case)
+    finally:
+        db.close()
+    return {
+        "rows": row_count,
+        "seconds": time.perf_counter() - start,
+        "bytes": os.path.getsize(path),
+        # Linux上ru_maxrss以KB计
+        "peak_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="查询结果导出的耗时和内存对比")
+    parser.add_argument("--db", default="garbage_monitoring.db", help="数据库文件路径")
+    parser.add_argument("--rows", type=int, default=1000000, help="导出的行数")
+    parser.add_argument("--cases", default="pandas,csv,parquet",
+                        help="对比的路径，逗号分隔：pandas（原路径）、csv、parquet")
+    parser.add_argument("--case", help=argparse.SUPPRESS)
+    parser.add_argument("--query", help=argparse.SUPPRESS)
+    parser.add_argument("--output", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    db_path = os.path.abspath(args.db)
+
+    if args.case:
+        print(json.dumps(run_case(db_path, args.query, args.case, args.output)))
+        return
+
+    query = build_query(db_path, args.rows)
+    print(f"导出查询: {query[:80]}...")
+    print(f"{'路径':<12}{'行数':>10}{'耗时(s)':>10}{'文件MB':>10}{'峰值内存MB':>12}")
+    with tempfile.TemporaryDirectory() as directory:
+        for case in args.cases.split(","):
+            output = os.path.join(directory, f"export_{case}.{'parquet' if case == 'parquet' else 'csv'}")
+            result = subprocess.run(
+                [sys.executable, __file__, "--db", db_path, "--case", case,
+                 "--query", query, "--output", output],
+                cwd=PROJECT_ROOT, capture_output=True, text=True
+            )
+            if result.returncode != 0:
+                print(f"{case:<12}失败: {result.stderr.strip().splitlines()[-1]}")
+                continue
+            stats = json.loads(result.stdout.strip().splitlines()[-1])
+            print(f"{case:<12}{stats['rows']:>10}{stats['seconds']:>10.2f}"
+                  f"{stats['bytes'] / 1024 / 1024:>10.1f}{stats['peak_mb']:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+工具响应JSON编码路径的性能对比
+
+对 get_overdue_issues 和 execute_any_sql_query 的响应，分别测量：
+1. 当前路径：execute_query逐行转换为dict，FastMCP用pydantic_core缩进格式序列化
+2. 各注册编码器（MCP_SERVER_CONFIG["json_encoder"]可选值）的紧凑编码
+3. 自定义SQL的预编码路径：从游标直接编码结果行，响应编码时原样拼接
+
+每种路径还测量生成JSON-RPC消息（stdio/HTTP写出前的最后一次序列化）的耗时和消息大小。
+
+用法:
+    python benchmarks/bench_json_encoding.py --db garbage_monitoring.db --rows 20000
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pydantic_core  # noqa: E402
+from mcp.types import CallToolResult, TextContent  # noqa: E402
+
+import mcp_server_fast  # noqa: E402
+from sqlite_operations import GarbageMonitoringDB  # noqa: E402
+
+
+def timeit(func, repeat: int) -> float:
+    """返回多次执行的耗时中位数（毫秒）"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def to_message(text: str) -> str:
+    """生成工具调用结果的JSON-RPC消息体"""
+    return CallToolResult(content=[TextContent(type="text", text=text)]).model_dump_json(
+        by_alias=True, exclude_none=True
+    )
+
+
+def fastmcp_default(result) -> str:
+    """FastMCP对dict结果的默认处理（func_metadata._convert_to_content）"""
+    return pydantic_core.to_json(result, fallback=str, indent=2).decode()
+
+
+def encoded(result, encoder: str) -> str:
+    """编码层的处理（encoded_tool包装函数）"""
+    return mcp_server_fast.encode_json(result, encoder).decode("utf-8")
+
+
+def report(title: str, cases: dict, repeat: int):
+    """输出各路径的编码耗时、消息序列化耗时和消息大小"""
+    print(f"\n{title}")
+    print(f"{'路径':<28}{'生成+编码(ms)':>14}{'消息序列化(ms)':>16}{'消息KB':>10}")
+    baseline = None
+    for name, func in cases.items():
+        encode_ms = timeit(func, repeat)
+        text = func()
+        message_ms = timeit(lambda: to_message(text), repeat)
+        total = encode_ms + message_ms
+        baseline = baseline or total
+        print(f"{name:<28}{encode_ms:>14.1f}{message_ms:>16.1f}"
+              f"{len(to_message(text).encode()) / 1024:>10.1f}  {baseline / total:.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="工具响应JSON编码路径的性能对比")
+    parser.add_argument("--db", default="garbage_monitoring.db", help="数据库文件路径")
+    parser.add_argument("--rows", type=int, default=20000, help="自定义SQL读取的行数")
+    parser.add_argument("--repeat", type=int, default=5, help="每个用例的执行次数")
+    args = parser.parse_args()
+
+    db = GarbageMonitoringDB(args.db)
+    mcp_server_fast.db = db
+    try:
+        overdue = db.get_overdue_issues()
+        report("get_overdue_issues（结果已生成，只比较编码）", {
+            "当前路径（缩进）": lambda: fastmcp_default(overdue),
+            **{f"编码器 {name}": (lambda name=name: encoded(overdue, name))
+               for name in mcp_server_fast.JSON_ENCODERS if name != "pydantic_indent"}
+        }, args.repeat)
+
+        query = f"SELECT * FROM garbage_data LIMIT {int(args.rows)}"
+
+        def run_query(pre_encode: bool, encode):
+            mcp_server_fast.MCP_SERVER_CONFIG["pre_encode_rows"] = pre_encode
+            admission, result = mcp_server_fast.run_admitted_query(query, [])
+            return encode(mcp_server_fast.build_query_response(query, [], admission, result))
+
+        report(f"execute_any_sql_query（{query}，含查询执行）", {
+            "当前路径（dict+缩进）": lambda: run_query(False, fastmcp_default),
+            **{f"dict+编码器 {name}": (lambda name=name: run_query(False, lambda r: encoded(r, name)))
+               for name in mcp_server_fast.JSON_ENCODERS if name != "pydantic_indent"},
+            "预编码+编码器 pydantic": lambda: run_query(True, lambda r: encoded(r, "pydantic")),
+        }, args.repeat)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+MCP服务器冷启动性能测试
+
+1. 用 python -X importtime 统计导入 mcp_server_fast 的耗时，列出耗时最多的模块，
+   并检查服务路径是否导入了只在数据导入时使用的重型模块（pandas、numpy）
+2. 以stdio子进程方式启动服务器，测量完成初始化握手和首次工具调用返回的耗时
+
+超过阈值或导入了重型模块时以非0状态退出，可用于发现启动性能回退。
+
+用法:
+    python benchmarks/bench_startup.py --db garbage_monitoring.db --repeat 3 --max-import-ms 2000
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 服务路径不应导入的模块（只在导入CSV、分析缓存和近似去重时使用）
+HEAVY_MODULES = ["pandas", "numpy"]
+
+
+def measure_imports(module: str) -> dict:
+    """导入模块一次，返回总耗时、其直接导入的各模块耗时和已加载的重型模块"""
+    probe = (f"import sys, json; import {module}; "
+             f"print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))")
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", probe],
+        cwd=PROJECT_ROOT, capture_output=True, text=True, check=True
+    )
+    total_ms = 0.0
+    children, pending = {}, {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or line.count("|") != 2:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        # importtime按完成顺序输出，子模块在父模块之前，每层缩进两个空格
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 1:
+            pending[name.strip()] = int(cumulative) / 1000
+        elif depth == 0:
+            if name.strip() == module:
+                total_ms, children = int(cumulative) / 1000, pending
+            pending = {}
+    return {
+        "total_ms": total_ms,
+        "children": children,
+        "heavy": json.loads(result.stdout.strip().splitlines()[-1])
+    }
+
+
+async def measure_first_response(db_path: str, tool: str) -> dict:
+    """以stdio子进程启动服务器，返回握手和首次工具调用的耗时（毫秒）"""
+    from mcp import ClientSession, StdioServerParameters
+    from mcp.client.stdio import stdio_client
+
+    params = StdioServerParameters(
+        command=sys.executable,
+        args=[os.path.join(PROJECT_ROOT, "mcp_server_fast.py"), db_path],
+        cwd=PROJECT_ROOT
+    )
+    start = time.perf_counter()
+    async with stdio_client(params) as (read, write):
+        async with ClientSession(read, write) as session:
+            await session.initialize()
+            initialized = time.perf_counter()
+            result = await session.call_tool(tool, {})
+            responded = time.perf_counter()
+    if result.isError:
+        raise RuntimeError(f"工具 {tool} 调用失败: {result.content}")
+    return {
+        "initialize_ms": (initialized - start) * 1000,
+        "first_response_ms": (responded - start) * 1000
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MCP服务器冷启动性能测试")
+    parser.add_argument("--db", default="garbage_monitoring.db", help="数据库文件路径")
+    parser.add_argument("--repeat", type=int, default=3, help="每项测量的次数")
+    parser.add_argument("--tool", default="get_available_date_range", help="首次调用的工具")
+    parser.add_argument("--max-import-ms", type=float, default=None,
+                        help="导入mcp_server_fast耗时中位数的上限，超过时以非0状态退出")
+    parser.add_argument("--max-first-response-ms", type=float, default=None,
+                        help="启动到首次工具响应耗时中位数的上限，超过时以非0状态退出")
+    args = parser.parse_args()
+    db_path = os.path.abspath(args.db)
+
+    failures = []
+    for module in ["sqlite_operations", "mcp_server_fast"]:
+        samples = [measure_imports(module) for _ in range(args.repeat)]
+        total = statistics.median(s["total_ms"] for s in samples)
+        print(f"导入 {module}: {total:.1f}ms（中位数，{args.repeat}次）")
+        slowest = sorted(samples[-1]["children"].items(), key=lambda x: -x[1])[:8]
+        for name, ms in slowest:
+            print(f"    {name:<40}{ms:>10.1f}ms")
+        heavy = samples[-1]["heavy"]
+        if heavy:
+            failures.append(f"导入 {module} 时加载了重型模块: {heavy}")
+        if module == "mcp_server_fast" and args.max_import_ms and total > args.max_import_ms:
+            failures.append(f"导入 {module} 耗时 {total:.1f}ms，超过上限 {args.max_import_ms}ms")
+
+    runs = [asyncio.run(measure_first_response(db_path, args.tool)) for _ in range(args.repeat)]
+    initialize_ms = statistics.median(r["initialize_ms"] for r in runs)
+    first_response_ms = statistics.median(r["first_response_ms"] for r in runs)
+    print(f"启动到完成握手: {initialize_ms:.1f}ms")
+    print(f"启动到首次工具响应（{args.tool}）: {first_response_ms:.1f}ms")
+    if args.max_first_response_ms and first_response_ms > args.max_first_response_ms:
+        failures.append(f"首次工具响应耗时 {first_response_ms:.1f}ms，"
+                        f"超过上限 {args.max_first_response_ms}ms")
+
+    for failure in failures:
+        print(f"✗ {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
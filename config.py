@@ -9,14 +9,227 @@ DATABASE_CONFIG = {
     "default_db_path": "garbage_monitoring.db",
     "test_db_path": "test_garbage_monitoring.db",
     "connection_timeout": 30,
-    "check_same_thread": False
+    "check_same_thread": False,
+    # 存储I/O配置档，取值为STORAGE_PROFILES的键
+    "storage_profile": "small_vm"
+}
+
+# 存储I/O配置档：每个连接建立时设置的PRAGMA
+# cache_size为负数时单位为KiB；page_size只在新建数据库和VACUUM前设置，已有数据库需VACUUM后才会改变
+STORAGE_PROFILES = {
+    # 小内存虚拟机：适度的内存映射和页缓存，临时B树落盘
+    "small_vm": {
+        "mmap_size": 256 * 1024 * 1024,
+        "cache_size": -16 * 1024,
+        "temp_store": "FILE",
+        "page_size": 4096
+    },
+    # 大内存服务器：整库内存映射，较大的页缓存，临时B树放在内存中
+    "large_box": {
+        "mmap_size": 2 * 1024 * 1024 * 1024,
+        "cache_size": -256 * 1024,
+        "temp_store": "MEMORY",
+        "page_size": 8192
+    }
+}
+
+# 查询超时配置（单位：秒）
+QUERY_TIMEOUT_CONFIG = {
+    # 未单独配置的工具使用的默认超时
+    "default_timeout": 30,
+    # SQLite每执行多少条虚拟机指令检查一次截止时间和取消标记
+    "progress_handler_steps": 1000,
+    # 各MCP工具的超时设置
+    "tool_timeouts": {
+        "get_realtime_clearance_data": 15,
+        "get_street_clearance_statistics": 20,
+        "get_overdue_issues": 20,
+        "get_decoration_appointments_data": 15,
+        "get_order_status_details": 15,
+        "check_data_quality": 60,
+        "get_available_date_range": 10,
+        "time_series": 10,
+        "top_k": 10,
+        "clearance_anomalies": 10,
+        "execute_any_sql_query": 10,
+        "execute_sql_batch": 20,
+        # 导出整个结果集，耗时随行数线性增长
+        "export_query": 300,
+        "get_slow_queries": 10,
+        "get_storage_diagnostics": 10
+    }
+}
+
+# 慢查询日志配置
+SLOW_QUERY_CONFIG = {
+    # 耗时超过该阈值（毫秒）的查询会连同EXPLAIN QUERY PLAN一起记录
+    "threshold_ms": 500,
+    "log_file": "slow_queries.log",
+    # 单个日志文件上限和保留的滚动文件数
+    "max_bytes": 5 * 1024 * 1024,
+    "backup_count": 3
+}
+
+# 自定义SQL准入控制配置，代价单位为估算访问的行数
+ADMISSION_CONTROL_CONFIG = {
+    "enabled": True,
+    # 超过该代价的查询直接拒绝
+    "max_cost": 10_000_000,
+    # 超过该代价的查询降级执行：限制返回行数并缩短超时
+    "downgrade_cost": 1_000_000,
+    "downgrade_max_rows": 1000,
+    "downgrade_timeout": 5
+}
+
+# 批量查询配置
+BATCH_QUERY_CONFIG = {
+    # execute_sql_batch单次最多执行的语句数
+    "max_statements": 10
+}
+
+# 结果摘要配置：response_mode="summary"时只返回字段统计、总行数和代表性样本
+RESULT_SUMMARY_CONFIG = {
+    # 代表性样本的行数（蓄水池抽样）
+    "sample_size": 20,
+    # 每个字段返回的高频取值个数
+    "top_values": 5,
+    # 每个字段最多记录的取值种类，超过后去重数为下限，内存不随结果行数增长
+    "max_tracked_values": 10000,
+    # 遍历游标时每批读取的行数
+    "fetch_batch_size": 5000,
+    # 抽样的随机种子，相同结果得到相同样本
+    "sample_seed": 0
+}
+
+# 服务端结果句柄配置：大结果保存在服务器进程内存中，只返回句柄和预览
+RESULT_HANDLE_CONFIG = {
+    "enabled": True,
+    # 结果行数超过该值时保存为句柄，不在响应中返回全部结果行
+    "min_rows": 200,
+    # 响应中附带的预览行数
+    "preview_rows": 20,
+    # 句柄有效期（秒），每次读取或导出时顺延
+    "ttl_seconds": 1800,
+    # 最多保存的结果个数和结果总行数，超过时淘汰最久未使用的结果
+    "max_results": 20,
+    "max_total_rows": 2000000,
+    # fetch_result单次最多返回的行数
+    "max_fetch_rows": 1000
+}
+
+# 结果文件导出配置
+EXPORT_CONFIG = {
+    # 导出目录，相对路径相对于项目根目录；导出路径不能超出该目录
+    "directory": "outputs",
+    # 每批写入的行数（Parquet每批一个row group），内存占用与结果总行数无关
+    "batch_size": 10000
+}
+
+# 数据质量画像配置
+DATA_QUALITY_CONFIG = {
+    # 扫描表时每批读取的行数
+    "fetch_batch_size": 5000,
+    # 唯一值数量估计所用HyperLogLog的精度，相对标准误差约 1.04/sqrt(2^precision)，14对应约0.8%
+    "hll_precision": 14,
+    # 判断取值是否重复出现的Bloom过滤器位数（每个字段 bits/8 字节），
+    # 取值种类超过约 bits/10 后重复值开始明显高估
+    "bloom_bits": 1 << 23
+}
+
+# 分析缓存配置：将garbage_data加载为NumPy列，分组统计走向量化计算
+ANALYTICS_CACHE_CONFIG = {
+    # 是否在启动时加载缓存，未启用时统计查询全部走SQL
+    "enabled": False,
+    # 缓存数据的内存预算（MB），超出时放弃缓存并回退到SQL
+    "max_memory_mb": 256,
+    # 加载时每批读取的行数
+    "fetch_batch_size": 50000
+}
+
+# 近似去重计数配置：按(日期, 街道, 垃圾类型)预先计算HyperLogLog草图
+DISTINCT_SKETCH_CONFIG = {
+    # 寄存器数量为2^precision，相对标准误差约 1.04/sqrt(2^precision)，11对应约2.3%
+    "precision": 11
+}
+
+# Top-K排行配置
+TOP_K_CONFIG = {
+    # 按日计数中每个(细分值, 日期)最多保留的对象数（按事件数和度量合计各取前N个），
+    # 被截断的日期记录截断阈值，跨日期排行据此给出误差上限；全部汇总不截断
+    "daily_capacity": 500
+}
+
+# 小区日清运量异常检测配置（EWMA滚动均值/方差）
+ANOMALY_CONFIG = {
+    # 平滑系数，越大越看重近期数据
+    "alpha": 0.3,
+    # 偏离度|z|超过该值判定为异常
+    "z_threshold": 3.0,
+    # 观测天数少于该值的小区不参与判定
+    "min_periods": 5,
+    # 标准差下限（相对均值的比例），避免方差接近0时偏离度失真
+    "min_relative_std": 0.1
+}
+
+# 按月分区存储配置：事件表按时间字段拆分到每月一个SQLite文件，查询时按需ATTACH
+PARTITION_CONFIG = {
+    # 是否启用分区存储，未启用时所有数据保存在主库中
+    "enabled": False,
+    # 分区文件目录（相对于主库所在目录），文件名为 YYYY-MM.db，无法解析时间的行存入 undated.db
+    "directory": "partitions",
+    # 最近若干个月各自保存为一个分区文件，更早的月份合并到 history.db；
+    # SQLite同时最多ATTACH 10个数据库，还需留出历史库、undated和导入时写入用的位置，超出时按上限计
+    "recent_months": 6,
+    # 参与分区的表
+    "tables": [
+        "garbage_data",
+        "small_package_garbage",
+        "garbage_bin_overflow",
+        "decoration_garbage_old",
+        "decoration_garbage_new"
+    ]
+}
+
+# 冷数据归档配置：已结束且超过一定时间的记录移入压缩归档库
+ARCHIVE_CONFIG = {
+    # 归档库文件（相对于主库所在目录）
+    "path": "garbage_archive.db",
+    # 发生时间早于多少天的已结束记录参与归档
+    "min_age_days": 90,
+    # 每个压缩块包含的行数
+    "chunk_rows": 5000,
+    # zlib压缩级别（1~9）
+    "compression_level": 6,
+    # 归档后是否VACUUM主库以回收空间
+    "vacuum": True
+}
+
+# 内存服务配置：启动时用backup API把数据库复制到共享内存库，所有读取走内存
+MEMORY_SERVING_CONFIG = {
+    # 是否启用，也可通过 GarbageMonitoringDB(serve_from_memory=True) 或服务器的 --memory 参数开启
+    "enabled": False,
+    # 检查磁盘库是否被其他进程更新的最小间隔（秒），有更新时重新做快照
+    "check_interval_seconds": 5
 }
 
 # MCP Server配置
 MCP_SERVER_CONFIG = {
     "server_name": "garbage-monitoring",
     "stdio_enabled": True,
-    "log_level": "INFO"
+    "log_level": "INFO",
+    # 传输方式：stdio（每个智能体进程各自启动服务器）、streamable-http或sse（多个智能体进程共享一个常驻服务器）
+    "transport": "stdio",
+    # 网络传输时监听的地址和端口，默认只监听本机
+    "host": "127.0.0.1",
+    "port": 8000,
+    # 只读工作进程数：大于0时工具调用分发到各自持有只读连接的子进程执行，
+    # 查询和结果转换不受单进程GIL限制；0表示在服务器进程的线程中执行
+    "workers": 0,
+    # 工具响应的JSON编码器（见mcp_server_fast.JSON_ENCODERS，可用register_json_encoder注册），
+    # pydantic_indent为FastMCP默认的缩进格式
+    "json_encoder": "pydantic",
+    # 自定义SQL的结果行从游标直接编码为JSON文本，不再转换为dict列表后整体序列化
+    "pre_encode_rows": True
 }
 
 # 数据表映射
@@ -33,15 +246,25 @@ FUNCTION_DESCRIPTIONS = {
     "生活垃圾监管": {
         "get_realtime_clearance_data": "展示全区清运实时数据",
         "get_street_clearance_statistics": "筛选查询各街道清运数量",
-        "get_overdue_issues": "整治逾期混运等问题"
+        "get_overdue_issues": "整治逾期混运等问题",
+        "clearance_anomalies": "识别日清运量骤降/骤增的小区"
     },
     "装修垃圾监管": {
         "get_decoration_appointments_data": "接入新旧模式预约数据",
         "get_order_status_details": "查看各状态工单详情"
     },
+    "统计分析": {
+        "time_series": "按小时/天/周/月统计事件时间序列",
+        "top_k": "查询事件数或度量最高的K个对象"
+    },
     "辅助功能": {
         "check_data_quality": "检查数据质量",
-        "get_available_date_range": "获取可用的数据日期范围"
+        "get_available_date_range": "获取可用的数据日期范围",
+        "fetch_result": "分页读取服务端保存的大结果",
+        "export_result": "把服务端保存的大结果导出为CSV/Parquet文件",
+        "export_query": "把查询结果直接流式导出为CSV/Parquet文件",
+        "get_slow_queries": "查看慢查询排行及执行计划",
+        "get_storage_diagnostics": "查看存储I/O配置档及实际生效的PRAGMA"
     }
 }
 
@@ -93,6 +316,20 @@ def get_db_path(test_mode: bool = False) -> str:
         return DATABASE_CONFIG["test_db_path"]
     return DATABASE_CONFIG["default_db_path"]
 
+def get_query_timeout(tool_name: str) -> float:
+    """
+    获取MCP工具的查询超时时间
+    
+    Args:
+        tool_name: 工具名称
+        
+    Returns:
+        超时秒数
+    """
+    return QUERY_TIMEOUT_CONFIG["tool_timeouts"].get(
+        tool_name, QUERY_TIMEOUT_CONFIG["default_timeout"]
+    )
+
 def get_table_display_name(table_name: str) -> str:
     """
     获取表格的中文显示名称
@@ -0,0 +1,162 @@
+"""
+HyperLogLog基数估计和Bloom过滤器
+用于按天预先计算、跨天合并的近似去重计数，以及内存固定的数据画像
+"""
+import hashlib
+import math
+from typing import Any, Iterable, Optional
+
+import numpy as np
+
+
+class HyperLogLog:
+    """
+    HyperLogLog去重计数草图
+
+    2^precision个寄存器，每个寄存器保存哈希值前导零个数的最大值。
+    同精度的草图可通过逐寄存器取最大值合并，合并结果等价于对并集建草图。
+    相对标准误差约为 1.04 / sqrt(2^precision)。
+    """
+
+    def __init__(self, precision: int = 11, registers: Optional[np.ndarray] = None):
+        """
+        初始化草图
+
+        Args:
+            precision: 精度，寄存器数量为2^precision，取值4~16
+            registers: 已有的寄存器数组，为None时创建空草图
+        """
+        if not 4 <= precision <= 16:
+            raise ValueError(f"HyperLogLog精度应在4到16之间: {precision}")
+        self.precision = precision
+        self.size = 1 << precision
+        if registers is None:
+            registers = np.zeros(self.size, dtype=np.uint8)
+        elif registers.size != self.size:
+            raise ValueError(f"寄存器数量 {registers.size} 与精度 {precision} 不匹配")
+        self.registers = registers
+
+    @staticmethod
+    def hash_value(value: Any) -> int:
+        """计算取值的64位哈希，与进程和Python版本无关"""
+        digest = hashlib.blake2b(str(value).encode("utf-8"), digest_size=8).digest()
+        return int.from_bytes(digest, "big")
+
+    def add(self, value: Any):
+        """加入一个取值"""
+        self.add_hash(self.hash_value(value))
+
+    def add_hash(self, hashed: int):
+        """加入一个已计算好的64位哈希"""
+        index = hashed >> (64 - self.precision)
+        remaining_bits = 64 - self.precision
+        remainder = hashed & ((1 << remaining_bits) - 1)
+        rank = remaining_bits - remainder.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def add_hashes(self, hashes: np.ndarray):
+        """
+        批量加入已计算好的64位哈希
+
+        与add_hash等价，按数组向量化计算。哈希函数可以与hash_value不同，
+        但同一草图（及与之合并的草图）须使用同一种哈希。
+
+        Args:
+            hashes: uint64哈希数组
+        """
+        remaining_bits = 64 - self.precision
+        index = (hashes >> np.uint64(remaining_bits)).astype(np.intp)
+        remainder = hashes & np.uint64((1 << remaining_bits) - 1)
+        # 高低32位分别转为float64（精确表示），由frexp的指数得到bit_length
+        high = np.frexp((remainder >> np.uint64(32)).astype(np.float64))[1]
+        low = np.frexp((remainder & np.uint64(0xFFFFFFFF)).astype(np.float64))[1]
+        bit_length = np.where(high > 0, high + 32, low)
+        rank = (remaining_bits - bit_length + 1).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+
+    def update(self, values: Iterable[Any]):
+        """加入多个取值"""
+        for value in values:
+            self.add(value)
+
+    def merge(self, other: "HyperLogLog"):
+        """合并另一个同精度草图（原地）"""
+        if other.precision != self.precision:
+            raise ValueError("只能合并相同精度的HyperLogLog草图")
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def count(self) -> int:
+        """估计去重数量"""
+        m = self.size
+        if m >= 128:
+            alpha = 0.7213 / (1 + 1.079 / m)
+        else:
+            alpha = {16: 0.673, 32: 0.697, 64: 0.709}[m]
+        estimate = alpha * m * m / float(np.sum(np.ldexp(1.0, -self.registers.astype(np.int32))))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        # 小基数时用线性计数修正
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    @property
+    def standard_error(self) -> float:
+        """相对标准误差"""
+        return 1.04 / math.sqrt(self.size)
+
+    def to_bytes(self) -> bytes:
+        """序列化为字节串，便于存入BLOB字段"""
+        return self.registers.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data: bytes, precision: int) -> "HyperLogLog":
+        """从to_bytes的结果恢复草图"""
+        return cls(precision, np.frombuffer(data, dtype=np.uint8).copy())
+
+
+class BloomFilter:
+    """
+    Bloom过滤器
+
+    判断取值是否出现过：判断为未出现时一定未出现，判断为出现过时有一定的误判概率，
+    加入的取值种类接近位数的1/10时误判率约1%，之后随种类增多而上升。
+    位数组大小固定，内存不随加入的取值数增长。
+    """
+
+    def __init__(self, bits: int = 1 << 23, hash_count: int = 3):
+        """
+        初始化过滤器
+
+        Args:
+            bits: 位数组的位数
+            hash_count: 每个取值设置的位数
+        """
+        self.bits = bits
+        self.hash_count = hash_count
+        self.array = np.zeros((bits + 7) // 8, dtype=np.uint8)
+
+    def _positions(self, hashes: np.ndarray) -> np.ndarray:
+        """由64位哈希的高低32位做双重哈希，得到每个取值的hash_count个位置"""
+        low = (hashes & np.uint64(0xFFFFFFFF)).astype(np.int64)
+        high = (hashes >> np.uint64(32)).astype(np.int64) | 1
+        return np.stack([(low + i * high) % self.bits for i in range(self.hash_count)])
+
+    def contains_hashes(self, hashes: np.ndarray) -> np.ndarray:
+        """
+        批量判断取值是否出现过
+
+        Args:
+            hashes: uint64哈希数组
+
+        Returns:
+            与hashes等长的布尔数组
+        """
+        positions = self._positions(hashes)
+        bits = (self.array[positions >> 3] >> (positions & 7).astype(np.uint8)) & 1
+        return bits.all(axis=0).astype(bool)
+
+    def add_hashes(self, hashes: np.ndarray):
+        """批量加入已计算好的64位哈希"""
+        positions = self._positions(hashes).ravel()
+        np.bitwise_or.at(self.array, positions >> 3, (1 << (positions & 7)).astype(np.uint8))
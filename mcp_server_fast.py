@@ -3,11 +3,35 @@
 垃圾监管系统 FastMCP Server
 使用FastMCP框架简化MCP Server实现，提供生活垃圾和装修垃圾监管功能
 """
+import asyncio
+import functools
+import json
 import logging
-from typing import Optional
+import multiprocessing
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
 
+import anyio
+import pydantic_core
 from mcp.server.fastmcp import FastMCP
-from sqlite_operations import GarbageMonitoringDB
+from mcp.types import TextContent
+
+from config import (
+    ADMISSION_CONTROL_CONFIG,
+    BATCH_QUERY_CONFIG,
+    EXPORT_CONFIG,
+    MCP_SERVER_CONFIG,
+    RESULT_HANDLE_CONFIG,
+    STORAGE_PROFILES,
+    get_query_timeout,
+)
+from result_export import EXPORT_FORMATS, resolve_export_path, write_rows
+from sqlite_operations import GarbageMonitoringDB, QueryTimeoutError
 
 # 配置日志
 logging.basicConfig(
@@ -19,38 +43,318 @@ logger = logging.getLogger(__name__)
 # 创建FastMCP应用实例
 mcp = FastMCP("garbage-monitoring")
 
-# 全局数据库实例
+class PreEncodedJSON:
+    """已编码好的结果行（如从游标直接编码的JSON文本），编码响应时拼接为JSON数组原样写入"""
+    
+    def __init__(self, rows: List[str], columns: Optional[List[str]] = None):
+        """
+        Args:
+            rows: 每行一个JSON对象文本
+            columns: 结果列名
+        """
+        self.rows = rows
+        self.columns = columns
+    
+    def __len__(self) -> int:
+        return len(self.rows)
+    
+    def __getitem__(self, index: slice) -> "PreEncodedJSON":
+        return PreEncodedJSON(self.rows[index], self.columns)
+    
+    @property
+    def data(self) -> bytes:
+        """UTF-8编码的JSON数组"""
+        return ("[" + ",".join(self.rows) + "]").encode("utf-8")
+    
+    def to_python(self) -> Any:
+        """解码为Python对象"""
+        return json.loads(self.data)
+
+# JSON编码器：(对象, 无法识别类型时的回调) -> UTF-8编码的JSON
+JSON_ENCODERS: Dict[str, Callable[[Any, Callable[[Any], Any]], bytes]] = {
+    # pydantic_core的Rust实现，紧凑输出
+    "pydantic": lambda obj, default: pydantic_core.to_json(obj, fallback=default),
+    # FastMCP默认的缩进格式，体积更大，便于人工查看
+    "pydantic_indent": lambda obj, default: pydantic_core.to_json(obj, fallback=default, indent=2),
+    "json": lambda obj, default: json.dumps(
+        obj, ensure_ascii=False, separators=(",", ":"), default=default
+    ).encode("utf-8"),
+}
+
+def register_json_encoder(name: str, encoder: Callable[[Any, Callable[[Any], Any]], bytes]):
+    """
+    注册JSON编码器，之后可在MCP_SERVER_CONFIG["json_encoder"]中选用
+    
+    Args:
+        name: 编码器名称
+        encoder: 接收(对象, default回调)并返回UTF-8编码JSON的函数；
+                 遇到无法识别的类型时须调用default回调并编码其返回值
+    """
+    JSON_ENCODERS[name] = encoder
+
+def encode_json(result: Any, encoder: Optional[str] = None) -> bytes:
+    """
+    把工具结果编码为UTF-8 JSON，PreEncodedJSON片段原样拼接
+    
+    片段先由编码器的default回调替换为唯一占位字符串，编码后在结果中
+    定位占位符并拼接片段，片段内容不经过解码和重新编码。
+    
+    Args:
+        result: 工具返回的结果
+        encoder: 编码器名称，默认取MCP_SERVER_CONFIG["json_encoder"]
+        
+    Returns:
+        UTF-8编码的JSON
+    """
+    fragments: List[bytes] = []
+    nonce = secrets.token_hex(8)
+    
+    def default(value: Any) -> Any:
+        if isinstance(value, PreEncodedJSON):
+            fragments.append(value.data)
+            return f"@@pre-encoded:{nonce}:{len(fragments) - 1}@@"
+        return str(value)
+    
+    encoded = JSON_ENCODERS[encoder or MCP_SERVER_CONFIG["json_encoder"]](result, default)
+    if not fragments:
+        return encoded
+    
+    # 编码器按遍历顺序调用default，占位符在输出中依次出现
+    view = memoryview(encoded)
+    parts = []
+    position = 0
+    for index, fragment in enumerate(fragments):
+        marker = f'"@@pre-encoded:{nonce}:{index}@@"'.encode()
+        found = encoded.index(marker, position)
+        parts += [view[position:found], fragment]
+        position = found + len(marker)
+    parts.append(view[position:])
+    return b"".join(parts)
+
+def encoded_tool(*args, **kwargs) -> Callable:
+    """
+    注册MCP工具，工具返回的dict经encode_json编码为紧凑JSON文本
+    
+    模块中的工具函数本身不变，仍返回dict，可直接调用；注册到FastMCP的是包装后的函数，
+    返回TextContent，FastMCP不再用缩进格式重新序列化。参数与mcp.tool()相同。
+    """
+    def decorator(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        async def encoded(*fn_args, **fn_kwargs):
+            data = encode_json(await fn(*fn_args, **fn_kwargs))
+            return TextContent(type="text", text=data.decode("utf-8"))
+        mcp.tool(*args, **kwargs)(encoded)
+        return fn
+    return decorator
+
+# 全局数据库实例，首次工具调用时才建立连接，服务启动时不做数据库相关工作
 db = None
+# 数据库路径和启动选项，由main或create_app记录
+db_options: Dict[str, Any] = {"db_path": "garbage_monitoring.db"}
+_db_init_lock = threading.Lock()
+# 只读工作进程池，未启用时工具调用在本进程的工作线程中执行
+worker_pool: Optional[ProcessPoolExecutor] = None
 
-def initialize_database_instance(db_path: str = "garbage_monitoring.db"):
-    """初始化数据库连接"""
+def configure_database_instance(db_path: str = "garbage_monitoring.db",
+                                serve_from_memory: Optional[bool] = None,
+                                storage_profile: Optional[str] = None):
+    """
+    记录数据库路径和启动选项，连接推迟到首次工具调用时建立
+    
+    Args:
+        db_path: 数据库文件路径
+        serve_from_memory: 是否把数据库复制到内存中提供查询，默认取MEMORY_SERVING_CONFIG的设置
+        storage_profile: 存储I/O配置档名称，默认取DATABASE_CONFIG["storage_profile"]
+    """
+    db_options.update(db_path=db_path, serve_from_memory=serve_from_memory,
+                      storage_profile=storage_profile)
+
+def initialize_database_instance(db_path: Optional[str] = None,
+                                 serve_from_memory: Optional[bool] = None,
+                                 storage_profile: Optional[str] = None) -> GarbageMonitoringDB:
+    """
+    初始化数据库连接，已初始化时直接返回
+    
+    Args:
+        db_path: 数据库文件路径，为None时使用configure_database_instance记录的设置
+        serve_from_memory: 是否把数据库复制到内存中提供查询
+        storage_profile: 存储I/O配置档名称
+        
+    Returns:
+        全局数据库实例
+    """
     global db
-    if db is None:
-        db = GarbageMonitoringDB(db_path)
-        logger.info(f"数据库初始化完成: {db_path}")
+    with _db_init_lock:
+        if db is None:
+            if db_path is not None:
+                configure_database_instance(db_path, serve_from_memory, storage_profile)
+            db = GarbageMonitoringDB(
+                db_options["db_path"],
+                serve_from_memory=db_options.get("serve_from_memory"),
+                storage_profile=db_options.get("storage_profile")
+            )
+            logger.info(f"数据库初始化完成: {db_options['db_path']}")
+    return db
+
+def call_db_method(name: str, *args, **kwargs) -> Any:
+    """调用全局db的指定方法，在执行调用的进程中解析db"""
+    return getattr(db, name)(*args, **kwargs)
+
+def db_method(name: str, *args, **kwargs) -> functools.partial:
+    """
+    构造对全局db方法的调用，可序列化后发送到只读工作进程执行
+    
+    Args:
+        name: GarbageMonitoringDB的方法名
+        *args: 位置参数
+        **kwargs: 关键字参数
+        
+    Returns:
+        无参可调用对象，供run_db_call执行
+    """
+    return functools.partial(call_db_method, name, *args, **kwargs)
+
+# 结果返回方式：full返回全部结果行，summary只返回字段统计、总行数和代表性样本
+RESPONSE_MODES = ("full", "summary")
+
+def check_response_mode(response_mode: str):
+    """检查结果返回方式是否有效"""
+    if response_mode not in RESPONSE_MODES:
+        raise ValueError(f"未知的返回方式: {response_mode}，可选值: {'、'.join(RESPONSE_MODES)}")
+
+def _exit_with_parent():
+    """等待服务器进程退出后结束当前工作进程"""
+    multiprocessing.parent_process().join()
+    os._exit(0)
+
+def _init_worker(options: Dict[str, Any]):
+    """工作进程初始化：以只读方式打开同一个数据库，之后的调用都使用该连接"""
+    global db
+    # stdio传输时标准输出是协议通道，工作进程既不能写入也不能持有它（否则客户端等不到EOF）
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    os.close(devnull)
+    # 服务器进程被直接终止（如stdio客户端退出时发送SIGTERM）时随之退出，不留下孤儿进程
+    threading.Thread(target=_exit_with_parent, daemon=True).start()
+    db = GarbageMonitoringDB(
+        options["db_path"],
+        serve_from_memory=options.get("serve_from_memory"),
+        storage_profile=options.get("storage_profile"),
+        read_only=True
+    )
+
+def _worker_ready() -> bool:
+    """空调用，用于预先启动工作进程"""
+    return db is not None
+
+def _run_in_worker(tool_name: str, func: Callable[[], Any]) -> Any:
+    """在工作进程中施加该工具的截止时间并执行调用"""
+    with db.query_deadline(get_query_timeout(tool_name)):
+        return func()
+
+def start_worker_pool(processes: int) -> ProcessPoolExecutor:
+    """
+    启动只读工作进程池，之后的工具调用分发到各进程执行
+    
+    各进程持有自己的只读连接，查询、dict(row)转换等CPU密集工作不再受本进程GIL限制，
+    结果以pickle返回。启动前先在本进程完成数据库初始化，并补齐查询时会按需写入的
+    元数据（目录、画像、Top-K计数、滚动统计等），工作进程只做读取。
+    
+    Args:
+        processes: 工作进程数
+        
+    Returns:
+        进程池
+    """
+    global worker_pool
+    initialize_database_instance().fill_missing_metadata()
+    # 服务器进程中已有事件循环和线程，用spawn启动干净的子进程
+    worker_pool = ProcessPoolExecutor(
+        processes,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(dict(db_options),)
+    )
+    # 预先启动全部工作进程，首个请求不承担进程启动和模块导入的耗时
+    for future in [worker_pool.submit(_worker_ready) for _ in range(processes)]:
+        future.result()
+    logger.info(f"只读工作进程池已启动，进程数: {processes}")
+    return worker_pool
 
-@mcp.tool()
-def get_realtime_clearance_data(date: Optional[str] = None) -> dict:
+def stop_worker_pool():
+    """关闭只读工作进程池"""
+    global worker_pool
+    if worker_pool is not None:
+        worker_pool.shutdown(cancel_futures=True)
+        worker_pool = None
+
+async def run_db_call(tool_name: str, func: Callable[[], Any], writes: bool = False) -> Any:
+    """
+    在工作线程或只读工作进程中执行数据库调用，并施加该工具的截止时间
+    
+    客户端取消请求或断开连接时，会设置取消标记，
+    正在执行的SQL由SQLite进度回调中止，不再占用服务器。
+    启用工作进程池时，尚未开始的调用直接撤销，已在执行的调用不能被取消中断，只由截止时间限制。
+    
+    Args:
+        tool_name: 工具名称，用于读取config中的超时设置
+        func: 无参可调用对象，在其中访问全局db执行查询；
+              启用工作进程池时须可序列化（用db_method或模块级函数的functools.partial构造）
+        writes: 调用是否写入数据库；写入的调用总在本进程的可写连接上执行，不分发到只读工作进程
+        
+    Returns:
+        func的返回值
+    """
+    timeout = get_query_timeout(tool_name)
+    
+    if worker_pool is not None and not writes:
+        future = worker_pool.submit(_run_in_worker, tool_name, func)
+        try:
+            return await asyncio.wrap_future(future)
+        except anyio.get_cancelled_exc_class():
+            future.cancel()
+            logger.warning(f"工具 {tool_name} 的请求已被客户端取消")
+            raise
+    
+    cancel_event = threading.Event()
+    
+    def call():
+        # 首次调用时在工作线程中建立连接，不阻塞事件循环
+        initialize_database_instance()
+        with db.query_deadline(timeout, cancel_event):
+            return func()
+    
+    try:
+        return await anyio.to_thread.run_sync(call, abandon_on_cancel=True)
+    except anyio.get_cancelled_exc_class():
+        cancel_event.set()
+        logger.warning(f"工具 {tool_name} 的请求已被客户端取消，正在中止查询")
+        raise
+
+@encoded_tool()
+async def get_realtime_clearance_data(date: Optional[str] = None, approximate: bool = False) -> dict:
     """
     展示全区清运实时数据
     
     Args:
         date: 查询日期 (YYYY-MM-DD格式)，默认为今天
+        approximate: 参与车辆数是否用HyperLogLog草图近似计算（相对标准误差约2%），默认精确
         
     Returns:
         包含清运概览和明细的数据
     """
-    if db is None:
-        initialize_database_instance()
-    
     logger.info(f"查询实时清运数据，日期: {date or '今天'}")
-    return db.get_realtime_clearance_data(date)
+    return await run_db_call(
+        "get_realtime_clearance_data", db_method("get_realtime_clearance_data", date, approximate)
+    )
 
-@mcp.tool()
-def get_street_clearance_statistics(
+@encoded_tool()
+async def get_street_clearance_statistics(
     start_date: str, 
     end_date: str, 
-    street_name: Optional[str] = None
+    street_name: Optional[str] = None,
+    dimensions: Optional[List[str]] = None,
+    approximate: bool = False
 ) -> dict:
     """
     筛选查询各街道清运数量
@@ -59,32 +363,75 @@ def get_street_clearance_statistics(
         start_date: 开始日期 (YYYY-MM-DD)
         end_date: 结束日期 (YYYY-MM-DD)
         street_name: 指定街道名称，可选
+        dimensions: 附加统计维度，可选，取值 community_type_name（小区类型）、car_group_name（车队）
+        approximate: 是否由预计算的小时桶和按日HyperLogLog草图合并得到结果，不扫描明细，
+                     涉及小区数为近似值（相对标准误差约2%），适合跨度较长的查询；
+                     指定dimensions时仍精确计算
         
     Returns:
         街道清运统计数据
     """
-    if db is None:
-        initialize_database_instance()
-    
     logger.info(f"查询街道清运统计，时间段: {start_date} 至 {end_date}，街道: {street_name or '全部'}")
-    return db.get_street_clearance_statistics(start_date, end_date, street_name)
+    return await run_db_call(
+        "get_street_clearance_statistics",
+        db_method("get_street_clearance_statistics",
+                  start_date, end_date, street_name, dimensions, approximate)
+    )
 
-@mcp.tool()
-def get_overdue_issues() -> dict:
+@encoded_tool()
+async def get_overdue_issues(as_of: Optional[str] = None, response_mode: str = "full") -> dict:
     """
     整治逾期混运等问题
     
+    Args:
+        as_of: 统计截至时间 (YYYY-MM-DD 或 YYYY-MM-DD HH:MM:SS)，只有日期时取当天结束，默认为当前时间；
+               按该时间判断事件是否已处置并计算处置耗时，相同as_of的结果一致
+        response_mode: full返回全部问题详情；summary把各类问题详情替换为摘要
+                       （字段统计、高频取值和少量代表性样本），问题很多时使用
+        
     Returns:
         包含小包垃圾超时和垃圾桶满溢超时问题的数据
     """
-    if db is None:
-        initialize_database_instance()
+    check_response_mode(response_mode)
+    logger.info(f"查询逾期混运问题，截至: {as_of or '当前时间'}，返回方式: {response_mode}")
+    if response_mode == "summary":
+        return await run_db_call(
+            "get_overdue_issues", functools.partial(summarize_overdue_issues, as_of)
+        )
+    return await run_db_call(
+        "get_overdue_issues", db_method("get_overdue_issues", as_of)
+    )
+
+def summarize_overdue_issues(as_of: Optional[str]) -> dict:
+    """查询逾期问题，并把各类问题的详情替换为摘要，需在run_db_call的工作线程中调用"""
+    result = dict(db.get_overdue_issues(as_of))
+    for name, issues in result.items():
+        if isinstance(issues, dict) and "问题详情" in issues:
+            result[name] = {"问题数量": issues["问题数量"],
+                            "问题摘要": db.summarize_records(issues["问题详情"])}
+    return result
+
+@encoded_tool()
+async def clearance_anomalies(z_threshold: Optional[float] = None, limit: int = 50) -> dict:
+    """
+    识别最近一天日清运量骤降或骤增的小区（可能漏收或误扫）
     
-    logger.info("查询逾期混运问题")
-    return db.get_overdue_issues()
+    基于导入时增量维护的各小区日清运量EWMA滚动均值和方差，不扫描历史数据。
+    
+    Args:
+        z_threshold: 偏离度阈值，默认3.0
+        limit: 最多返回的小区数，默认50
+        
+    Returns:
+        异常小区列表，含当日清运量、预期清运量和偏离度
+    """
+    logger.info(f"查询清运量异常小区，阈值: {z_threshold or '默认'}")
+    return await run_db_call(
+        "clearance_anomalies", db_method("get_clearance_anomalies", z_threshold, limit)
+    )
 
-@mcp.tool()
-def get_decoration_appointments_data(days_back: int = 30) -> dict:
+@encoded_tool()
+async def get_decoration_appointments_data(days_back: int = 30) -> dict:
     """
     接入新旧模式预约数据
     
@@ -94,85 +441,413 @@ def get_decoration_appointments_data(days_back: int = 30) -> dict:
     Returns:
         整合的新旧模式预约数据
     """
-    if db is None:
-        initialize_database_instance()
-    
     logger.info(f"查询装修垃圾预约数据，最近 {days_back} 天")
-    return db.get_decoration_appointments_data(days_back)
+    return await run_db_call(
+        "get_decoration_appointments_data",
+        db_method("get_decoration_appointments_data", days_back)
+    )
 
-@mcp.tool()
-def get_order_status_details(
+@encoded_tool()
+async def get_order_status_details(
     status: Optional[str] = None, 
-    mode: Optional[str] = None
+    mode: Optional[str] = None,
+    page: int = 1,
+    page_size: int = 100
 ) -> dict:
     """
     查看各状态工单详情
     
     Args:
         status: 筛选特定状态的工单，可选
-        mode: 筛选模式 ('老模式' 或 '新模式')，可选
+        mode: 筛选模式 ('老模式' 或 '新模式')，可选，不指定时包含两种模式
+        page: 工单详情页码，从1开始，默认第1页
+        page_size: 每页工单数，默认100
         
     Returns:
-        工单状态统计和详情
+        工单状态统计、当前页的工单详情和分页信息
     """
-    if db is None:
-        initialize_database_instance()
-    
-    logger.info(f"查询工单状态详情，状态: {status or '全部'}，模式: {mode or '全部'}")
-    return db.get_order_status_details(status, mode)
+    logger.info(f"查询工单状态详情，状态: {status or '全部'}，模式: {mode or '全部'}，第 {page} 页")
+    return await run_db_call(
+        "get_order_status_details",
+        db_method("get_order_status_details", status, mode, page, page_size)
+    )
 
-@mcp.tool()
-def check_data_quality() -> dict:
+@encoded_tool()
+async def check_data_quality(refresh: bool = False, include_markdown: bool = False) -> dict:
     """
     检查数据质量
     
+    返回所有数据表每个字段的缺失值、唯一值、重复值和最小/最大值画像。
+    唯一值和重复值为估计值，报告中的“估计值字段”列出这些字段；
+    需要计算画像的表逐表依次扫描，不并行。
+    
+    Args:
+        refresh: 是否重新扫描数据计算画像，默认使用导入时保存的画像；
+                 刷新会写入画像，启用工作进程时在服务器进程中执行
+        include_markdown: 是否附带Markdown格式的表格
+        
     Returns:
         数据质量报告
     """
-    if db is None:
-        initialize_database_instance()
-    
-    logger.info("执行数据质量检查")
-    return db.check_data_quality()
+    logger.info(f"执行数据质量检查，刷新画像: {refresh}")
+    return await run_db_call(
+        "check_data_quality", db_method("check_data_quality", refresh, include_markdown),
+        writes=refresh
+    )
 
-@mcp.tool()
-def get_available_date_range() -> dict:
+@encoded_tool()
+async def get_available_date_range() -> dict:
     """
     获取可用的数据日期范围
     
     Returns:
         各表的数据日期范围
     """
-    if db is None:
-        initialize_database_instance()
-    
     logger.info("查询可用数据日期范围")
-    return db.get_available_date_range()
+    return await run_db_call(
+        "get_available_date_range", db_method("get_available_date_range")
+    )
 
-@mcp.tool()
-def execute_any_sql_query(query: str, params: Optional[list] = None) -> dict:
+@encoded_tool()
+async def time_series(
+    table_name: str,
+    metric: str = "count",
+    bucket: str = "day",
+    group_by: Optional[List[str]] = None,
+    start_time: Optional[str] = None,
+    end_time: Optional[str] = None,
+    filters: Optional[dict] = None
+) -> dict:
+    """
+    按小时/天/周/月统计事件的时间序列，由预先计算的小时桶合并得到
+    
+    支持的数据表、维度和度量：
+    - garbage_data（干湿垃圾清运）：维度 street_name、type_name、car_group_name，度量为清运量
+    - garbage_bin_overflow（垃圾桶满溢）：维度 division_name、is_handle、is_timeout，仅支持count
+    - small_package_garbage（小包垃圾落地）：维度 division_name、is_handle、is_timeout，度量为处理时长（分钟）
+    - decoration_garbage_old（装修垃圾老模式）：维度 street_name、order_state_desc，度量为垃圾量
+    - decoration_garbage_new（装修垃圾新模式）：维度 street_name、order_state、decoration_stage，度量为预约袋数
+    
+    Args:
+        table_name: 数据表名称
+        metric: 统计指标，count（事件数）、sum（度量合计）或 avg（度量平均值），默认count
+        bucket: 时间粒度，hour、day、week（以周一日期标识）或 month，默认day
+        group_by: 分组维度列表，可选
+        start_time: 开始时间（含），YYYY-MM-DD 或 YYYY-MM-DD HH:MM:SS，可选
+        end_time: 结束时间（含），只有日期时包含当天全部时段，可选
+        filters: 维度的等值过滤条件，如 {"street_name": "龙华街道"}，可选
+        
+    Returns:
+        按时间和维度排序的时间序列
+    """
+    logger.info(f"查询时间序列，数据表: {table_name}，指标: {metric}，粒度: {bucket}，分组: {group_by}")
+    return await run_db_call(
+        "time_series",
+        db_method("get_time_series",
+                  table_name, metric, bucket, group_by, start_time, end_time, filters)
+    )
+
+@encoded_tool()
+async def top_k(
+    table_name: str,
+    key: str,
+    k: int = 10,
+    metric: str = "count",
+    type_name: Optional[str] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None
+) -> dict:
+    """
+    查询事件数或度量合计最高的K个街道/小区/垃圾房/车辆，由导入时预聚合的计数直接得到
+    
+    支持的数据表和排名字段：
+    - garbage_data（干湿垃圾清运）：street_name、community_name、vehicle_license_num、car_group_name，
+      可按 type_name 筛选垃圾类型，sum为清运量
+    - garbage_bin_overflow（垃圾桶满溢）：station_name、community_name、division_name，仅支持count
+    - small_package_garbage（小包垃圾落地）：station_name、community_name、division_name，sum为处理时长
+    - decoration_garbage_old（装修垃圾老模式）：street_name、community_name、vehicle_license_num，sum为垃圾量
+    - decoration_garbage_new（装修垃圾新模式）：street_name、community_name，sum为预约袋数
+    
+    Args:
+        table_name: 数据表名称
+        key: 排名字段
+        k: 返回条数，默认10
+        metric: 排序指标，count（事件数）或 sum（度量合计），默认count
+        type_name: 垃圾类型，如 湿垃圾（仅garbage_data），可选
+        start_date: 开始日期（含），YYYY-MM-DD，可选
+        end_date: 结束日期（含），YYYY-MM-DD，可选
+        
+    Returns:
+        排行结果；按日计数被截断时附带误差上限，无法确定前K个对象时在原表上精确计算
+    """
+    logger.info(f"查询Top-K排行，数据表: {table_name}，排名字段: {key}，k: {k}，指标: {metric}")
+    return await run_db_call(
+        "top_k",
+        db_method("get_top_k", table_name, key, k, metric, type_name, start_date, end_date)
+    )
+
+def run_admitted_query(query: str, params: list,
+                       source: str = "execute_any_sql_query",
+                       include_history: bool = False,
+                       response_mode: str = "full") -> tuple:
+    """
+    先做准入控制，再按决策执行自定义SQL，需在run_db_call的工作线程中调用
+    
+    Args:
+        query: SQL查询语句
+        params: 查询参数列表
+        source: 查询来源，记入慢查询日志
+        include_history: 是否同时读取已归档的历史数据
+        response_mode: full返回全部结果行，summary只返回结果摘要
+        
+    Returns:
+        (准入控制结果, 查询结果)，未启用准入控制时前者为None；
+        启用pre_encode_rows时查询结果为PreEncodedJSON，summary时为结果摘要dict
+    """
+    if include_history:
+        with db.include_history():
+            return run_admitted_query(query, params, source, response_mode=response_mode)
+    admission = None
+    if ADMISSION_CONTROL_CONFIG["enabled"]:
+        admission = db.check_query_admission(query, tuple(params))
+        if admission["决策"] == "拒绝":
+            return admission, []
+    options = {"source": source}
+    if admission and admission["决策"] == "降级":
+        options.update(timeout=ADMISSION_CONTROL_CONFIG["downgrade_timeout"],
+                       max_rows=ADMISSION_CONTROL_CONFIG["downgrade_max_rows"])
+    if response_mode == "summary":
+        # 一次遍历游标计算摘要，结果行不进入响应
+        return admission, db.execute_query_summary(query, tuple(params), **options)
+    if MCP_SERVER_CONFIG["pre_encode_rows"]:
+        # 结果行从游标直接编码为JSON，响应编码时原样拼接
+        columns, rows = db.execute_query_json_rows(query, tuple(params), **options)
+        return admission, PreEncodedJSON(rows, columns)
+    return admission, db.execute_query(query, tuple(params), **options)
+
+def build_query_response(query: str, params: list, admission: Optional[dict],
+                         result: Any) -> dict:
+    """
+    组装自定义SQL的返回结构
+    
+    Args:
+        query: SQL查询语句
+        params: 查询参数列表
+        admission: 准入控制结果
+        result: 查询结果列表、PreEncodedJSON或结果摘要dict
+        
+    Returns:
+        execute_any_sql_query约定的返回字典
+    """
+    response = {"查询语句": query, "查询参数": params}
+    if isinstance(result, dict):
+        response.update(结果数量=result["总行数"], 结果摘要=result)
+    else:
+        response.update(结果数量=len(result), 查询结果=result)
+    response["执行状态"] = "成功"
+    if admission:
+        response["准入控制"] = {
+            "决策": admission["决策"],
+            "估算代价": admission["估算代价"],
+            "代价预算": admission["代价预算"]
+        }
+        if admission["决策"] == "拒绝":
+            response["执行状态"] = "已拒绝"
+            response["错误信息"] = admission["说明"]
+            logger.warning(f"SQL查询被准入控制拒绝: {admission['说明']}")
+        elif admission["决策"] == "降级":
+            response["准入控制"]["说明"] = admission["说明"]
+    
+    return response
+
+def build_query_error(query: str, params: list, e: Exception) -> dict:
+    """
+    组装自定义SQL执行失败或超时时的返回结构
+    
+    Args:
+        query: SQL查询语句
+        params: 查询参数列表
+        e: 执行时抛出的异常
+        
+    Returns:
+        execute_any_sql_query约定的返回字典
+    """
+    if isinstance(e, QueryTimeoutError):
+        logger.warning(f"SQL查询超时: {e}")
+        status, message = "超时", f"{e}。请缩小时间范围、补充过滤条件或避免笛卡尔积后重试"
+    else:
+        logger.error(f"SQL查询执行失败: {str(e)}")
+        status, message = "失败", str(e)
+    
+    return {
+        "查询语句": query,
+        "查询参数": params,
+        "结果数量": 0,
+        "查询结果": [],
+        "执行状态": status,
+        "错误信息": message
+    }
+
+def run_admitted_batch(statements: List[tuple]) -> Dict[str, dict]:
+    """
+    在同一个读快照中依次执行多条自定义SQL，需在run_db_call的工作线程中调用
+    
+    Args:
+        statements: (query, params)列表
+        
+    Returns:
+        语句序号到单条查询响应的映射，单条失败不影响其他语句
+    """
+    responses = {}
+    with db.read_snapshot():
+        for index, (query, params) in enumerate(statements):
+            try:
+                admission, result = run_admitted_query(query, params, "execute_sql_batch")
+                responses[str(index)] = build_query_response(query, params, admission, result)
+            except Exception as e:
+                responses[str(index)] = build_query_error(query, params, e)
+    return responses
+
+class ResultStore:
+    """
+    服务端结果缓存
+    
+    大结果按句柄保存在服务器进程的内存中（启用工作进程时也由服务器进程保存），
+    只把句柄和预览返回给大模型。每次读取时顺延有效期；超过有效期、结果个数或
+    结果总行数上限时淘汰最久未使用的结果。
+    """
+    
+    def __init__(self, ttl_seconds: float, max_results: int, max_total_rows: int):
+        """
+        Args:
+            ttl_seconds: 句柄有效期（秒）
+            max_results: 最多保存的结果个数
+            max_total_rows: 所有结果的总行数上限，最新的结果总会保留
+        """
+        self.ttl_seconds = ttl_seconds
+        self.max_results = max_results
+        self.max_total_rows = max_total_rows
+        self._entries: "OrderedDict[str, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def put(self, rows: Any, query: str, params: list) -> str:
+        """
+        保存结果
+        
+        Args:
+            rows: 结果行，PreEncodedJSON或dict列表
+            query: 产生结果的SQL语句
+            params: 查询参数
+            
+        Returns:
+            结果句柄
+        """
+        handle = secrets.token_hex(8)
+        with self._lock:
+            self._purge_expired()
+            self._entries[handle] = {
+                "rows": rows,
+                "query": query,
+                "params": params,
+                "expires_at": time.monotonic() + self.ttl_seconds
+            }
+            total_rows = sum(len(entry["rows"]) for entry in self._entries.values())
+            while len(self._entries) > 1 and (len(self._entries) > self.max_results
+                                              or total_rows > self.max_total_rows):
+                _, evicted = self._entries.popitem(last=False)
+                total_rows -= len(evicted["rows"])
+        return handle
+    
+    def get(self, handle: str) -> dict:
+        """
+        读取结果并顺延有效期
+        
+        Raises:
+            KeyError: 句柄不存在、已过期或已被淘汰
+        """
+        with self._lock:
+            self._purge_expired()
+            if handle not in self._entries:
+                raise KeyError(f"结果句柄 {handle} 不存在或已过期，请重新执行查询")
+            entry = self._entries[handle]
+            entry["expires_at"] = time.monotonic() + self.ttl_seconds
+            self._entries.move_to_end(handle)
+            return entry
+    
+    def _purge_expired(self):
+        """删除已过期的结果"""
+        now = time.monotonic()
+        for handle in [h for h, entry in self._entries.items() if entry["expires_at"] <= now]:
+            del self._entries[handle]
+
+result_store = ResultStore(RESULT_HANDLE_CONFIG["ttl_seconds"], RESULT_HANDLE_CONFIG["max_results"],
+                           RESULT_HANDLE_CONFIG["max_total_rows"])
+
+def store_large_result(response: dict) -> dict:
+    """
+    结果行数超过RESULT_HANDLE_CONFIG["min_rows"]时，把查询结果保存到result_store，
+    响应中的查询结果替换为结果句柄和预览
+    
+    Args:
+        response: build_query_response返回的字典
+        
+    Returns:
+        替换后的响应；未启用或结果较小时原样返回
+    """
+    rows = response.get("查询结果")
+    if not RESULT_HANDLE_CONFIG["enabled"] or rows is None \
+            or len(rows) <= RESULT_HANDLE_CONFIG["min_rows"]:
+        return response
+    handle = result_store.put(rows, response["查询语句"], response["查询参数"])
+    preview = rows[:RESULT_HANDLE_CONFIG["preview_rows"]]
+    replaced = {}
+    for key, value in response.items():
+        if key != "查询结果":
+            replaced[key] = value
+            continue
+        replaced["结果句柄"] = handle
+        replaced["结果预览"] = preview
+        replaced["句柄说明"] = (
+            f"结果共 {len(rows)} 行，完整结果保存在服务端（{RESULT_HANDLE_CONFIG['ttl_seconds']}秒内未使用则失效），"
+            f"结果预览为前 {len(preview)} 行；用fetch_result分页读取，用export_result导出为文件"
+        )
+    logger.info(f"查询结果 {len(rows)} 行已保存为结果句柄 {handle}")
+    return replaced
+
+@encoded_tool()
+async def execute_any_sql_query(query: str, params: Optional[list] = None,
+                                include_history: bool = False,
+                                response_mode: str = "full") -> dict:
     """
     执行任意SQL查询语句
     
     当用户的需求不属于预定义的五种功能，或需求比较模糊时，
     大模型可以根据具体需求生成SQL查询语句和参数，通过此工具执行查询。
+    服务器启用只读工作进程（--workers）时，取消请求不会中断已经开始执行的查询，
+    查询会一直执行到完成或超时。
     
     Args:
         query: SQL查询语句，可以使用?作为占位符
         params: 占位符对应的参数列表，可选
+        include_history: 是否同时查询已归档的历史数据（几个月前已结束的记录），
+                         默认只查询在线数据；需要更早的历史记录时设为True，查询会变慢
+        response_mode: full返回全部结果行；summary只返回结果摘要（总行数、各字段的最小/最大/平均值、
+                       高频取值和空值数，以及少量代表性样本），预计结果有成百上千行时使用
         
     Returns:
-        包含查询结果和执行信息的字典，结构如下：
+        包含查询结果和执行信息的字典，小数按完整精度返回，超出浮点范围的值（Inf/NaN）返回为null。
+        结构如下：
         - 查询语句: SQL查询语句
         - 查询参数: 查询参数列表
         - 结果数量: 查询结果数量
-        - 查询结果: 查询结果列表
-        - 执行状态: 执行状态，成功或失败
-        - 错误信息: 错误信息，如果执行失败
+        - 查询结果: 查询结果列表（response_mode为full时）
+        - 结果句柄、结果预览: 结果行数较多时代替查询结果，完整结果保存在服务端，
+          用fetch_result分页读取、export_result导出为文件
+        - 结果摘要: 总行数、字段统计、代表性样本（response_mode为summary时）
+        - 执行状态: 执行状态，成功、失败、超时或已拒绝
+        - 错误信息: 错误信息，如果执行失败；被拒绝时说明导致高代价的全表扫描或缺失索引
+        - 准入控制: 执行前根据EXPLAIN QUERY PLAN估算的代价及决策（执行/降级/拒绝）
     """
-    if db is None:
-        initialize_database_instance()
-    
     # 确保params是列表或元组格式
     if params is None:
         params = []
@@ -183,29 +858,296 @@ def execute_any_sql_query(query: str, params: Optional[list] = None) -> dict:
     logger.info(f"查询参数: {params}")
     
     try:
-        # 调用数据库操作类的execute_query方法
-        result = db.execute_query(query, tuple(params))
+        check_response_mode(response_mode)
+        # 调用数据库操作类的execute_query方法，超时由run_db_call施加
+        admission, result = await run_db_call(
+            "execute_any_sql_query",
+            functools.partial(run_admitted_query, query, params, include_history=include_history,
+                              response_mode=response_mode)
+        )
+        return store_large_result(build_query_response(query, params, admission, result))
         
+    except Exception as e:
+        return build_query_error(query, params, e)
+
+@encoded_tool()
+async def execute_sql_batch(queries: list) -> dict:
+    """
+    在一次调用中执行多条SQL查询语句
+    
+    一个问题需要多次小查询时（如先查日期范围、再计数、再取TopN），
+    用此工具一次提交，避免多次往返。所有语句在同一个读事务中执行，
+    看到同一份数据快照；每条语句单独做准入控制，单条失败不影响其他语句。
+    
+    Args:
+        queries: 查询列表，每项为 {"query": "SQL语句", "params": [参数]}，
+                 或 [SQL语句, [参数]]；params可省略
+        
+    Returns:
+        包含各语句结果的字典，结构如下：
+        - 语句数量: 提交的语句数
+        - 成功数量: 执行成功的语句数
+        - 批量结果: 以语句序号（从0开始的字符串）为键，
+          值与execute_any_sql_query的返回结构相同
+    """
+    max_statements = BATCH_QUERY_CONFIG["max_statements"]
+    if len(queries) > max_statements:
         return {
-            "查询语句": query,
-            "查询参数": params,
-            "结果数量": len(result),
-            "查询结果": result,
-            "执行状态": "成功",
+            "语句数量": len(queries),
+            "成功数量": 0,
+            "批量结果": {},
+            "执行状态": "失败",
+            "错误信息": f"单次最多提交 {max_statements} 条语句，请拆分后重试"
         }
+    
+    # 统一为(query, params)列表
+    statements = []
+    for item in queries:
+        if isinstance(item, dict):
+            query, params = item.get("query", ""), item.get("params")
+        else:
+            query, params = item[0], item[1] if len(item) > 1 else None
+        if params is None:
+            params = []
+        elif not isinstance(params, (list, tuple)):
+            params = [params]
+        statements.append((query, list(params)))
+    
+    logger.info(f"批量执行SQL查询，共 {len(statements)} 条")
+    
+    responses = await run_db_call(
+        "execute_sql_batch", functools.partial(run_admitted_batch, statements)
+    )
+    return {
+        "语句数量": len(statements),
+        "成功数量": sum(1 for r in responses.values() if r["执行状态"] == "成功"),
+        "批量结果": {index: store_large_result(r) for index, r in responses.items()}
+    }
+
+@encoded_tool()
+async def fetch_result(handle: str, offset: int = 0, limit: int = 100) -> dict:
+    """
+    分页读取服务端保存的查询结果
+    
+    execute_any_sql_query或execute_sql_batch的结果行数较多时，响应中只有结果句柄和预览，
+    需要查看更多结果行时用此工具按页读取。
+    
+    Args:
+        handle: 查询响应中的结果句柄
+        offset: 起始行号，从0开始
+        limit: 读取的行数，默认100行，单次最多RESULT_HANDLE_CONFIG["max_fetch_rows"]行
+        
+    Returns:
+        包含结果行和分页信息的字典，结构如下：
+        - 结果句柄: 结果句柄
+        - 结果数量: 结果总行数
+        - 起始位置: 本页的起始行号
+        - 返回数量: 本页的行数
+        - 剩余数量: 本页之后还有的行数
+        - 查询结果: 本页的结果行
+        - 执行状态: 成功或失败
+        - 错误信息: 错误信息，如果句柄不存在或已过期
+    """
+    logger.info(f"读取结果句柄 {handle}，起始位置: {offset}，行数: {limit}")
+    try:
+        entry = result_store.get(handle)
+    except KeyError as e:
+        return {"结果句柄": handle, "执行状态": "失败", "错误信息": e.args[0]}
+    
+    rows = entry["rows"]
+    offset = max(0, offset)
+    limit = max(0, min(limit, RESULT_HANDLE_CONFIG["max_fetch_rows"]))
+    page = rows[offset:offset + limit]
+    return {
+        "结果句柄": handle,
+        "结果数量": len(rows),
+        "起始位置": offset,
+        "返回数量": len(page),
+        "剩余数量": max(0, len(rows) - offset - len(page)),
+        "查询结果": page,
+        "执行状态": "成功"
+    }
+
+def iter_stored_rows(rows: Any, columns: List[str], batch_size: int):
+    """按批产出服务端保存的结果行，每行的取值与columns一一对应"""
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        if isinstance(batch, PreEncodedJSON):
+            batch = [json.loads(row) for row in batch.rows]
+        yield [tuple(row.get(column) for column in columns) for row in batch]
+
+def export_stored_result(rows: Any, file_format: str, path: str) -> int:
+    """把服务端保存的结果写入文件，返回写入的行数"""
+    if isinstance(rows, PreEncodedJSON) and rows.columns is not None:
+        columns = rows.columns
+    else:
+        columns = list(rows[0]) if rows else []
+    return write_rows(path, file_format, columns,
+                      iter_stored_rows(rows, columns, EXPORT_CONFIG["batch_size"]))
+
+@encoded_tool()
+async def export_result(handle: str, format: str = "csv", path: Optional[str] = None) -> dict:
+    """
+    把服务端保存的查询结果直接导出为文件
+    
+    结果行由服务器从内存写入文件，不经过大模型。用户需要完整明细或要求保存结果时使用。
+    
+    Args:
+        handle: 查询响应中的结果句柄
+        format: 文件格式，csv（utf-8-sig编码，可直接用Excel打开）或parquet
+        path: 导出文件路径，相对于导出目录（默认outputs），默认以结果句柄命名
         
+    Returns:
+        包含导出文件信息的字典，结构如下：
+        - 结果句柄: 结果句柄
+        - 文件路径: 导出文件的绝对路径
+        - 文件格式: csv或parquet
+        - 行数: 写入的结果行数
+        - 文件大小: 文件字节数
+        - 执行状态: 成功或失败
+        - 错误信息: 错误信息，如果导出失败
+    """
+    logger.info(f"导出结果句柄 {handle}，格式: {format}，路径: {path}")
+    try:
+        if format not in EXPORT_FORMATS:
+            raise ValueError(f"不支持的导出格式: {format}，可选值: {', '.join(EXPORT_FORMATS)}")
+        entry = result_store.get(handle)
+        target = resolve_export_path(path, f"result_{handle}.{format}")
+        # 写文件在工作线程中执行，不阻塞事件循环
+        row_count = await anyio.to_thread.run_sync(
+            functools.partial(export_stored_result, entry["rows"], format, target)
+        )
     except Exception as e:
-        error_msg = f"SQL查询执行失败: {str(e)}"
-        logger.error(error_msg)
+        logger.error(f"结果导出失败: {e}")
+        return {"结果句柄": handle, "执行状态": "失败", "错误信息": e.args[0] if e.args else str(e)}
+    
+    return {
+        "结果句柄": handle,
+        "文件路径": target,
+        "文件格式": format,
+        "行数": row_count,
+        "文件大小": os.path.getsize(target),
+        "执行状态": "成功"
+    }
+
+def run_export_query(query: str, params: list, file_format: str, path: str,
+                     include_history: bool = False) -> tuple:
+    """
+    先做准入控制，再把查询结果流式写入文件，需在run_db_call的工作线程中调用
+    
+    导出需要完整结果，准入控制只执行拒绝决策，降级决策不截断结果行。
+    
+    Returns:
+        (准入控制结果, 写入的行数)，未启用准入控制时前者为None
+    """
+    if include_history:
+        with db.include_history():
+            return run_export_query(query, params, file_format, path)
+    admission = None
+    if ADMISSION_CONTROL_CONFIG["enabled"]:
+        admission = db.check_query_admission(query, tuple(params))
+        if admission["决策"] == "拒绝":
+            return admission, 0
+    return admission, db.export_query(query, path, file_format, tuple(params), source="export_query")
+
+@encoded_tool()
+async def export_query(query: str, params: Optional[list] = None, format: str = "csv",
+                       path: Optional[str] = None, include_history: bool = False) -> dict:
+    """
+    执行SQL查询并把全部结果直接导出为文件
+    
+    服务器分批读取游标写入文件，结果行不经过大模型，内存占用与结果行数无关。
+    用户要求导出或下载明细数据（如某段时间的全部清运记录）时使用；
+    只需要分析结果时用execute_any_sql_query。
+    启用只读工作进程时，导出开始后取消请求不再生效，导出持续到完成或超时。
+    
+    Args:
+        query: SQL查询语句，可以使用?作为占位符
+        params: 占位符对应的参数列表，可选
+        format: 文件格式，csv（utf-8-sig编码，可直接用Excel打开）或parquet
+        path: 导出文件路径，相对于导出目录（默认outputs），默认以导出时间命名
+        include_history: 是否同时导出已归档的历史数据
         
-        return {
-            "查询语句": query,
-            "查询参数": params,
-            "结果数量": 0,
-            "查询结果": [],
-            "执行状态": "失败",
-            "错误信息": str(e)
+    Returns:
+        包含导出文件信息的字典，结构如下：
+        - 查询语句: SQL查询语句
+        - 查询参数: 查询参数列表
+        - 文件路径: 导出文件的绝对路径
+        - 文件格式: csv或parquet
+        - 行数: 写入的结果行数
+        - 文件大小: 文件字节数
+        - 执行状态: 成功、失败、超时或已拒绝
+        - 错误信息: 错误信息，如果导出失败或被拒绝
+        - 准入控制: 执行前根据EXPLAIN QUERY PLAN估算的代价及决策
+    """
+    if params is None:
+        params = []
+    elif not isinstance(params, (list, tuple)):
+        params = [params]
+    
+    logger.info(f"导出SQL查询结果: {query}，格式: {format}，路径: {path}")
+    response = {"查询语句": query, "查询参数": params}
+    try:
+        if format not in EXPORT_FORMATS:
+            raise ValueError(f"不支持的导出格式: {format}，可选值: {', '.join(EXPORT_FORMATS)}")
+        target = resolve_export_path(
+            path, f"export_{time.strftime('%Y%m%d_%H%M%S')}_{secrets.token_hex(4)}.{format}"
+        )
+        admission, row_count = await run_db_call(
+            "export_query",
+            functools.partial(run_export_query, query, list(params), format, target,
+                              include_history=include_history)
+        )
+    except Exception as e:
+        error = build_query_error(query, params, e)
+        response.update(执行状态=error["执行状态"], 错误信息=error["错误信息"])
+        return response
+    
+    if admission and admission["决策"] == "拒绝":
+        logger.warning(f"导出被准入控制拒绝: {admission['说明']}")
+        response.update(执行状态="已拒绝", 错误信息=admission["说明"])
+    else:
+        response.update(文件路径=target, 文件格式=format, 行数=row_count,
+                        文件大小=os.path.getsize(target), 执行状态="成功")
+    if admission:
+        response["准入控制"] = {
+            "决策": admission["决策"],
+            "估算代价": admission["估算代价"],
+            "代价预算": admission["代价预算"]
         }
+    return response
+
+@encoded_tool()
+async def get_slow_queries(limit: int = 10) -> dict:
+    """
+    查看慢查询排行
+    
+    汇总慢查询日志中超过阈值的查询（包括预定义工具和自定义SQL），
+    按总耗时排序，并附带EXPLAIN QUERY PLAN中的全表扫描和临时B树步骤。
+    
+    Args:
+        limit: 返回的查询条数，默认10条
+        
+    Returns:
+        按SQL语句聚合的慢查询排行
+    """
+    logger.info(f"查询慢查询排行，前 {limit} 条")
+    return await run_db_call("get_slow_queries", db_method("get_slow_queries", limit))
+
+@encoded_tool()
+async def get_storage_diagnostics() -> dict:
+    """
+    查看存储I/O诊断信息
+    
+    返回当前使用的存储配置档（mmap_size、cache_size、temp_store、page_size），
+    以及服务连接上实际生效的PRAGMA、数据库大小和服务模式（磁盘/内存快照），
+    配置未完全生效时（如已有数据库的page_size不同）给出说明。
+    
+    Returns:
+        存储配置档及生效的PRAGMA
+    """
+    logger.info("查询存储I/O诊断信息")
+    return await run_db_call("get_storage_diagnostics", db_method("get_storage_diagnostics"))
 
 def create_app(db_path: str = "garbage_monitoring.db"):
     """
@@ -217,26 +1159,54 @@ def create_app(db_path: str = "garbage_monitoring.db"):
     Returns:
         FastMCP应用实例
     """
-    # 初始化数据库路径
-    initialize_database_instance(db_path)
+    # 记录数据库路径，连接在首次工具调用时建立
+    configure_database_instance(db_path)
     return mcp
 
 def main():
     """主函数"""
-    import sys
+    import argparse
     
-    # 从命令行参数获取数据库路径
-    db_path = sys.argv[1] if len(sys.argv) > 1 else "garbage_monitoring.db"
+    # 从命令行参数获取数据库路径和启动选项
+    parser = argparse.ArgumentParser(description="垃圾监管FastMCP服务器")
+    parser.add_argument("db_path", nargs="?", default="garbage_monitoring.db", help="数据库文件路径")
+    parser.add_argument("--memory", action="store_true", default=None,
+                        help="启动时把数据库复制到内存中，所有查询读取内存快照")
+    parser.add_argument("--storage-profile", choices=list(STORAGE_PROFILES), default=None,
+                        help="存储I/O配置档，默认取DATABASE_CONFIG中的设置")
+    parser.add_argument("--transport", choices=["stdio", "streamable-http", "sse"],
+                        default=MCP_SERVER_CONFIG["transport"],
+                        help="传输方式，网络传输时多个智能体进程可共享一个常驻服务器")
+    parser.add_argument("--host", default=MCP_SERVER_CONFIG["host"], help="网络传输时监听的地址")
+    parser.add_argument("--port", type=int, default=MCP_SERVER_CONFIG["port"],
+                        help="网络传输时监听的端口")
+    parser.add_argument("--workers", type=int, default=MCP_SERVER_CONFIG["workers"],
+                        help="只读工作进程数，大于0时工具调用分发到各工作进程并行执行")
+    args = parser.parse_args()
+    db_path = args.db_path
     
     logger.info(f"启动垃圾监管FastMCP服务器，数据库路径: {db_path}")
     
-    # 初始化数据库
-    initialize_database_instance(db_path)
+    # 记录数据库设置，连接在首次工具调用时建立
+    configure_database_instance(db_path, serve_from_memory=args.memory,
+                                storage_profile=args.storage_profile)
+    
+    if args.transport != "stdio":
+        # 常驻服务器在启动时建立连接并预热元数据目录，之后各会话共享
+        initialize_database_instance().get_table_catalog()
+        mcp.settings.host = args.host
+        mcp.settings.port = args.port
+        path = mcp.settings.streamable_http_path if args.transport == "streamable-http" \
+            else mcp.settings.sse_path
+        logger.info(f"网络传输: {args.transport}，地址: http://{args.host}:{args.port}{path}")
+    
+    if args.workers > 0:
+        start_worker_pool(args.workers)
     
     try:
         logger.info("✅ FastMCP服务器启动完成，等待连接...")
         # 运行FastMCP服务器（同步版本）
-        mcp.run()
+        mcp.run(transport=args.transport)
     except KeyboardInterrupt:
         logger.info("收到退出信号，正在关闭服务器...")
     except Exception as e:
@@ -244,6 +1214,7 @@ def main():
         raise
     finally:
         # 清理资源
+        stop_worker_pool()
         global db
         if db:
             db.close()
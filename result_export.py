@@ -0,0 +1,135 @@
+"""
+结果文件导出
+把查询结果分批写入CSV（utf-8-sig，与智能体保存的CSV一致）或Parquet文件，
+每次只持有一批结果行，内存占用与结果总行数无关
+"""
+import csv
+import os
+from typing import Any, Iterable, List, Optional, Sequence
+
+from config import EXPORT_CONFIG
+
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+EXPORT_FORMATS = ("csv", "parquet")
+
+
+def export_directory() -> str:
+    """返回导出目录的绝对路径"""
+    return os.path.abspath(os.path.join(PROJECT_ROOT, EXPORT_CONFIG["directory"]))
+
+
+def resolve_export_path(path: Optional[str], default_name: str) -> str:
+    """
+    解析导出文件路径，并创建所在目录
+
+    Args:
+        path: 相对于导出目录的文件路径，为空时使用default_name
+        default_name: 默认文件名
+
+    Returns:
+        导出文件的绝对路径
+
+    Raises:
+        ValueError: 路径超出导出目录
+    """
+    directory = export_directory()
+    target = os.path.abspath(os.path.join(directory, path or default_name))
+    if os.path.commonpath([directory, target]) != directory or target == directory:
+        raise ValueError(f"导出路径必须位于 {directory} 目录内: {path}")
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    return target
+
+
+def write_rows(path: str, file_format: str, columns: List[str],
+               batches: Iterable[Sequence[Sequence[Any]]]) -> int:
+    """
+    把分批的结果行写入文件
+
+    先写入临时文件，全部写完后再改名为目标文件，导出失败时不留下不完整的文件。
+
+    Args:
+        path: 导出文件路径
+        file_format: csv或parquet
+        columns: 结果列名
+        batches: 结果行的批次，每行的取值与columns一一对应
+
+    Returns:
+        写入的行数
+    """
+    if file_format not in EXPORT_FORMATS:
+        raise ValueError(f"不支持的导出格式: {file_format}，可选值: {', '.join(EXPORT_FORMATS)}")
+    temp_path = f"{path}.tmp"
+    try:
+        if file_format == "csv":
+            row_count = _write_csv(temp_path, columns, batches)
+        else:
+            row_count = _write_parquet(temp_path, columns, batches)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return row_count
+
+
+def _write_csv(path: str, columns: List[str], batches: Iterable[Sequence[Sequence[Any]]]) -> int:
+    """写入CSV，NULL写为空字段"""
+    row_count = 0
+    with open(path, "w", encoding="utf-8-sig", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for batch in batches:
+            writer.writerows(batch)
+            row_count += len(batch)
+    return row_count
+
+
+def _write_parquet(path: str, columns: List[str], batches: Iterable[Sequence[Sequence[Any]]]) -> int:
+    """写入Parquet，字段类型由第一批结果推断，每批写为一个row group"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError("导出Parquet需要安装pyarrow: pip install pyarrow") from e
+
+    row_count = 0
+    writer = None
+    try:
+        for batch in batches:
+            values = list(zip(*batch)) if batch else [()] * len(columns)
+            if writer is None:
+                arrays = [_arrow_array(pa, column, list(v)) for column, v in zip(columns, values)]
+                writer = pq.ParquetWriter(path, pa.schema(
+                    [pa.field(column, array.type) for column, array in zip(columns, arrays)]
+                ))
+            else:
+                arrays = [_arrow_array(pa, field.name, list(v), field.type)
+                          for field, v in zip(writer.schema_arrow, values)]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=writer.schema_arrow))
+            row_count += len(batch)
+        if writer is None:
+            # 空结果也写出带列名的文件
+            writer = pq.ParquetWriter(path, pa.schema([pa.field(c, pa.string()) for c in columns]))
+    finally:
+        if writer is not None:
+            writer.close()
+    return row_count
+
+
+def _arrow_array(pa, column: str, values: List[Any], arrow_type=None):
+    """
+    把一列取值转换为Arrow数组
+
+    SQLite是动态类型，同一列可能混有数值和文本：第一批中类型不一致或全为NULL的列按文本保存；
+    之后的批次须与第一批推断的类型一致，文本列中的其他类型转换为文本。
+    """
+    try:
+        array = pa.array(values, type=arrow_type)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        if arrow_type is not None and not pa.types.is_string(arrow_type):
+            raise ValueError(f"字段 {column} 的取值类型与前面的结果行（{arrow_type}）不一致，"
+                             f"请在SQL中用CAST统一类型后导出")
+        array = pa.array([None if v is None else str(v) for v in values], type=pa.string())
+    if arrow_type is None and pa.types.is_null(array.type):
+        array = array.cast(pa.string())
+    return array
@@ -4,14 +4,274 @@ SQLite数据库操作模块
 """
 import sqlite3
 import logging
+import functools
+import logging.handlers
+import math
 import os
-import pandas as pd
-from typing import List, Dict, Any, Optional, Tuple
+import random
+import re
+import threading
+import time
+import urllib.parse
+import zlib
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple
 from datetime import datetime, timedelta
 import json
 
+from config import (
+    ADMISSION_CONTROL_CONFIG,
+    ANALYTICS_CACHE_CONFIG,
+    ANOMALY_CONFIG,
+    ARCHIVE_CONFIG,
+    DATABASE_CONFIG,
+    DATA_QUALITY_CONFIG,
+    DISTINCT_SKETCH_CONFIG,
+    EXPORT_CONFIG,
+    MEMORY_SERVING_CONFIG,
+    PARTITION_CONFIG,
+    QUERY_TIMEOUT_CONFIG,
+    RESULT_SUMMARY_CONFIG,
+    SLOW_QUERY_CONFIG,
+    STORAGE_PROFILES,
+    TOP_K_CONFIG,
+)
+from result_export import write_rows
+
+# NumPy/pandas只在导入数据、分析缓存和近似去重时用到，按需导入以加快服务启动
+if TYPE_CHECKING:
+    from analytics_cache import GarbageAnalyticsCache
+
 logger = logging.getLogger(__name__)
 
+
+class QueryTimeoutError(Exception):
+    """查询超过截止时间，已被SQLite中止"""
+
+
+class QueryCancelledError(Exception):
+    """查询被调用方取消（如MCP客户端断开或取消请求）"""
+
+
+def _sqlite_sort_key(value: Any) -> Tuple[int, Any]:
+    """按SQLite的跨类型排序规则（NULL < 数值 < 文本 < BLOB）生成排序键"""
+    if value is None:
+        return (-1, 0)
+    if isinstance(value, (int, float)):
+        return (0, value)
+    if isinstance(value, str):
+        return (1, value)
+    return (2, bytes(value))
+
+
+def _min_max(values: Iterable[Any]) -> Tuple[Any, Any]:
+    """按SQLite的跨类型排序规则取最小值和最大值"""
+    values = list(values)
+    try:
+        # 同类型取值直接比较（文本按码点比较，与SQLite的BINARY排序一致）
+        return min(values), max(values)
+    except TypeError:
+        return min(values, key=_sqlite_sort_key), max(values, key=_sqlite_sort_key)
+
+
+def _profile_table(connection: sqlite3.Connection, table_name: str) -> List[Dict[str, Any]]:
+    """
+    对一张表做一次全表扫描，计算所有字段的数据质量画像
+    
+    空值、空字符串和最小/最大值为精确值；唯一值数量由HyperLogLog估计，
+    重复值由Bloom过滤器判断取值此前是否出现过来估计。每批结果按列转置后用
+    pandas.factorize去重，只对批内不同的取值计算哈希。每个字段的草图和位数组大小固定，
+    内存不随表行数和取值种类增长，无论字段多少都只扫描一遍表。
+    
+    Args:
+        connection: 数据库连接
+        table_name: 表格名称
+        
+    Returns:
+        每个字段一条的画像记录列表
+    """
+    import numpy as np
+    import pandas as pd
+    from hyperloglog import BloomFilter, HyperLogLog
+    
+    precision = DATA_QUALITY_CONFIG["hll_precision"]
+    cursor = connection.cursor()
+    cursor.execute(f'PRAGMA table_info("{table_name}")')
+    columns = [(row[1], row[2]) for row in cursor.fetchall()]
+    
+    null_counts = [0] * len(columns)
+    empty_counts = [0] * len(columns)
+    # 重复出现的次数：取值第二次及以后的每次出现
+    repeat_counts = [0] * len(columns)
+    extremes: List[Optional[Tuple[Any, Any]]] = [None] * len(columns)
+    distinct = [HyperLogLog(precision) for _ in columns]
+    duplicated = [HyperLogLog(precision) for _ in columns]
+    seen = [BloomFilter(DATA_QUALITY_CONFIG["bloom_bits"]) for _ in columns]
+    total_rows = 0
+    
+    cursor.execute(f'SELECT * FROM "{table_name}"')
+    while True:
+        batch = cursor.fetchmany(DATA_QUALITY_CONFIG["fetch_batch_size"])
+        if not batch:
+            break
+        total_rows += len(batch)
+        for i, values in enumerate(zip(*batch)):
+            null_counts[i] += values.count(None)
+            empty_counts[i] += values.count('')
+            codes, uniques = pd.factorize(np.array(values, dtype=object))
+            occurrences = np.bincount(codes[codes >= 0], minlength=len(uniques))
+            present = uniques != ''
+            uniques, occurrences = uniques[present], occurrences[present]
+            if not len(uniques):
+                continue
+            
+            low, high = _min_max(uniques)
+            if extremes[i] is not None:
+                low, high = _min_max([low, high, *extremes[i]])
+            extremes[i] = (low, high)
+            
+            hashes = pd.util.hash_array(uniques, categorize=False)
+            distinct[i].add_hashes(hashes)
+            seen_before = seen[i].contains_hashes(hashes)
+            # 批内多次出现的取值除第一次外都是重复出现；此前批次出现过的取值，批内第一次也是
+            repeat_counts[i] += int(occurrences.sum()) - len(uniques) + int(seen_before.sum())
+            duplicated[i].add_hashes(hashes[seen_before | (occurrences > 1)])
+            seen[i].add_hashes(hashes)
+    
+    profiles = []
+    for i, (column_name, column_type) in enumerate(columns):
+        present_rows = total_rows - null_counts[i] - empty_counts[i]
+        distinct_count = min(distinct[i].count(), present_rows)
+        duplicate_kinds = min(duplicated[i].count(), distinct_count) if repeat_counts[i] else 0
+        low, high = extremes[i] or (None, None)
+        profiles.append({
+            "column_name": column_name,
+            "column_type": column_type,
+            "total_rows": total_rows,
+            "null_count": null_counts[i],
+            "empty_count": empty_counts[i],
+            "distinct_count": max(distinct_count, 1) if present_rows else 0,
+            "duplicate_kinds": duplicate_kinds,
+            # 重复值总行数包括每个重复取值的第一次出现
+            "duplicate_rows": min(repeat_counts[i] + duplicate_kinds, present_rows),
+            "min_value": low,
+            "max_value": high
+        })
+    return profiles
+
+
+def _writes_to_disk(method: Callable) -> Callable:
+    """修改数据的方法：内存服务模式下写入磁盘库，最外层调用结束后重新做内存快照"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._writing_to_disk():
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+def _summarize_rows(columns: List[str],
+                    batches: Iterable[Sequence[Sequence[Any]]]) -> Dict[str, Any]:
+    """
+    一次遍历结果行，计算总行数、字段统计和代表性样本
+    
+    每个字段统计空值数、去重数、最小/最大值和高频取值；全部非空值都能转换为数值的字段
+    （包括以文本存储的清运量等）按数值比较并计算平均值。每批结果按列转置后用Counter
+    和内置聚合计数，样本用蓄水池抽样等概率抽取并按原顺序返回。每个字段记录的取值种类
+    有上限，超过时淘汰低频取值（去重数变为下限、高频取值为近似），内存不随结果行数增长。
+    
+    Args:
+        columns: 字段名列表
+        batches: 逐批产生的结果行，每批为行的列表
+        
+    Returns:
+        包含总行数、字段统计和代表性样本的字典
+    """
+    sample_size = RESULT_SUMMARY_CONFIG["sample_size"]
+    max_tracked = RESULT_SUMMARY_CONFIG["max_tracked_values"]
+    rng = random.Random(RESULT_SUMMARY_CONFIG["sample_seed"])
+    null_counts = [0] * len(columns)
+    value_counts = [Counter() for _ in columns]
+    # 淘汰的取值只参与最小/最大值比较
+    evicted: List[List[Any]] = [[] for _ in columns]
+    numeric = [True] * len(columns)
+    sums = [0.0] * len(columns)
+    numeric_range: List[Optional[Tuple[float, float]]] = [None] * len(columns)
+    sample: List[Tuple[int, Sequence[Any]]] = []
+    total_rows = 0
+    
+    for batch in batches:
+        for row in batch:
+            if len(sample) < sample_size:
+                sample.append((total_rows, row))
+            else:
+                slot = rng.randrange(total_rows + 1)
+                if slot < sample_size:
+                    sample[slot] = (total_rows, row)
+            total_rows += 1
+        
+        for i, values in enumerate(zip(*batch)):
+            null_counts[i] += values.count(None) + values.count('')
+            counts = value_counts[i]
+            counts.update(values)
+            counts.pop(None, None)
+            counts.pop('', None)
+            if len(counts) > max_tracked:
+                kept = dict(counts.most_common(max_tracked))
+                evicted[i] = [min(evicted[i] + [v for v in counts if v not in kept],
+                                  key=_sqlite_sort_key),
+                              max(evicted[i] + [v for v in counts if v not in kept],
+                                  key=_sqlite_sort_key)]
+                value_counts[i] = Counter(kept)
+            if numeric[i]:
+                try:
+                    numbers = [float(v) for v in values if v is not None and v != '']
+                except (TypeError, ValueError):
+                    numeric[i] = False
+                    continue
+                if numbers:
+                    sums[i] += sum(numbers)
+                    low, high = min(numbers), max(numbers)
+                    if numeric_range[i] is not None:
+                        low = min(low, numeric_range[i][0])
+                        high = max(high, numeric_range[i][1])
+                    numeric_range[i] = (low, high)
+    
+    statistics = {}
+    for i, column in enumerate(columns):
+        counts = value_counts[i]
+        non_null = total_rows - null_counts[i]
+        column_stats: Dict[str, Any] = {"空值数": null_counts[i], "去重数": len(counts)}
+        if evicted[i]:
+            column_stats["去重数为下限"] = True
+        if non_null and numeric[i]:
+            column_stats.update(
+                最小值=int(numeric_range[i][0]) if numeric_range[i][0].is_integer()
+                else numeric_range[i][0],
+                最大值=int(numeric_range[i][1]) if numeric_range[i][1].is_integer()
+                else numeric_range[i][1],
+                平均值=round(sums[i] / non_null, 4)
+            )
+        elif non_null:
+            candidates = list(counts) + evicted[i]
+            column_stats.update(最小值=min(candidates, key=_sqlite_sort_key),
+                                最大值=max(candidates, key=_sqlite_sort_key))
+        # 只出现一次的取值（如编号）不算高频取值
+        column_stats["高频取值"] = [
+            {"取值": value, "次数": count}
+            for value, count in counts.most_common(RESULT_SUMMARY_CONFIG["top_values"])
+            if count > 1
+        ]
+        statistics[column] = column_stats
+    
+    return {
+        "总行数": total_rows,
+        "字段统计": statistics,
+        "代表性样本": [dict(zip(columns, row)) for _, row in sorted(sample, key=lambda x: x[0])],
+        "样本说明": f"从 {total_rows} 行中等概率抽取 {min(sample_size, total_rows)} 行，按原顺序排列"
+    }
+
+
 class GarbageMonitoringDB:
     """垃圾监管数据库操作类"""
     
@@ -47,42 +307,934 @@ class GarbageMonitoringDB:
         "清运小区对应": "clearance_community_mapping"
     }
     
-    def __init__(self, db_path: str = "garbage_monitoring.db"):
+    # 系统维护的元数据表前缀，不属于业务数据
+    META_TABLE_PREFIX = "meta_"
+    
+    # 按月分区文件名：YYYY-MM.db，早于最近几个月的数据合并在history.db，
+    # 时间字段无法解析的行存入undated.db
+    PARTITION_FILE_PATTERN = re.compile(r"^(\d{4}-\d{2}|history|undated)\.db$")
+    HISTORY_PARTITION = "history"
+    UNDATED_PARTITION = "undated"
+    
+    # 可归档的表：记录主键，及"已结束"条件（None表示记录一经产生即已结束）
+    ARCHIVE_SOURCES = {
+        # 清运记录没有处置状态，装车后称重的重量可能补录，已称重的记录视为结束
+        "garbage_data": {"key": "id", "closed": "garbage_weight IS NOT NULL AND garbage_weight != ''"},
+        "small_package_garbage": {"key": "event_id", "closed": "is_handle = 'TRUE'"},
+        "garbage_bin_overflow": {"key": "event_id", "closed": "is_handle = 'TRUE'"},
+        "decoration_garbage_old": {"key": "bg_order_id", "closed": "order_state = '7'"},
+        "decoration_garbage_new": {"key": "appointment_order_id", "closed": "order_state = '已完成'"}
+    }
+    
+    # 各表用于统计日期范围的时间字段
+    TABLE_TIME_COLUMNS = {
+        "garbage_data": "load_time_str",
+        "small_package_garbage": "drop_time",
+        "garbage_bin_overflow": "full_time",
+        "decoration_garbage_old": "create_time_str",
+        "decoration_garbage_new": "create_order_time",
+        "inspection_details": "createtime",
+        "contract_details": "declare_date"
+    }
+    
+    # 数据画像中由HyperLogLog/Bloom过滤器估计的字段
+    PROFILE_ESTIMATED_FIELDS = ("唯一值数量", "重复值种类", "重复值总行数", "重复率(%)")
+    
+    # 预先计算去重草图的表：按(日期, 街道, 垃圾类型)分组，对各字段分别建草图
+    DISTINCT_SKETCH_COLUMNS = {
+        "garbage_data": ["vehicle_license_num", "community_name"]
+    }
+    
+    # 可按时间分桶统计的事件表：分组维度（字段名 -> 中文名）和可求和的度量
+    # 度量为None的表只支持count；小时桶中维度值依次存放在d0、d1、d2字段
+    TIME_SERIES_SOURCES = {
+        "garbage_data": {
+            "dimensions": {"street_name": "街道", "type_name": "垃圾类型", "car_group_name": "车队"},
+            "measure": ("CAST(garbage_weight AS FLOAT)", "清运量")
+        },
+        "garbage_bin_overflow": {
+            "dimensions": {"division_name": "区划", "is_handle": "是否处理", "is_timeout": "是否超时"},
+            "measure": None
+        },
+        "small_package_garbage": {
+            "dimensions": {"division_name": "区划", "is_handle": "是否处理", "is_timeout": "是否超时"},
+            "measure": ("CAST(NULLIF(take_minutes, '') AS FLOAT)", "处理时长（分钟）")
+        },
+        "decoration_garbage_old": {
+            "dimensions": {"street_name": "街道", "order_state_desc": "工单状态"},
+            "measure": ("CAST(NULLIF(garbage_weight, '') AS FLOAT)", "垃圾量")
+        },
+        "decoration_garbage_new": {
+            "dimensions": {"street_name": "街道", "order_state": "工单状态", "decoration_stage": "装修阶段"},
+            "measure": ("CAST(NULLIF(appointment_bags_number, '') AS FLOAT)", "预约袋数")
+        }
+    }
+    
+    # 可做Top-K排行的事件表：排名字段（字段名 -> 中文名）和细分字段
+    # 计数和度量（取自TIME_SERIES_SOURCES）按(排名字段, 细分值, 日期)预先汇总，
+    # 细分值与日期为'*'的行是全部汇总
+    TOP_K_SOURCES = {
+        "garbage_data": {
+            "keys": {"street_name": "街道", "community_name": "小区",
+                     "vehicle_license_num": "车牌号", "car_group_name": "车队"},
+            "segment": "type_name"
+        },
+        "garbage_bin_overflow": {
+            "keys": {"station_name": "垃圾房", "community_name": "小区", "division_name": "区划"},
+            "segment": None
+        },
+        "small_package_garbage": {
+            "keys": {"station_name": "垃圾房", "community_name": "小区", "division_name": "区划"},
+            "segment": None
+        },
+        "decoration_garbage_old": {
+            "keys": {"street_name": "街道", "community_name": "小区", "vehicle_license_num": "车牌号"},
+            "segment": None
+        },
+        "decoration_garbage_new": {
+            "keys": {"street_name": "街道", "community_name": "小区"},
+            "segment": None
+        }
+    }
+    
+    # 小时桶合并到各时间粒度时的分桶表达式，周以周一日期标识
+    TIME_SERIES_BUCKETS = {
+        "hour": "hour",
+        "day": "substr(hour, 1, 10)",
+        "week": "date(substr(hour, 1, 10), 'weekday 0', '-6 days')",
+        "month": "substr(hour, 1, 7)"
+    }
+    
+    # get_street_clearance_statistics可选的附加统计维度及其中文列名
+    CLEARANCE_EXTRA_DIMENSIONS = {
+        "community_type_name": "小区类型",
+        "car_group_name": "车队"
+    }
+    
+    # 问题状态表的来源：事件表 -> 发生时间字段
+    OPEN_ISSUE_SOURCES = {
+        "small_package_garbage": "drop_time",
+        "garbage_bin_overflow": "full_time"
+    }
+    
+    # 工单查询中新旧两种模式的表结构差异
+    ORDER_MODE_SPECS = {
+        "老模式": {
+            "table": "decoration_garbage_old",
+            "status_column": "order_state_desc",
+            "overtime_count": "COUNT(CASE WHEN is_over_time = '是' THEN 1 END)",
+            "detail_columns": """
+            CAST(bg_order_id AS TEXT) AS 订单号,
+            street_name AS 街道,
+            community_name AS 小区,
+            order_state_desc AS 状态,
+            create_time_str AS 创建时间,
+            estimate_clear_time_str AS 预约时间,
+            finish_time_str AS 完成时间,
+            CASE WHEN is_over_time = '是' THEN '是' ELSE '否' END AS 是否超时
+            """
+        },
+        "新模式": {
+            "table": "decoration_garbage_new",
+            "status_column": "order_state",
+            "overtime_count": "NULL",
+            "detail_columns": """
+            appointment_order_id AS 订单号,
+            street_name AS 街道,
+            community_name AS 小区,
+            order_state AS 状态,
+            create_order_time AS 创建时间,
+            resident_appointment_time AS 预约时间,
+            NULL AS 完成时间,
+            NULL AS 是否超时
+            """
+        }
+    }
+    
+    # 逾期问题按统计截至时间缓存的结果条数
+    OVERDUE_CACHE_SIZE = 32
+    
+    def __init__(self, db_path: str = "garbage_monitoring.db",
+                 partitioned: Optional[bool] = None,
+                 serve_from_memory: Optional[bool] = None,
+                 storage_profile: Optional[str] = None,
+                 read_only: bool = False):
         """
         初始化数据库连接
         
         Args:
             db_path: SQLite数据库文件路径
+            partitioned: 是否按月分区存储事件表，默认取PARTITION_CONFIG的设置
+            serve_from_memory: 是否把数据库复制到内存中提供查询，默认取MEMORY_SERVING_CONFIG的设置
+            storage_profile: 存储I/O配置档名称，默认取DATABASE_CONFIG["storage_profile"]
+            read_only: 以只读方式打开已初始化的数据库（供只读工作进程使用），不创建表和元数据
         """
+        self.storage_profile = storage_profile or DATABASE_CONFIG["storage_profile"]
+        if self.storage_profile not in STORAGE_PROFILES:
+            raise ValueError(
+                f"未知的存储配置档: {self.storage_profile}，可选值: {list(STORAGE_PROFILES)}"
+            )
         self.db_path = db_path
+        self.read_only = read_only
         self.connection = None
         self.data_dir = "./data/"
+        # 连接在多个工作线程间共享，语句执行需串行化
+        self._lock = threading.RLock()
+        # 每个线程各自的截止时间与取消标记，由进度回调读取
+        self._local = threading.local()
+        # 慢查询日志，超过阈值的查询连同执行计划写入滚动日志文件
+        self.slow_query_threshold_ms = SLOW_QUERY_CONFIG["threshold_ms"]
+        self.slow_query_log_path = SLOW_QUERY_CONFIG["log_file"]
+        self._slow_query_handler = None
+        # 元数据目录缓存：(PRAGMA data_version, 目录)，其他连接提交后自动失效
+        self._catalog_cache: Optional[Tuple[int, Dict[str, Dict[str, Any]]]] = None
+        # 指定as_of的逾期问题结果：as_of -> (PRAGMA data_version, 结果)，导入时清空
+        self._overdue_cache: "OrderedDict[str, Tuple[int, Dict[str, Any]]]" = OrderedDict()
+        # garbage_data的NumPy分析缓存，未启用时为None；记录上次同步时的data_version
+        self.analytics_cache: "Optional[GarbageAnalyticsCache]" = None
+        self._analytics_data_version: Optional[int] = None
+        # 按月分区：分区文件目录、已附加的分区（月份 -> 别名）和临时视图当前覆盖的月份
+        self.partitioned = PARTITION_CONFIG["enabled"] if partitioned is None else partitioned
+        self.partition_dir = os.path.join(
+            os.path.dirname(os.path.abspath(db_path)), PARTITION_CONFIG["directory"]
+        )
+        self._attached_partitions: Dict[str, Set[str]] = {}
+        self._partition_view_months: Optional[Tuple[str, ...]] = None
+        # 冷数据归档库，以及已解压到临时表的归档数据版本：表名 -> (块数, 最大块ID)
+        self.archive_path = os.path.join(
+            os.path.dirname(os.path.abspath(db_path)), ARCHIVE_CONFIG["path"]
+        )
+        self._archive_loaded: Dict[str, Tuple[int, int]] = {}
+        # 内存服务：磁盘库连接（仅用于做快照和写入）、当前快照的URI和磁盘库的data_version
+        self.serve_from_memory = (MEMORY_SERVING_CONFIG["enabled"] if serve_from_memory is None
+                                  else serve_from_memory)
+        self._disk_connection: Optional[sqlite3.Connection] = None
+        self._snapshot_uri: Optional[str] = None
+        self._snapshot_count = 0
+        self._snapshot_lock = threading.RLock()
+        self._disk_data_version: Optional[int] = None
+        self._last_snapshot_check = 0.0
         
         # 检查数据库是否需要初始化
         db_exists = os.path.exists(db_path)
+        if read_only and not db_exists:
+            raise FileNotFoundError(f"只读模式要求数据库已初始化: {db_path}")
         
         self.connect()
+        if not read_only:
+            self._ensure_meta_tables()
         
         if not db_exists:
             logger.info("数据库文件不存在，开始初始化数据库...")
             self.initialize_database()
+        
+        if self.partitioned:
+            if not read_only:
+                self._compact_partitions()
+            self._route_partitions()
+        
+        if self.serve_from_memory:
+            if self.partitioned:
+                raise ValueError("内存服务模式不支持分区存储")
+            self._disk_connection = self.connection
+            self.refresh_snapshot()
+        
+        if ANALYTICS_CACHE_CONFIG["enabled"]:
+            self.enable_analytics_cache()
     
     def connect(self):
         """建立数据库连接"""
         try:
-            self.connection = sqlite3.connect(self.db_path, check_same_thread=False)
-            self.connection.row_factory = sqlite3.Row  # 返回字典格式结果
+            # uri=True使分区文件可以 file:...?mode=ro 的形式只读附加
+            path = self.db_path
+            if self.read_only:
+                path = "file:" + urllib.parse.quote(os.path.abspath(self.db_path)) + "?mode=ro"
+            self.connection = sqlite3.connect(
+                path,
+                timeout=DATABASE_CONFIG["connection_timeout"],
+                check_same_thread=DATABASE_CONFIG["check_same_thread"],
+                uri=True
+            )
+            self._configure_connection(self.connection)
             logger.info(f"成功连接到数据库: {self.db_path}")
         except Exception as e:
             logger.error(f"数据库连接失败: {e}")
             raise
     
+    def _configure_connection(self, connection: sqlite3.Connection):
+        """设置服务连接的结果格式、进度回调和存储配置档"""
+        connection.row_factory = sqlite3.Row  # 返回字典格式结果
+        # 通过进度回调在SQLite内部检查截止时间和取消标记
+        connection.set_progress_handler(
+            self._check_deadline, QUERY_TIMEOUT_CONFIG["progress_handler_steps"]
+        )
+        self._apply_storage_profile(connection)
+    
+    def _apply_storage_profile(self, connection: sqlite3.Connection, schema: str = "main"):
+        """
+        在连接上设置存储配置档中的PRAGMA
+        
+        page_size只在库还是空的（新建）时设置，对已有数据库设置不起作用，
+        需通过_vacuum重建后才会改变。
+        
+        Args:
+            connection: 数据库连接
+            schema: 按库生效的PRAGMA（page_size、cache_size、mmap_size）作用的库名，
+                    附加的分区库需单独设置；temp_store对整个连接生效，只随main设置
+        """
+        profile = STORAGE_PROFILES[self.storage_profile]
+        if "page_size" in profile and \
+                connection.execute(f"PRAGMA {schema}.page_count").fetchone()[0] == 0:
+            connection.execute(f"PRAGMA {schema}.page_size = {int(profile['page_size'])}")
+        for name in ("cache_size", "mmap_size"):
+            if name in profile:
+                connection.execute(f"PRAGMA {schema}.{name} = {int(profile[name])}")
+        if schema == "main" and "temp_store" in profile:
+            connection.execute(f"PRAGMA temp_store = {profile['temp_store']}")
+    
+    def _vacuum(self):
+        """VACUUM主库回收空间，重建前设置配置档的page_size，已有数据库借此改变页大小"""
+        page_size = STORAGE_PROFILES[self.storage_profile].get("page_size")
+        with self._lock:
+            if page_size:
+                self.connection.execute(f"PRAGMA main.page_size = {int(page_size)}")
+            self.connection.execute("VACUUM")
+    
+    def get_storage_diagnostics(self) -> Dict[str, Any]:
+        """
+        查看存储I/O配置档及服务连接上实际生效的PRAGMA
+        
+        Returns:
+            配置档、配置值、生效值、数据库大小和配置未完全生效的说明
+        """
+        profile = STORAGE_PROFILES[self.storage_profile]
+        names = ["page_size", "cache_size", "mmap_size", "temp_store", "journal_mode",
+                 "busy_timeout", "page_count", "freelist_count"]
+        with self._lock:
+            effective = {
+                name: self.connection.execute(f"PRAGMA {name}").fetchone()[0] for name in names
+            }
+        effective["temp_store"] = {0: "DEFAULT", 1: "FILE", 2: "MEMORY"}.get(
+            effective["temp_store"], effective["temp_store"])
+        db_size = effective["page_count"] * effective["page_size"]
+        in_memory = self._disk_connection is not None
+        
+        notes = []
+        if profile.get("page_size") and effective["page_size"] != profile["page_size"]:
+            notes.append(f"当前page_size为{effective['page_size']}，配置为{profile['page_size']}；"
+                         f"page_size只在新建数据库和VACUUM（如冷数据归档后）时设置，已有数据库需VACUUM后才会改变")
+        if not in_memory and profile.get("mmap_size"):
+            if effective["mmap_size"] == 0:
+                notes.append("SQLite编译时禁用了内存映射，读取仍经页缓存复制")
+            elif effective["mmap_size"] < db_size:
+                notes.append("内存映射小于数据库大小，超出部分仍经页缓存读取")
+        
+        return {
+            "配置档": self.storage_profile,
+            "可选配置档": list(STORAGE_PROFILES),
+            "配置值": profile,
+            "生效值": effective,
+            "数据库大小MB": round(db_size / 1024 / 1024, 2),
+            "服务模式": "内存快照" if in_memory else "磁盘",
+            "说明": notes
+        }
+    
+    def refresh_snapshot(self) -> Dict[str, Any]:
+        """
+        用backup API把磁盘库完整复制到新的共享内存库，再原子地切换服务连接
+        
+        复制期间查询继续读取旧快照，切换后关闭旧快照；按连接缓存的目录、
+        逾期结果和分析缓存随之失效。
+        
+        Returns:
+            快照信息，包括耗时和数据库大小
+        """
+        if self._disk_connection is None:
+            raise RuntimeError("未启用内存服务模式")
+        with self._snapshot_lock:
+            start = time.perf_counter()
+            self._snapshot_count += 1
+            uri = (f"file:garbage_monitoring_{id(self)}_{self._snapshot_count}"
+                   f"?mode=memory&cache=shared")
+            snapshot = sqlite3.connect(uri, check_same_thread=False, uri=True)
+            self._disk_connection.backup(snapshot)
+            self._configure_connection(snapshot)
+            version = self._disk_connection.execute("PRAGMA data_version").fetchone()[0]
+            
+            with self._lock:
+                previous = self.connection
+                self.connection = snapshot
+                self._snapshot_uri = uri
+                self._catalog_cache = None
+                self._overdue_cache.clear()
+                self._archive_loaded.clear()
+                if self.analytics_cache:
+                    self.analytics_cache.connection = snapshot
+                    self.analytics_cache.invalidate()
+                    self._analytics_data_version = None
+            if previous is not self._disk_connection:
+                previous.close()
+            self._disk_data_version = version
+            self._last_snapshot_check = time.monotonic()
+            
+            page_count = snapshot.execute("PRAGMA page_count").fetchone()[0]
+            page_size = snapshot.execute("PRAGMA page_size").fetchone()[0]
+            info = {
+                "快照序号": self._snapshot_count,
+                "快照耗时ms": round((time.perf_counter() - start) * 1000, 2),
+                "数据库大小MB": round(page_count * page_size / 1024 / 1024, 2)
+            }
+        logger.info(f"内存快照已更新: {info}")
+        return info
+    
+    def _check_snapshot(self):
+        """内存服务模式下，按间隔检查磁盘库是否被其他连接更新，有更新时重新做快照"""
+        now = time.monotonic()
+        if now - self._last_snapshot_check < MEMORY_SERVING_CONFIG["check_interval_seconds"]:
+            return
+        # 读事务进行中不切换快照，另一个线程正在做快照时也不重复检查
+        if self.connection.in_transaction or not self._snapshot_lock.acquire(blocking=False):
+            return
+        try:
+            self._last_snapshot_check = now
+            version = self._disk_connection.execute("PRAGMA data_version").fetchone()[0]
+            if version != self._disk_data_version:
+                logger.info("磁盘库已被其他连接更新，重新做内存快照")
+                self.refresh_snapshot()
+        finally:
+            self._snapshot_lock.release()
+    
+    @contextmanager
+    def _writing_to_disk(self):
+        """
+        内存服务模式下，在上下文内把服务连接指向磁盘库，写入结束后重新做快照
+        
+        上下文期间持有连接锁，其他线程的查询等待写入完成后读取新快照。
+        """
+        if self.partitioned:
+            # 维护元数据的方法直接读取整表，期间临时视图须覆盖全部分区
+            with self._lock:
+                self._route_partitions()
+                yield
+            return
+        if self._disk_connection is None or getattr(self._local, "writing_to_disk", False):
+            yield
+            return
+        with self._snapshot_lock, self._lock:
+            serving = self.connection
+            self.connection = self._disk_connection
+            self._local.writing_to_disk = True
+            try:
+                yield
+            finally:
+                self._local.writing_to_disk = False
+                self.connection = serving
+            self.refresh_snapshot()
+    
+    def _ensure_meta_tables(self):
+        """创建导入时维护的元数据表"""
+        with self._lock:
+            self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS meta_column_profile (
+                table_name TEXT NOT NULL,
+                column_name TEXT NOT NULL,
+                column_type TEXT,
+                column_comment TEXT,
+                total_rows INTEGER,
+                null_count INTEGER,
+                empty_count INTEGER,
+                distinct_count INTEGER,
+                duplicate_kinds INTEGER,
+                duplicate_rows INTEGER,
+                min_value,
+                max_value,
+                profiled_at TEXT,
+                PRIMARY KEY (table_name, column_name)
+            )
+            """)
+            self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS meta_table_catalog (
+                table_name TEXT PRIMARY KEY,
+                row_count INTEGER NOT NULL,
+                time_column TEXT,
+                min_time TEXT,
+                max_time TEXT,
+                distinct_days INTEGER,
+                updated_at TEXT
+            )
+            """)
+            self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS meta_distinct_sketch (
+                table_name TEXT NOT NULL,
+                day TEXT NOT NULL,
+                street_name TEXT,
+                type_name TEXT,
+                column_name TEXT NOT NULL,
+                precision INTEGER NOT NULL,
+                registers BLOB NOT NULL,
+                PRIMARY KEY (table_name, day, street_name, type_name, column_name)
+            )
+            """)
+            self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS meta_hourly_buckets (
+                table_name TEXT NOT NULL,
+                hour TEXT NOT NULL,
+                d0 TEXT,
+                d1 TEXT,
+                d2 TEXT,
+                event_count INTEGER NOT NULL,
+                measure_sum REAL,
+                measure_count INTEGER NOT NULL
+            )
+            """)
+            self.connection.execute("""
+            CREATE INDEX IF NOT EXISTS idx_meta_hourly_buckets
+            ON meta_hourly_buckets (table_name, hour)
+            """)
+            self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS meta_topk_counters (
+                table_name TEXT NOT NULL,
+                key_column TEXT NOT NULL,
+                segment TEXT NOT NULL,
+                day TEXT NOT NULL,
+                key_value TEXT NOT NULL,
+                event_count INTEGER NOT NULL,
+                measure_sum REAL
+            )
+            """)
+            self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS meta_topk_thresholds (
+                table_name TEXT NOT NULL,
+                key_column TEXT NOT NULL,
+                segment TEXT NOT NULL,
+                day TEXT NOT NULL,
+                max_dropped_count INTEGER,
+                max_dropped_sum REAL,
+                PRIMARY KEY (table_name, key_column, segment, day)
+            )
+            """)
+            # 全部汇总行上的排行只需沿索引读取前K条
+            self.connection.execute("""
+            CREATE INDEX IF NOT EXISTS idx_meta_topk_count
+            ON meta_topk_counters (table_name, key_column, segment, day, event_count DESC, key_value)
+            """)
+            self.connection.execute("""
+            CREATE INDEX IF NOT EXISTS idx_meta_topk_measure
+            ON meta_topk_counters (table_name, key_column, segment, day, measure_sum DESC, key_value)
+            """)
+            self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS meta_community_ewma (
+                community_name TEXT PRIMARY KEY,
+                street_name TEXT,
+                first_day TEXT NOT NULL,
+                last_day TEXT NOT NULL,
+                days_observed INTEGER NOT NULL,
+                ewma_mean REAL NOT NULL,
+                ewma_var REAL NOT NULL,
+                last_weight REAL,
+                expected_weight REAL,
+                expected_std REAL,
+                z_score REAL,
+                updated_at TEXT
+            )
+            """)
+            self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS meta_archived_keys (
+                table_name TEXT NOT NULL,
+                key_value TEXT NOT NULL,
+                PRIMARY KEY (table_name, key_value)
+            ) WITHOUT ROWID
+            """)
+            self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS meta_community_ewma_days (
+                day TEXT PRIMARY KEY,
+                row_count INTEGER NOT NULL,
+                weight_sum REAL NOT NULL
+            )
+            """)
+            # 早期版本按REAL亲和性保存处置耗时，整数被转换为浮点数；问题状态表可由数据表重建
+            declared = {row[1]: row[2] for row in
+                        self.connection.execute("PRAGMA table_info(meta_open_issues)")}
+            if declared.get("take_minutes") == "REAL":
+                self.connection.execute("DROP TABLE meta_open_issues")
+            self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS meta_open_issues (
+                source TEXT NOT NULL,
+                event_id TEXT NOT NULL,
+                station_name TEXT,
+                division_name TEXT,
+                community_name TEXT,
+                opened_at TEXT,
+                closed_at TEXT,
+                is_handle TEXT,
+                is_timeout TEXT,
+                take_minutes,
+                PRIMARY KEY (source, event_id)
+            )
+            """)
+            self.connection.execute("""
+            CREATE INDEX IF NOT EXISTS idx_meta_open_issues_opened
+            ON meta_open_issues (source, opened_at)
+            """)
+            self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS meta_table_days (
+                table_name TEXT NOT NULL,
+                day TEXT NOT NULL,
+                row_count INTEGER NOT NULL,
+                PRIMARY KEY (table_name, day)
+            )
+            """)
+            self.connection.commit()
+    
+    def _on_table_loaded(self, table_name: str,
+                         column_comments: Optional[Dict[str, str]] = None):
+        """
+        表数据导入完成后的钩子，更新该表的元数据
+        
+        Args:
+            table_name: 表格名称
+            column_comments: 字段名到中文注释的映射，为None时保留已有注释
+        """
+        try:
+            with self._lock:
+                profiles = _profile_table(self.connection, table_name)
+            self._store_table_profile(table_name, profiles, column_comments)
+        except Exception as e:
+            logger.error(f"更新表 {table_name} 的数据画像失败: {e}")
+        
+        try:
+            self.refresh_table_catalog(table_name)
+        except Exception as e:
+            logger.error(f"更新表 {table_name} 的元数据目录失败: {e}")
+        
+        if table_name in self.TIME_SERIES_SOURCES:
+            try:
+                self.refresh_hourly_buckets(table_name)
+            except Exception as e:
+                logger.error(f"更新表 {table_name} 的小时桶失败: {e}")
+        
+        if table_name in self.TOP_K_SOURCES:
+            try:
+                self.refresh_topk_counters(table_name)
+            except Exception as e:
+                logger.error(f"更新表 {table_name} 的Top-K计数失败: {e}")
+        
+        if table_name in self.OPEN_ISSUE_SOURCES:
+            try:
+                self.refresh_open_issues(table_name)
+            except Exception as e:
+                logger.error(f"更新表 {table_name} 的问题状态失败: {e}")
+        
+        if table_name == "garbage_data":
+            try:
+                self.update_community_ewma()
+            except Exception as e:
+                logger.error(f"更新小区清运量滚动统计失败: {e}")
+        
+        if table_name in self.DISTINCT_SKETCH_COLUMNS:
+            try:
+                self.refresh_distinct_sketches(table_name)
+            except Exception as e:
+                logger.error(f"更新表 {table_name} 的去重草图失败: {e}")
+        
+        if self.analytics_cache and table_name == self.analytics_cache.TABLE_NAME:
+            self._refresh_analytics_cache()
+    
+    @_writes_to_disk
+    def fill_missing_metadata(self) -> List[str]:
+        """
+        补齐查询时会按需计算并保存的元数据
+        
+        目录、数据画像、小时桶、Top-K计数、问题状态、去重草图和小区滚动统计通常在导入时维护，
+        缺失时查询方法会先计算并写入。只读连接不能写入，因此在启动只读工作进程前先调用本方法。
+        
+        Returns:
+            补齐的元数据项，形如 "topk:garbage_data"
+        """
+        tables = set(self._list_data_tables())
+        precision = DISTINCT_SKETCH_CONFIG["precision"]
+        
+        def missing(query: str, *params) -> bool:
+            with self._lock:
+                return self.connection.execute(query, params).fetchone() is None
+        
+        filled = []
+        self.get_table_catalog()
+        for table_name in sorted(tables):
+            if missing("SELECT 1 FROM meta_column_profile WHERE table_name = ? LIMIT 1", table_name):
+                self._store_table_profile(table_name, self._profile_table_isolated(table_name))
+                filled.append(f"profile:{table_name}")
+        for table_name in tables & set(self.TIME_SERIES_SOURCES):
+            if missing("SELECT 1 FROM meta_hourly_buckets WHERE table_name = ? LIMIT 1", table_name):
+                self.refresh_hourly_buckets(table_name)
+                filled.append(f"hourly:{table_name}")
+        for table_name in tables & set(self.TOP_K_SOURCES):
+            if missing("SELECT 1 FROM meta_topk_counters WHERE table_name = ? LIMIT 1", table_name):
+                self.refresh_topk_counters(table_name)
+                filled.append(f"topk:{table_name}")
+        for table_name in tables & set(self.OPEN_ISSUE_SOURCES):
+            if missing("SELECT 1 FROM meta_open_issues WHERE source = ? LIMIT 1", table_name):
+                self.refresh_open_issues(table_name)
+                filled.append(f"open_issues:{table_name}")
+        for table_name in tables & set(self.DISTINCT_SKETCH_COLUMNS):
+            if missing("SELECT 1 FROM meta_distinct_sketch WHERE table_name = ? AND precision = ? LIMIT 1",
+                       table_name, precision):
+                self.refresh_distinct_sketches(table_name)
+                filled.append(f"sketch:{table_name}")
+        if "garbage_data" in tables and missing("SELECT 1 FROM meta_community_ewma LIMIT 1"):
+            self.update_community_ewma()
+            filled.append("ewma:garbage_data")
+        if filled:
+            logger.info(f"已补齐元数据: {filled}")
+        return filled
+    
+    @_writes_to_disk
+    def refresh_table_catalog(self, table_name: str):
+        """
+        重新统计一张表的行数、时间范围和按日行数，写入元数据目录
+        
+        Args:
+            table_name: 表格名称
+        """
+        time_column = self.TABLE_TIME_COLUMNS.get(table_name)
+        with self._lock:
+            cursor = self.connection.cursor()
+            cursor.execute(f'SELECT COUNT(*) FROM "{table_name}"')
+            row_count = cursor.fetchone()[0]
+            
+            days = []
+            min_time = max_time = None
+            if time_column:
+                # 一次分组扫描同时得到按日行数和整体时间范围
+                cursor.execute(f"""
+                SELECT DATE({time_column}) AS day, COUNT(*) AS n,
+                       MIN({time_column}) AS min_time, MAX({time_column}) AS max_time
+                FROM "{table_name}"
+                WHERE {time_column} IS NOT NULL AND {time_column} != ''
+                GROUP BY DATE({time_column})
+                HAVING day IS NOT NULL
+                """)
+                days = cursor.fetchall()
+                if days:
+                    min_time = min(row["min_time"] for row in days)
+                    max_time = max(row["max_time"] for row in days)
+            
+            cursor.execute("DELETE FROM meta_table_days WHERE table_name = ?", (table_name,))
+            cursor.executemany(
+                "INSERT INTO meta_table_days (table_name, day, row_count) VALUES (?, ?, ?)",
+                [(table_name, row["day"], row["n"]) for row in days]
+            )
+            cursor.execute("""
+            INSERT OR REPLACE INTO meta_table_catalog (
+                table_name, row_count, time_column, min_time, max_time, distinct_days, updated_at
+            ) VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (table_name, row_count, time_column, min_time, max_time,
+                  len(days), datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+            self.connection.commit()
+            self._catalog_cache = None
+    
+    @_writes_to_disk
+    def refresh_distinct_sketches(self, table_name: str = "garbage_data"):
+        """
+        重新计算一张表按(日期, 街道, 垃圾类型)分组的HyperLogLog去重草图
+        
+        Args:
+            table_name: 表格名称，需在DISTINCT_SKETCH_COLUMNS中
+        """
+        from hyperloglog import HyperLogLog
+        
+        time_column = self.TABLE_TIME_COLUMNS[table_name]
+        precision = DISTINCT_SKETCH_CONFIG["precision"]
+        rows = []
+        with self._lock:
+            cursor = self.connection.cursor()
+            for column in self.DISTINCT_SKETCH_COLUMNS[table_name]:
+                cursor.execute(f"""
+                SELECT DISTINCT DATE({time_column}) AS day, street_name, type_name, {column} AS value
+                FROM "{table_name}"
+                WHERE DATE({time_column}) IS NOT NULL AND {column} IS NOT NULL
+                """)
+                sketches: Dict[Tuple, HyperLogLog] = {}
+                hashes: Dict[Any, int] = {}
+                for day, street, type_name, value in cursor.fetchall():
+                    sketch = sketches.get((day, street, type_name))
+                    if sketch is None:
+                        sketch = sketches[(day, street, type_name)] = HyperLogLog(precision)
+                    if value not in hashes:
+                        hashes[value] = HyperLogLog.hash_value(value)
+                    sketch.add_hash(hashes[value])
+                rows.extend(
+                    (table_name, day, street, type_name, column, precision, sketch.to_bytes())
+                    for (day, street, type_name), sketch in sketches.items()
+                )
+            
+            cursor.execute("DELETE FROM meta_distinct_sketch WHERE table_name = ?", (table_name,))
+            cursor.executemany("""
+            INSERT INTO meta_distinct_sketch (
+                table_name, day, street_name, type_name, column_name, precision, registers
+            ) VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, rows)
+            self.connection.commit()
+        logger.info(f"已更新表 {table_name} 的去重草图，共 {len(rows)} 个")
+    
+    def estimate_distinct_counts(self, table_name: str, column: str,
+                                 groups: Dict[Any, List[Tuple[str, Any, Any]]]) -> Dict[Any, int]:
+        """
+        合并按日草图，近似计算各分组的去重数量
+        
+        Args:
+            table_name: 表格名称
+            column: 去重字段
+            groups: 分组键到其覆盖的(日期, 街道, 垃圾类型)列表的映射
+            
+        Returns:
+            分组键到去重数量估计值的映射
+        """
+        precision = DISTINCT_SKETCH_CONFIG["precision"]
+        days = {key[0] for keys in groups.values() for key in keys}
+        if not days:
+            return {group: 0 for group in groups}
+        
+        with self._lock:
+            sketched = self.connection.execute("""
+            SELECT COUNT(*) FROM meta_distinct_sketch
+            WHERE table_name = ? AND column_name = ? AND precision = ?
+            """, (table_name, column, precision)).fetchone()[0]
+        # 草图缺失或精度配置变化时先重新计算；写入前不持有连接锁，内存服务模式下
+        # 写入会先取快照锁再取连接锁，并在结束后切换到新的快照连接
+        if sketched == 0:
+            self.refresh_distinct_sketches(table_name)
+        with self._lock:
+            cursor = self.connection.cursor()
+            cursor.execute("""
+            SELECT day, street_name, type_name, registers FROM meta_distinct_sketch
+            WHERE table_name = ? AND column_name = ? AND precision = ? AND day BETWEEN ? AND ?
+            """, (table_name, column, precision, min(days), max(days)))
+            registers = {(row[0], row[1], row[2]): row[3] for row in cursor.fetchall()}
+        
+        from hyperloglog import HyperLogLog
+        
+        estimates = {}
+        for group, keys in groups.items():
+            merged = HyperLogLog(precision)
+            for key in keys:
+                if key in registers:
+                    merged.merge(HyperLogLog.from_bytes(registers[key], precision))
+            estimates[group] = merged.count()
+        return estimates
+    
+    @staticmethod
+    def _approximate_distinct_note() -> str:
+        """近似去重计数的说明文字"""
+        from hyperloglog import HyperLogLog
+        
+        error = HyperLogLog(DISTINCT_SKETCH_CONFIG["precision"]).standard_error
+        return f"近似（HyperLogLog按日草图合并，相对标准误差约{error:.1%}）"
+    
+    def get_table_catalog(self) -> Dict[str, Dict[str, Any]]:
+        """
+        读取元数据目录，结果缓存在进程内
+        
+        通过PRAGMA data_version判断其他连接是否提交过修改，
+        未变化时直接返回缓存；缺少目录记录的数据表会先补齐。
+        读快照（read_snapshot）中不补齐，返回的目录缺少这些表，以免提交打断快照。
+        
+        Returns:
+            表名到目录记录的映射
+        """
+        with self._lock:
+            version = self.connection.execute("PRAGMA data_version").fetchone()[0]
+            if self._catalog_cache is not None and self._catalog_cache[0] == version:
+                return self._catalog_cache[1]
+            
+            cursor = self.connection.cursor()
+            cursor.execute("SELECT * FROM meta_table_catalog")
+            catalog = {row["table_name"]: dict(row) for row in cursor.fetchall()}
+            missing = [t for t in self._list_data_tables() if t not in catalog]
+            if not missing:
+                self._catalog_cache = (version, catalog)
+                return catalog
+            if self.connection.in_transaction:
+                return catalog
+        
+        # 补齐在释放连接锁之后进行，与内存服务模式下写入的加锁顺序（快照锁、连接锁）一致
+        logger.info(f"补齐元数据目录: {missing}")
+        for table_name in missing:
+            self.refresh_table_catalog(table_name)
+        return self.get_table_catalog()
+    
+    def enable_analytics_cache(self, max_memory_mb: Optional[float] = None) -> Dict[str, Any]:
+        """
+        启用garbage_data的NumPy分析缓存并完成首次加载
+        
+        Args:
+            max_memory_mb: 内存预算（MB），默认取配置
+            
+        Returns:
+            缓存状态；超出内存预算或使用分区存储时缓存不启用，统计查询继续走SQL
+        """
+        if self.partitioned:
+            # 缓存按rowid增量同步，分区表的临时视图没有rowid
+            logger.warning("分区存储模式下不支持分析缓存，统计查询继续走SQL")
+            return {"已加载": False, "说明": "分区存储模式下不支持分析缓存"}
+        from analytics_cache import GarbageAnalyticsCache
+        
+        self.analytics_cache = GarbageAnalyticsCache(
+            self.connection, self._lock,
+            max_memory_mb=max_memory_mb or ANALYTICS_CACHE_CONFIG["max_memory_mb"],
+            fetch_batch_size=ANALYTICS_CACHE_CONFIG["fetch_batch_size"]
+        )
+        self._refresh_analytics_cache()
+        if self.analytics_cache is None:
+            return {"已加载": False}
+        return self.analytics_cache.get_status()
+    
+    def _refresh_analytics_cache(self):
+        """增量同步分析缓存；超出内存预算或同步失败时停用缓存"""
+        from analytics_cache import AnalyticsCacheMemoryError
+        
+        try:
+            with self._lock:
+                self._analytics_data_version = self.connection.execute(
+                    "PRAGMA data_version").fetchone()[0]
+                info = self.analytics_cache.refresh()
+            logger.info(f"分析缓存已同步: {info}")
+        except AnalyticsCacheMemoryError as e:
+            logger.warning(f"{e}，停用分析缓存")
+            self.analytics_cache = None
+        except Exception as e:
+            logger.error(f"同步分析缓存失败，停用分析缓存: {e}")
+            self.analytics_cache = None
+    
+    def _get_analytics_cache(self) -> "Optional[GarbageAnalyticsCache]":
+        """
+        返回可用的分析缓存
+        
+        其他连接提交过修改（PRAGMA data_version变化）时先增量同步。
+        
+        Returns:
+            分析缓存，未启用或不可用时为None
+        """
+        if self.analytics_cache is None:
+            return None
+        with self._lock:
+            version = self.connection.execute("PRAGMA data_version").fetchone()[0]
+        if not self.analytics_cache.loaded or version != self._analytics_data_version:
+            self._refresh_analytics_cache()
+        return self.analytics_cache
+    
     def close(self):
         """关闭数据库连接"""
+        if self._slow_query_handler:
+            self._slow_query_handler.close()
+            self._slow_query_handler = None
         if self.connection:
             self.connection.close()
             logger.info("数据库连接已关闭")
+        if self._disk_connection and self._disk_connection is not self.connection:
+            self._disk_connection.close()
     
+    @_writes_to_disk
     def initialize_database(self):
         """初始化数据库，从CSV文件创建表格并填充数据"""
         try:
@@ -109,6 +1261,7 @@ class GarbageMonitoringDB:
             logger.error(f"数据库初始化失败: {e}")
             raise
     
+    @_writes_to_disk
     def create_table_from_csv(self, csv_path: str, table_name: str):
         """
         从CSV文件创建表格并插入数据
@@ -122,6 +1275,8 @@ class GarbageMonitoringDB:
             csv_path: CSV文件路径
             table_name: 表格名称
         """
+        import pandas as pd
+        
         try:
             # 尝试不同编码读取CSV文件
             df = None
@@ -163,8 +1318,22 @@ class GarbageMonitoringDB:
                 sql_types.append(mapped_type)
             
             # 删除表如果存在
+            # 分区表的同名临时视图会遮蔽主库中的表，导入期间先移除
+            if self.partitioned and table_name in PARTITION_CONFIG["tables"]:
+                self._detach_partitions()
             cursor = self.connection.cursor()
             cursor.execute(f"DROP TABLE IF EXISTS {table_name}")
+            cursor.execute("DELETE FROM meta_table_catalog WHERE table_name = ?", (table_name,))
+            cursor.execute("DELETE FROM meta_table_days WHERE table_name = ?", (table_name,))
+            cursor.execute("DELETE FROM meta_distinct_sketch WHERE table_name = ?", (table_name,))
+            cursor.execute("DELETE FROM meta_hourly_buckets WHERE table_name = ?", (table_name,))
+            cursor.execute("DELETE FROM meta_topk_counters WHERE table_name = ?", (table_name,))
+            cursor.execute("DELETE FROM meta_topk_thresholds WHERE table_name = ?", (table_name,))
+            cursor.execute("DELETE FROM meta_open_issues WHERE source = ?", (table_name,))
+            self._catalog_cache = None
+            self._overdue_cache.clear()
+            if self.analytics_cache and table_name == self.analytics_cache.TABLE_NAME:
+                self.analytics_cache.invalidate()
             
             # 创建表结构
             column_definitions = []
@@ -195,8 +1364,27 @@ class GarbageMonitoringDB:
                 data_to_insert = data_rows.values.tolist()
                 cursor.executemany(insert_sql, data_to_insert)
                 
+                archive_key = self.ARCHIVE_SOURCES.get(table_name, {}).get("key")
+                if archive_key in clean_column_names:
+                    # 已归档的记录保存在归档库中，重新导入时不再写回在线表
+                    cursor.execute(f"""
+                    DELETE FROM {table_name}
+                    WHERE {archive_key} IN (SELECT key_value FROM meta_archived_keys WHERE table_name = ?)
+                    """, (table_name,))
+                    if cursor.rowcount:
+                        logger.info(f"表 {table_name} 中 {cursor.rowcount} 条已归档的记录不再写回在线表")
+                
                 self.connection.commit()
                 logger.info(f"成功向表 {table_name} 插入 {len(data_to_insert)} 条记录")
+                
+                if self.partitioned and table_name in PARTITION_CONFIG["tables"]:
+                    self._move_to_partitions(table_name)
+                
+                column_comments = {
+                    name: '' if pd.isna(comment) else str(comment)
+                    for name, comment in zip(clean_column_names, comments_row)
+                }
+                self._on_table_loaded(table_name, column_comments)
             else:
                 logger.warning(f"表 {table_name} 没有数据行可插入")
             
@@ -265,55 +1453,1211 @@ class GarbageMonitoringDB:
         cleaned = cleaned.strip('_')
         return cleaned if cleaned else 'column'
     
-    def execute_query(self, query: str, params: Tuple = ()) -> List[Dict[str, Any]]:
+    @contextmanager
+    def query_deadline(self, timeout: Optional[float] = None,
+                       cancel_event: Optional[threading.Event] = None):
         """
-        执行查询语句
+        为当前线程内的所有查询设置截止时间和取消标记
+        
+        嵌套使用时取更早的截止时间，退出时恢复外层设置。
         
         Args:
-            query: SQL查询语句
-            params: 查询参数
-            
-        Returns:
-            查询结果列表
+            timeout: 超时秒数，为None时不限制
+            cancel_event: 取消标记，被set后正在执行的查询会被中止
         """
+        previous = (getattr(self._local, "deadline", None),
+                    getattr(self._local, "cancel_event", None),
+                    getattr(self._local, "timeout", None))
+        deadline, outer_cancel, outer_timeout = previous
+        if timeout is not None:
+            new_deadline = time.monotonic() + timeout
+            if deadline is None or new_deadline < deadline:
+                deadline = new_deadline
+                outer_timeout = timeout
+        self._local.deadline = deadline
+        self._local.cancel_event = cancel_event or outer_cancel
+        self._local.timeout = outer_timeout
         try:
-            cursor = self.connection.cursor()
-            cursor.execute(query, params)
-            results = cursor.fetchall()
-            return [dict(row) for row in results]
-        except Exception as e:
-            logger.error(f"查询执行失败: {e}")
-            logger.error(f"SQL: {query}")
-            logger.error(f"参数: {params}")
-            raise
+            yield
+        finally:
+            self._local.deadline, self._local.cancel_event, self._local.timeout = previous
     
-    # ========== 生活垃圾监管功能 ==========
+    def _check_deadline(self) -> int:
+        """SQLite进度回调，返回非0值时中止当前语句"""
+        cancel_event = getattr(self._local, "cancel_event", None)
+        if cancel_event is not None and cancel_event.is_set():
+            self._local.abort_reason = "cancelled"
+            return 1
+        deadline = getattr(self._local, "deadline", None)
+        if deadline is not None and time.monotonic() > deadline:
+            self._local.abort_reason = "timeout"
+            return 1
+        return 0
+    
+    def _raise_if_aborted(self):
+        """如果本线程的查询已被进度回调中止，抛出对应的异常"""
+        reason = getattr(self._local, "abort_reason", None)
+        self._local.abort_reason = None
+        if reason == "cancelled":
+            raise QueryCancelledError("查询已被取消")
+        if reason == "timeout":
+            raise QueryTimeoutError(f"查询超时（超过 {self._local.timeout} 秒），已中止")
     
-    def get_realtime_clearance_data(self, date: Optional[str] = None) -> Dict[str, Any]:
+    def list_partitions(self) -> List[str]:
         """
-        功能1: 展示全区清运实时数据
+        列出已有的分区
+        
+        Returns:
+            月份（YYYY-MM）按时间排序，其后依次为history（合并的历史月份）和undated（无时间数据），
+            两者只在存在时列出
+        """
+        if not os.path.isdir(self.partition_dir):
+            return []
+        return sorted(
+            match.group(1)
+            for match in map(self.PARTITION_FILE_PATTERN.match, os.listdir(self.partition_dir))
+            if match
+        )
+    
+    def partitions_for_range(self, start: Optional[str] = None,
+                             end: Optional[str] = None) -> List[str]:
+        """
+        返回与时间范围相交的分区
         
         Args:
-            date: 查询日期，默认为今天 (YYYY-MM-DD格式)
+            start: 起始日期或时间，为None时不限
+            end: 结束日期或时间，为None时不限
             
         Returns:
-            包含清运概览和明细的数据
+            需要读取的分区；两端都不限时包括undated，起始早于最早的月份分区时包括history
         """
-        if date is None:
-            date = datetime.now().strftime('%Y-%m-%d')
+        partitions = self.list_partitions()
+        if start is None and end is None:
+            return partitions
+        months = [p for p in partitions if p not in (self.HISTORY_PARTITION, self.UNDATED_PARTITION)]
+        selected = [
+            month for month in months
+            if (start is None or month >= start[:7]) and (end is None or month <= end[:7])
+        ]
+        # 历史库只含早于最早月份分区的数据
+        if self.HISTORY_PARTITION in partitions and (
+                start is None or not months or start[:7] < months[0]):
+            selected.insert(0, self.HISTORY_PARTITION)
+        return selected
+    
+    def _partition_path(self, month: str) -> str:
+        """分区文件路径"""
+        return os.path.join(self.partition_dir, f"{month}.db")
+    
+    @staticmethod
+    def _partition_alias(month: str) -> str:
+        """分区附加到连接上时使用的库名"""
+        return "p_" + month.replace("-", "_")
+    
+    def _drop_partition_views(self, cursor: sqlite3.Cursor):
+        """删除指向分区的临时视图"""
+        for table_name in PARTITION_CONFIG["tables"]:
+            cursor.execute(f"DROP VIEW IF EXISTS temp.{table_name}")
+        self._partition_view_months = None
+    
+    def _detach_partitions(self):
+        """删除临时视图并分离全部分区，导入数据前调用"""
+        with self._lock:
+            cursor = self.connection.cursor()
+            self._drop_partition_views(cursor)
+            for month in list(self._attached_partitions):
+                cursor.execute(f"DETACH DATABASE {self._partition_alias(month)}")
+                del self._attached_partitions[month]
+    
+    def _route_partitions(self, date_range: Optional[Tuple[Optional[str], Optional[str]]] = None):
+        """
+        让分区表的同名临时视图只覆盖查询涉及的月份
         
-        # 查询清运概览
-        overview_query = """
-        SELECT 
-            street_name AS 街道,
-            type_name AS 垃圾类型,
-            COUNT(*) AS 清运次数,
-            SUM(CAST(garbage_weight AS FLOAT)) AS 总清运量,
-            COUNT(DISTINCT vehicle_license_num) AS 参与车辆数,
-            MAX(load_time_str) AS 最新清运时间
-        FROM garbage_data 
-        WHERE DATE(load_time_str) = ?
-        GROUP BY street_name, type_name
+        临时视图在名称解析时优先于主库中的同名空表，查询语句无需改写。
+        分区以只读方式附加；date_range为None时视图覆盖全部分区。
+        视图保留到下一次涉及的分区不同时才重建，连续查询相同月份时不改动schema。
+        
+        Args:
+            date_range: 查询的(起始, 结束)日期，任一端为None时不限
+            
+        Raises:
+            ValueError: 涉及的分区数超过SQLite可同时附加的数据库上限
+        """
+        months = tuple(self.partitions_for_range(*date_range) if date_range
+                       else self.list_partitions())
+        if months == self._partition_view_months:
+            return
+        limit = self.connection.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+        if len(months) > limit:
+            raise ValueError(
+                f"查询涉及 {len(months)} 个分区，超过可同时附加的上限 {limit}，"
+                f"请缩小查询时间范围或归档历史月份"
+            )
+        with self._lock:
+            # 视图维护不受调用方截止时间约束，避免中途中止后视图只覆盖部分月份
+            saved = (getattr(self._local, "deadline", None),
+                     getattr(self._local, "cancel_event", None))
+            self._local.deadline = self._local.cancel_event = None
+            try:
+                cursor = self.connection.cursor()
+                self._drop_partition_views(cursor)
+                missing = [month for month in months if month not in self._attached_partitions]
+                if len(self._attached_partitions) + len(missing) > limit:
+                    for month in [m for m in self._attached_partitions if m not in months]:
+                        cursor.execute(f"DETACH DATABASE {self._partition_alias(month)}")
+                        del self._attached_partitions[month]
+                for month in missing:
+                    alias = self._partition_alias(month)
+                    uri = "file:" + urllib.parse.quote(self._partition_path(month)) + "?mode=ro"
+                    cursor.execute(f"ATTACH DATABASE ? AS {alias}", (uri,))
+                    self._apply_storage_profile(self.connection, alias)
+                    cursor.execute(f"SELECT name FROM {alias}.sqlite_master WHERE type = 'table'")
+                    self._attached_partitions[month] = {row[0] for row in cursor.fetchall()}
+                for table_name in PARTITION_CONFIG["tables"]:
+                    sources = [
+                        f"SELECT * FROM {self._partition_alias(month)}.{table_name}"
+                        for month in months if table_name in self._attached_partitions[month]
+                    ]
+                    if sources:
+                        cursor.execute(
+                            f"CREATE TEMP VIEW {table_name} AS {' UNION ALL '.join(sources)}"
+                        )
+                self._partition_view_months = months
+            finally:
+                self._local.deadline, self._local.cancel_event = saved
+    
+    def _recent_month_count(self) -> int:
+        """单独保存为分区文件的最近月份数，为历史库、undated和导入写入留出附加位置"""
+        limit = self.connection.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+        return max(1, min(PARTITION_CONFIG["recent_months"], limit - 3))
+    
+    @staticmethod
+    def _partition_create_sql(create_sql: str, table_name: str) -> str:
+        """把建表语句改写为在partition_write库中按需建表"""
+        return re.sub(
+            rf"^CREATE TABLE \"?{table_name}\"?(?=[\s(])",
+            f"CREATE TABLE IF NOT EXISTS partition_write.{table_name}", create_sql
+        )
+    
+    def _move_to_partitions(self, table_name: str):
+        """
+        把刚导入主库的数据按月写入分区文件，并清空主库中的表
+        
+        每个月份先删除本次导入时间范围内的旧行再写入，重复导入同一批数据不会产生重复行；
+        早于最早月份分区的迟到数据写入历史库。写入后把超出最近月份数的分区合并到历史库。
+        
+        Args:
+            table_name: 刚导入的表名
+        """
+        time_column = self.TABLE_TIME_COLUMNS[table_name]
+        month_expr = f"COALESCE(strftime('%Y-%m', {time_column}), '{self.UNDATED_PARTITION}')"
+        os.makedirs(self.partition_dir, exist_ok=True)
+        
+        with self._lock:
+            self._detach_partitions()
+            months = [m for m in self.list_partitions()
+                      if m not in (self.HISTORY_PARTITION, self.UNDATED_PARTITION)]
+            cursor = self.connection.cursor()
+            create_sql = self._partition_create_sql(cursor.execute(
+                "SELECT sql FROM main.sqlite_master WHERE type = 'table' AND name = ?",
+                (table_name,)
+            ).fetchone()[0], table_name)
+            cursor.execute(f"""
+            SELECT {month_expr} AS month, MIN({time_column}), MAX({time_column}), COUNT(*)
+            FROM main.{table_name}
+            GROUP BY month
+            """)
+            for month, min_time, max_time, count in cursor.fetchall():
+                target = month
+                if month != self.UNDATED_PARTITION and months and month < months[0]:
+                    target = self.HISTORY_PARTITION
+                cursor.execute("ATTACH DATABASE ? AS partition_write", (self._partition_path(target),))
+                self._apply_storage_profile(self.connection, "partition_write")
+                try:
+                    cursor.execute(create_sql)
+                    if month == self.UNDATED_PARTITION:
+                        cursor.execute(f"""
+                        DELETE FROM partition_write.{table_name}
+                        WHERE strftime('%Y-%m', {time_column}) IS NULL
+                        """)
+                    else:
+                        cursor.execute(f"""
+                        DELETE FROM partition_write.{table_name}
+                        WHERE {time_column} BETWEEN ? AND ?
+                        """, (min_time, max_time))
+                    cursor.execute(f"""
+                    INSERT INTO partition_write.{table_name}
+                    SELECT * FROM main.{table_name} WHERE {month_expr} = ?
+                    """, (month,))
+                    self.connection.commit()
+                    logger.info(f"表 {table_name} 的 {count} 条记录已写入分区 {target}")
+                finally:
+                    if self.connection.in_transaction:
+                        self.connection.rollback()
+                    cursor.execute("DETACH DATABASE partition_write")
+            cursor.execute(f"DELETE FROM main.{table_name}")
+            self.connection.commit()
+            self._compact_partitions()
+        self._route_partitions()
+    
+    def _compact_partitions(self):
+        """
+        把最近月份之外的月份分区合并到历史库，使查询同时附加的分区数有上限
+        
+        每张表先删除历史库中该月的行再写入，合并中断后重新执行不会产生重复行；
+        写入提交后才删除月份分区文件。
+        """
+        months = [m for m in self.list_partitions()
+                  if m not in (self.HISTORY_PARTITION, self.UNDATED_PARTITION)]
+        stale = months[:-self._recent_month_count()]
+        if not stale:
+            return
+        with self._lock:
+            self._detach_partitions()
+            cursor = self.connection.cursor()
+            for month in stale:
+                cursor.execute("ATTACH DATABASE ? AS partition_read", (self._partition_path(month),))
+                cursor.execute("ATTACH DATABASE ? AS partition_write",
+                               (self._partition_path(self.HISTORY_PARTITION),))
+                self._apply_storage_profile(self.connection, "partition_write")
+                try:
+                    tables = cursor.execute(
+                        "SELECT name, sql FROM partition_read.sqlite_master WHERE type = 'table'"
+                    ).fetchall()
+                    for table_name, create_sql in tables:
+                        time_column = self.TABLE_TIME_COLUMNS[table_name]
+                        cursor.execute(self._partition_create_sql(create_sql, table_name))
+                        cursor.execute(f"""
+                        DELETE FROM partition_write.{table_name}
+                        WHERE strftime('%Y-%m', {time_column}) = ?
+                        """, (month,))
+                        cursor.execute(f"""
+                        INSERT INTO partition_write.{table_name}
+                        SELECT * FROM partition_read.{table_name}
+                        """)
+                    self.connection.commit()
+                finally:
+                    if self.connection.in_transaction:
+                        self.connection.rollback()
+                    cursor.execute("DETACH DATABASE partition_read")
+                    cursor.execute("DETACH DATABASE partition_write")
+                os.remove(self._partition_path(month))
+                logger.info(f"分区 {month} 已合并到历史库")
+    
+    def _open_archive(self) -> sqlite3.Connection:
+        """打开归档库，不存在时创建"""
+        archive = sqlite3.connect(self.archive_path)
+        archive.execute("""
+        CREATE TABLE IF NOT EXISTS archive_chunks (
+            chunk_id INTEGER PRIMARY KEY,
+            table_name TEXT NOT NULL,
+            min_time TEXT,
+            max_time TEXT,
+            row_count INTEGER NOT NULL,
+            columns TEXT NOT NULL,
+            payload BLOB NOT NULL,
+            archived_at TEXT NOT NULL
+        )
+        """)
+        archive.execute("""
+        CREATE INDEX IF NOT EXISTS idx_archive_chunks_table
+        ON archive_chunks (table_name, max_time)
+        """)
+        return archive
+    
+    @_writes_to_disk
+    def archive_cold_data(self, min_age_days: Optional[int] = None,
+                          tables: Optional[List[str]] = None) -> Dict[str, Any]:
+        """
+        把已结束且超过一定时间的记录移出在线表，压缩保存到归档库
+        
+        记录按时间顺序每chunk_rows行序列化为JSON并用zlib压缩为一个块；归档库提交后
+        才从在线表删除，随后重新计算该表的元数据。已归档记录的主键保存在meta_archived_keys中：
+        同一主键不会重复归档，之后才结束的旧记录在下次归档时补上，重新导入时已归档的记录
+        不再写回在线表。在线查询不再读取归档数据，需要时通过include_history显式合并。
+        
+        Args:
+            min_age_days: 发生时间早于多少天的记录参与归档，默认取配置
+            tables: 参与归档的表，默认为ARCHIVE_SOURCES中的全部表
+            
+        Returns:
+            归档截止日期和各表的归档行数、压缩前后字节数
+        """
+        if self.partitioned:
+            raise ValueError("分区存储模式下不支持归档，历史月份已保存在各自的分区文件中")
+        if min_age_days is None:
+            min_age_days = ARCHIVE_CONFIG["min_age_days"]
+        tables = tables or list(self.ARCHIVE_SOURCES)
+        unknown = [t for t in tables if t not in self.ARCHIVE_SOURCES]
+        if unknown:
+            raise ValueError(f"不支持归档的表: {unknown}，可选值: {list(self.ARCHIVE_SOURCES)}")
+        cutoff = (datetime.now() - timedelta(days=min_age_days)).strftime('%Y-%m-%d')
+        
+        archive = self._open_archive()
+        try:
+            details = {table_name: self._archive_table(archive, table_name, cutoff)
+                       for table_name in tables}
+        finally:
+            archive.close()
+        
+        if ARCHIVE_CONFIG["vacuum"] and any(d["归档行数"] for d in details.values()):
+            self._vacuum()
+        logger.info(f"冷数据归档完成，截止日期 {cutoff}: {details}")
+        return {"归档截止日期": cutoff, "归档库": self.archive_path, "归档明细": details}
+    
+    def _archive_table(self, archive: sqlite3.Connection, table_name: str,
+                       cutoff: str) -> Dict[str, int]:
+        """归档一张表中早于cutoff、主键尚未归档的已结束记录"""
+        time_column = self.TABLE_TIME_COLUMNS[table_name]
+        key = self.ARCHIVE_SOURCES[table_name]["key"]
+        closed = self.ARCHIVE_SOURCES[table_name]["closed"]
+        where = f"""{time_column} < ? AND DATE({time_column}) IS NOT NULL
+            AND {key} IS NOT NULL AND {key} != ''
+            AND {key} NOT IN (SELECT key_value FROM meta_archived_keys WHERE table_name = ?)"""
+        params: List[Any] = [cutoff, table_name]
+        if closed:
+            where += f" AND {closed}"
+        
+        archived = {"归档行数": 0, "原始字节": 0, "压缩后字节": 0}
+        with self._lock:
+            cursor = self.connection.cursor()
+            cursor.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table_name,)
+            )
+            if cursor.fetchone() is None:
+                return archived
+            cursor.execute(
+                f"SELECT * FROM {table_name} WHERE {where} ORDER BY {time_column}", params
+            )
+            columns = [description[0] for description in cursor.description]
+            time_index = columns.index(time_column)
+            key_index = columns.index(key)
+            keys = set()
+            archived_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            while True:
+                batch = cursor.fetchmany(ARCHIVE_CONFIG["chunk_rows"])
+                if not batch:
+                    break
+                rows = [list(row) for row in batch]
+                keys.update(str(row[key_index]) for row in rows)
+                raw = json.dumps(rows, ensure_ascii=False).encode("utf-8")
+                payload = zlib.compress(raw, ARCHIVE_CONFIG["compression_level"])
+                archive.execute("""
+                INSERT INTO archive_chunks (
+                    table_name, min_time, max_time, row_count, columns, payload, archived_at
+                ) VALUES (?, ?, ?, ?, ?, ?, ?)
+                """, (table_name, rows[0][time_index], rows[-1][time_index], len(rows),
+                      json.dumps(columns), payload, archived_at))
+                archived["归档行数"] += len(rows)
+                archived["原始字节"] += len(raw)
+                archived["压缩后字节"] += len(payload)
+            if not archived["归档行数"]:
+                return archived
+            # 归档库先提交，再在同一事务中记录主键并从在线表删除，中途失败不会丢失数据
+            archive.commit()
+            cursor.executemany(
+                "INSERT OR IGNORE INTO meta_archived_keys (table_name, key_value) VALUES (?, ?)",
+                [(table_name, value) for value in keys]
+            )
+            cursor.execute(f"""
+            DELETE FROM {table_name}
+            WHERE {key} IN (SELECT key_value FROM meta_archived_keys WHERE table_name = ?)
+            """, (table_name,))
+            self.connection.commit()
+            self._catalog_cache = None
+            self._overdue_cache.clear()
+        
+        logger.info(f"表 {table_name} 已归档 {archived['归档行数']} 条记录")
+        self._on_table_loaded(table_name)
+        return archived
+    
+    def _load_archive_tables(self, cursor: sqlite3.Cursor) -> List[str]:
+        """
+        把归档数据解压到临时表temp.archive_<表名>，归档库未变化时沿用已加载的数据
+        
+        Returns:
+            有归档数据的表
+        """
+        if not os.path.exists(self.archive_path):
+            return []
+        existing = {row[0] for row in cursor.execute(
+            "SELECT name FROM main.sqlite_master WHERE type = 'table'"
+        )}
+        archive = self._open_archive()
+        try:
+            versions = {
+                row[0]: (row[1], row[2]) for row in archive.execute("""
+                SELECT table_name, COUNT(*), MAX(chunk_id) FROM archive_chunks GROUP BY table_name
+                """)
+            }
+            for table_name, version in versions.items():
+                if self._archive_loaded.get(table_name) == version:
+                    continue
+                key = self.ARCHIVE_SOURCES[table_name]["key"]
+                cursor.execute(f"DROP TABLE IF EXISTS temp.archive_{table_name}")
+                if table_name in existing:
+                    cursor.execute(
+                        f"CREATE TEMP TABLE archive_{table_name} AS SELECT * FROM main.{table_name} WHERE 0"
+                    )
+                else:
+                    # 在线表已不存在时按归档时的列建表
+                    columns = json.loads(archive.execute(
+                        "SELECT columns FROM archive_chunks WHERE table_name = ? ORDER BY chunk_id LIMIT 1",
+                        (table_name,)
+                    ).fetchone()[0])
+                    cursor.execute(f"CREATE TEMP TABLE archive_{table_name} ({', '.join(columns)})")
+                # 归档中断后重新归档可能留下同一主键的多份记录，只保留一份
+                cursor.execute(
+                    f"CREATE UNIQUE INDEX temp.idx_archive_{table_name}_key ON archive_{table_name} ({key})"
+                )
+                for columns, payload in archive.execute(
+                    "SELECT columns, payload FROM archive_chunks WHERE table_name = ? ORDER BY chunk_id",
+                    (table_name,)
+                ):
+                    columns = json.loads(columns)
+                    cursor.executemany(
+                        f"INSERT OR IGNORE INTO temp.archive_{table_name} ({', '.join(columns)}) "
+                        f"VALUES ({', '.join('?' for _ in columns)})",
+                        json.loads(zlib.decompress(payload))
+                    )
+                self._archive_loaded[table_name] = version
+        finally:
+            archive.close()
+        return list(versions)
+    
+    @contextmanager
+    def include_history(self):
+        """
+        在上下文内让查询同时读取在线表和归档数据
+        
+        归档数据解压到临时表，同名临时视图合并在线表与归档表并遮蔽在线表，
+        查询语句无需改写；主键仍在在线表中的归档记录不重复计入。上下文期间持有连接锁。
+        
+        Raises:
+            ValueError: 分区存储模式下没有归档数据
+        """
+        if self.partitioned:
+            raise ValueError("分区存储模式下不支持归档，历史月份已在分区文件中，直接查询即可")
+        with self._lock:
+            cursor = self.connection.cursor()
+            tables = self._load_archive_tables(cursor)
+            existing = {row[0] for row in cursor.execute(
+                "SELECT name FROM main.sqlite_master WHERE type = 'table'"
+            )}
+            for table_name in tables:
+                key = self.ARCHIVE_SOURCES[table_name]["key"]
+                if table_name not in existing:
+                    cursor.execute(
+                        f"CREATE TEMP VIEW {table_name} AS SELECT * FROM temp.archive_{table_name}"
+                    )
+                    continue
+                cursor.execute(f"""
+                CREATE TEMP VIEW {table_name} AS
+                SELECT * FROM main.{table_name}
+                UNION ALL
+                SELECT * FROM temp.archive_{table_name}
+                WHERE {key} NOT IN (SELECT {key} FROM main.{table_name} WHERE {key} IS NOT NULL)
+                """)
+            try:
+                with self._pinned_connection():
+                    yield
+            finally:
+                for table_name in tables:
+                    cursor.execute(f"DROP VIEW IF EXISTS temp.{table_name}")
+    
+    def execute_query(self, query: str, params: Tuple = (),
+                      timeout: Optional[float] = None,
+                      source: str = "execute_query",
+                      max_rows: Optional[int] = None,
+                      date_range: Optional[Tuple[Optional[str], Optional[str]]] = None
+                      ) -> List[Dict[str, Any]]:
+        """
+        执行查询语句
+        
+        Args:
+            query: SQL查询语句
+            params: 查询参数
+            timeout: 本次查询的超时秒数，为None时沿用query_deadline的设置
+            source: 查询来源（工具或方法名），记入慢查询日志
+            max_rows: 最多读取的行数，为None时读取全部结果
+            date_range: 查询涉及的(起始, 结束)日期；分区存储时只附加覆盖该范围的月份，
+                        为None时读取全部分区
+            
+        Returns:
+            查询结果列表
+        """
+        return self._run_query(query, params, timeout, source, max_rows, date_range,
+                               self._fetch_dicts)[1]
+    
+    def execute_query_json(self, query: str, params: Tuple = (),
+                           timeout: Optional[float] = None,
+                           source: str = "execute_query_json",
+                           max_rows: Optional[int] = None,
+                           date_range: Optional[Tuple[Optional[str], Optional[str]]] = None
+                           ) -> Tuple[int, bytes]:
+        """
+        执行查询语句，结果直接编码为JSON数组
+        
+        查询语句原样执行，每行按cursor.description直接编码为JSON对象，
+        不再转换为dict列表后整体序列化。REAL按完整精度编码，Inf/NaN编码为null。
+        参数与execute_query相同。
+        
+        Returns:
+            (结果行数, UTF-8编码的JSON数组)
+        """
+        return self._run_query(query, params, timeout, source, max_rows, date_range,
+                               self._fetch_json)
+    
+    def execute_query_json_rows(self, query: str, params: Tuple = (),
+                                timeout: Optional[float] = None,
+                                source: str = "execute_query_json_rows",
+                                max_rows: Optional[int] = None,
+                                date_range: Optional[Tuple[Optional[str], Optional[str]]] = None
+                                ) -> Tuple[List[str], List[str]]:
+        """
+        执行查询语句，每个结果行编码为一个JSON对象文本
+        
+        编码方式与execute_query_json相同，结果行保持分开，便于分页读取和按行导出。
+        参数与execute_query相同。
+        
+        Returns:
+            (结果列名, 每行的JSON对象文本)
+        """
+        return self._run_query(query, params, timeout, source, max_rows, date_range,
+                               self._fetch_json_rows)[1]
+    
+    def execute_query_summary(self, query: str, params: Tuple = (),
+                              timeout: Optional[float] = None,
+                              source: str = "execute_query_summary",
+                              max_rows: Optional[int] = None,
+                              date_range: Optional[Tuple[Optional[str], Optional[str]]] = None
+                              ) -> Dict[str, Any]:
+        """
+        执行查询语句，只返回结果摘要
+        
+        分批遍历一次游标，计算总行数、字段统计（最小/最大/平均值、高频取值、空值数）
+        和代表性样本，返回大小与结果行数无关。参数与execute_query相同。
+        
+        Returns:
+            结果摘要，结构见summarize_records
+        """
+        return self._run_query(query, params, timeout, source, max_rows, date_range,
+                               self._fetch_summary)[1]
+    
+    def export_query(self, query: str, path: str, file_format: str = "csv",
+                     params: Tuple = (),
+                     timeout: Optional[float] = None,
+                     source: str = "export_query",
+                     date_range: Optional[Tuple[Optional[str], Optional[str]]] = None) -> int:
+        """
+        执行查询并把结果流式写入文件
+        
+        每次从游标读取EXPORT_CONFIG["batch_size"]行写入文件，结果行不转换为dict，
+        内存占用与结果行数无关。写入完成前文件以临时文件存在，失败或超时时删除。
+        导出在独立的只读连接上执行，期间不占用服务连接的锁；分区模式以及在
+        include_history/read_snapshot上下文内时仍使用服务连接。
+        
+        Args:
+            query: SQL查询语句
+            path: 导出文件路径
+            file_format: csv（utf-8-sig编码）或parquet（需要pyarrow）
+            params: 查询参数
+            timeout: 本次导出的超时秒数，为None时沿用query_deadline的设置
+            source: 查询来源（工具或方法名），记入慢查询日志
+            date_range: 查询涉及的(起始, 结束)日期，含义与execute_query相同
+            
+        Returns:
+            写入的行数
+        """
+        return self._run_query(query, params, timeout, source, None, date_range,
+                               functools.partial(self._fetch_to_file, path, file_format),
+                               isolated=True)[0]
+    
+    @staticmethod
+    def summarize_records(records: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        计算已取出的结果记录的摘要
+        
+        Args:
+            records: 字段相同的结果记录列表
+            
+        Returns:
+            包含总行数、字段统计、代表性样本和样本说明的字典
+        """
+        columns = list(records[0]) if records else []
+        return _summarize_rows(columns, [[tuple(record.values()) for record in records]])
+    
+    def _run_query(self, query: str, params: Tuple, timeout: Optional[float], source: str,
+                   max_rows: Optional[int],
+                   date_range: Optional[Tuple[Optional[str], Optional[str]]],
+                   fetch: Callable[[sqlite3.Cursor, str, Tuple, Optional[int]], Tuple[int, Any]],
+                   isolated: bool = False) -> Tuple[int, Any]:
+        """
+        在截止时间、分区路由和慢查询日志的约束下执行查询，由fetch读取并转换结果
+        
+        Args:
+            isolated: 是否在独立的只读连接上执行，执行期间不占用服务连接的锁
+        
+        Returns:
+            (结果行数, fetch转换后的结果)
+        """
+        if self._disk_connection is not None:
+            self._check_snapshot()
+        start = time.perf_counter()
+        try:
+            with self.query_deadline(timeout), self._query_connection(isolated) as connection:
+                # 从取得连接开始计时，排队等待其他查询的时间不计入耗时
+                start = time.perf_counter()
+                self._local.abort_reason = None
+                # 截止时间已过或已取消时，不再开始新的语句
+                if self._check_deadline():
+                    self._raise_if_aborted()
+                if self.partitioned:
+                    self._route_partitions(date_range)
+                cursor = connection.cursor()
+                try:
+                    row_count, results = fetch(cursor, query, params, max_rows)
+                except sqlite3.OperationalError:
+                    self._raise_if_aborted()
+                    raise
+                elapsed_ms = (time.perf_counter() - start) * 1000
+                if elapsed_ms >= self.slow_query_threshold_ms:
+                    with self._lock:
+                        self._log_slow_query(query, params, elapsed_ms, row_count, source)
+                return row_count, results
+        except (QueryTimeoutError, QueryCancelledError) as e:
+            logger.warning(f"查询被中止: {e}")
+            logger.warning(f"SQL: {query}")
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            if isinstance(e, QueryTimeoutError) and elapsed_ms >= self.slow_query_threshold_ms:
+                with self._lock:
+                    self._log_slow_query(query, params, elapsed_ms, None, source, status="超时")
+            raise
+        except Exception as e:
+            logger.error(f"查询执行失败: {e}")
+            logger.error(f"SQL: {query}")
+            logger.error(f"参数: {params}")
+            raise
+    
+    @contextmanager
+    def _query_connection(self, isolated: bool):
+        """
+        取得执行查询的连接
+        
+        isolated为True时打开独立的只读连接；分区模式下分区数据由服务连接上的临时视图合并，
+        本线程在服务连接上建立了上下文（历史视图或读事务）时须看到同一连接的状态，
+        这两种情况仍持有锁使用服务连接。
+        """
+        if not isolated or self.partitioned or getattr(self._local, "pinned", 0):
+            with self._lock:
+                yield self.connection
+            return
+        connection = self._open_isolated_connection()
+        try:
+            yield connection
+        finally:
+            connection.close()
+    
+    @contextmanager
+    def _pinned_connection(self):
+        """标记本线程在服务连接上建立了上下文，期间的查询都使用服务连接"""
+        self._local.pinned = getattr(self._local, "pinned", 0) + 1
+        try:
+            yield
+        finally:
+            self._local.pinned -= 1
+    
+    def _open_isolated_connection(self) -> sqlite3.Connection:
+        """
+        打开与服务连接配置相同的独立只读连接
+        
+        连接设置同样的进度回调，调用方的截止时间和取消标记同样生效；
+        内存服务模式下打开同一个共享内存快照。
+        """
+        path = self._snapshot_uri or (
+            "file:" + urllib.parse.quote(os.path.abspath(self.db_path)) + "?mode=ro")
+        connection = sqlite3.connect(path, timeout=DATABASE_CONFIG["connection_timeout"],
+                                     uri=True)
+        try:
+            self._configure_connection(connection)
+        except Exception:
+            connection.close()
+            raise
+        return connection
+    
+    @staticmethod
+    def _fetch_dicts(cursor: sqlite3.Cursor, query: str, params: Tuple,
+                     max_rows: Optional[int]) -> Tuple[int, List[Dict[str, Any]]]:
+        """执行查询并把结果行转换为dict"""
+        cursor.execute(query, params)
+        results = cursor.fetchmany(max_rows) if max_rows else cursor.fetchall()
+        return len(results), [dict(row) for row in results]
+    
+    @staticmethod
+    def _fetch_summary(cursor: sqlite3.Cursor, query: str, params: Tuple,
+                       max_rows: Optional[int]) -> Tuple[int, Dict[str, Any]]:
+        """执行查询并分批遍历游标计算结果摘要"""
+        cursor.execute(query, params)
+        columns = [d[0] for d in cursor.description] if cursor.description else []
+        batch_size = RESULT_SUMMARY_CONFIG["fetch_batch_size"]
+        
+        def batches():
+            remaining = max_rows or None
+            while remaining is None or remaining > 0:
+                batch = cursor.fetchmany(batch_size if remaining is None
+                                         else min(batch_size, remaining))
+                if not batch:
+                    break
+                if remaining is not None:
+                    remaining -= len(batch)
+                yield batch
+        
+        summary = _summarize_rows(columns, batches())
+        return summary["总行数"], summary
+    
+    @staticmethod
+    def _fetch_to_file(path: str, file_format: str, cursor: sqlite3.Cursor, query: str,
+                       params: Tuple, max_rows: Optional[int]) -> Tuple[int, str]:
+        """执行查询并分批把游标中的结果行写入文件"""
+        cursor.execute(query, params)
+        columns = [d[0] for d in cursor.description] if cursor.description else []
+        batch_size = EXPORT_CONFIG["batch_size"]
+        
+        def batches():
+            while True:
+                batch = cursor.fetchmany(batch_size)
+                if not batch:
+                    break
+                yield batch
+        
+        try:
+            return write_rows(path, file_format, columns, batches()), path
+        finally:
+            # 写入失败时未读完的语句会一直持有读锁
+            cursor.close()
+    
+    def _fetch_json(self, cursor: sqlite3.Cursor, query: str, params: Tuple,
+                    max_rows: Optional[int]) -> Tuple[int, bytes]:
+        """执行查询，把每行编码为JSON对象后拼接成数组"""
+        row_count, (_, rows) = self._fetch_json_rows(cursor, query, params, max_rows)
+        return row_count, ("[" + ",".join(rows) + "]").encode("utf-8")
+    
+    def _fetch_json_rows(self, cursor: sqlite3.Cursor, query: str, params: Tuple,
+                         max_rows: Optional[int]) -> Tuple[int, Tuple[List[str], List[str]]]:
+        """
+        执行查询，按cursor.description直接把每行编码为JSON对象文本
+        
+        查询语句原样执行，不改写，结果顺序与execute_query一致；结果行不转换为sqlite3.Row/dict。
+        同名列与dict(row)一样只保留第一个取值。
+        """
+        cursor.execute(query, params)
+        names = [d[0] for d in cursor.description] if cursor.description else []
+        columns = list(dict.fromkeys(names))
+        rows = cursor.fetchmany(max_rows) if max_rows else cursor.fetchall()
+        if len(columns) < len(names):
+            first = [names.index(c) for c in columns]
+            rows = [[row[i] for i in first] for row in rows]
+        return len(rows), (columns, [self._encode_json_row(columns, row) for row in rows])
+    
+    @staticmethod
+    def _encode_json_row(columns: List[str], values: Sequence[Any]) -> str:
+        """把一行编码为JSON对象文本，Inf/NaN不是合法的JSON数值，编码为null"""
+        return json.dumps(
+            {c: None if isinstance(v, float) and not math.isfinite(v) else v
+             for c, v in zip(columns, values)},
+            ensure_ascii=False, separators=(",", ":"), default=str
+        )
+    
+    @contextmanager
+    def read_snapshot(self):
+        """
+        在一个读事务中执行多条查询，所有查询看到同一份数据快照
+        
+        事务期间持有连接锁，其他线程的查询会等待快照结束。
+        开始事务前先补齐元数据目录，事务中的准入控制只读取目录，不再提交写入。
+        """
+        self.get_table_catalog()
+        with self._lock:
+            started = not self.connection.in_transaction
+            if started:
+                self.connection.execute("BEGIN")
+            try:
+                with self._pinned_connection():
+                    yield
+            finally:
+                if started and self.connection.in_transaction:
+                    self.connection.execute("COMMIT")
+    
+    def _explain_rows(self, query: str, params: Tuple = ()) -> List[sqlite3.Row]:
+        """执行EXPLAIN QUERY PLAN，返回(id, parent, notused, detail)原始行"""
+        with self._lock:
+            # EXPLAIN开销很小，不受调用方截止时间约束（超时查询也需要记录计划）
+            saved = (getattr(self._local, "deadline", None),
+                     getattr(self._local, "cancel_event", None))
+            self._local.deadline = self._local.cancel_event = None
+            try:
+                cursor = self.connection.cursor()
+                cursor.execute(f"EXPLAIN QUERY PLAN {query}", params)
+                return cursor.fetchall()
+            finally:
+                self._local.deadline, self._local.cancel_event = saved
+    
+    def explain_query_plan(self, query: str, params: Tuple = ()) -> Dict[str, Any]:
+        """
+        获取查询的EXPLAIN QUERY PLAN输出，并标记全表扫描和临时B树
+        
+        Args:
+            query: SQL查询语句
+            params: 查询参数
+            
+        Returns:
+            包含执行计划明细、全表扫描和临时B树步骤的字典
+        """
+        plan = [row["detail"] for row in self._explain_rows(query, params)]
+        
+        return {
+            "查询计划": plan,
+            # 带USING INDEX的SCAN是索引扫描，只有裸SCAN才是全表扫描
+            "全表扫描": [step for step in plan
+                     if step.startswith("SCAN ") and " USING " not in step
+                     and step != "SCAN CONSTANT ROW"],
+            "临时B树": [step for step in plan if "USE TEMP B-TREE" in step]
+        }
+    
+    def get_table_row_count(self, table_name: str) -> int:
+        """
+        获取表的行数，优先读取元数据目录
+        
+        Args:
+            table_name: 表格名称
+            
+        Returns:
+            行数，表不存在时返回0
+        """
+        entry = self.get_table_catalog().get(table_name)
+        if entry is not None:
+            return entry["row_count"]
+        with self._lock:
+            if self.partitioned:
+                self._route_partitions()
+            cursor = self.connection.cursor()
+            try:
+                cursor.execute(f'SELECT COUNT(*) FROM "{table_name}"')
+                return cursor.fetchone()[0]
+            except sqlite3.OperationalError:
+                return 0
+    
+    def estimate_query_cost(self, query: str, params: Tuple = ()) -> Dict[str, Any]:
+        """
+        根据EXPLAIN QUERY PLAN和表行数估算查询代价
+        
+        代价以访问的行数计。嵌套循环中每一层的访问行数与外层循环行数相乘；
+        带索引的等值查找按每次10行、范围查找按表的1/4估算，
+        与SQLite在没有统计信息时的默认估计一致。
+        
+        Args:
+            query: SQL查询语句
+            params: 查询参数
+            
+        Returns:
+            包含估算代价、各扫描步骤代价、全表扫描、缺失索引和临时B树的字典
+        """
+        rows = self._explain_rows(query, params)
+        children: Dict[int, List[sqlite3.Row]] = {}
+        for row in rows:
+            children.setdefault(row["parent"], []).append(row)
+        
+        with self._lock:
+            cursor = self.connection.cursor()
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+            tables = {row[0] for row in cursor.fetchall()}
+        
+        # 计划中用别名代替表名，按FROM/JOIN子句解析别名
+        alias_pattern = re.compile(
+            r'\b(\w+)\s+(?:AS\s+)?(\w+)\s*(?:,|\bJOIN\b|\bON\b|\bWHERE\b|\bGROUP\b|'
+            r'\bORDER\b|\bLIMIT\b|\bLEFT\b|\bINNER\b|\bCROSS\b|\bUNION\b|\)|$)',
+            re.IGNORECASE
+        )
+        aliases = {m.group(2): m.group(1) for m in alias_pattern.finditer(query)}
+        scan_pattern = re.compile(r'^(SCAN|SEARCH) (\S+)(?: USING (.*))?$')
+        
+        derived_rows: Dict[str, float] = {}
+        scans: List[Dict[str, Any]] = []
+        missing_indexes: List[str] = []
+        temp_btrees: List[str] = []
+        
+        def resolve(name: str) -> str:
+            if name in tables or name in derived_rows:
+                return name
+            return aliases.get(name, name)
+        
+        def walk(parent: int, outer_rows: float) -> Tuple[float, float]:
+            """返回(该子树的代价, 该层最终输出行数)"""
+            cost, loop_rows = 0.0, outer_rows
+            for step in children.get(parent, []):
+                detail = step["detail"]
+                match = scan_pattern.match(detail)
+                if detail == "SCAN CONSTANT ROW":
+                    continue
+                if match:
+                    kind, name, using = match.groups()
+                    table = resolve(name)
+                    if table in derived_rows:
+                        table_rows = derived_rows[table]
+                    elif table in tables:
+                        table_rows = self.get_table_row_count(table)
+                    else:
+                        table_rows = 1
+                    
+                    if kind == "SCAN":
+                        per_loop = table_rows
+                    elif using and "AUTOMATIC" in using:
+                        # 临时自动索引：每次执行都要先扫描全表建索引
+                        cost += table_rows
+                        columns = re.findall(r'(\w+)[=<>]', using)
+                        missing_indexes.append(f"{table}({', '.join(columns)})")
+                        per_loop = min(table_rows, 10)
+                    elif using and not re.search(r'[<>]', using):
+                        per_loop = min(table_rows, 10)
+                    else:
+                        per_loop = max(1, table_rows / 4)
+                    
+                    step_cost = loop_rows * per_loop
+                    if kind == "SCAN" and using is None and table in tables:
+                        scans.append({
+                            "步骤": detail,
+                            "表": table,
+                            "表行数": table_rows,
+                            "外层循环行数": int(loop_rows),
+                            "代价": int(step_cost)
+                        })
+                    cost += step_cost
+                    loop_rows = step_cost
+                    cost += walk(step["id"], loop_rows)[0]
+                elif detail.startswith(("MATERIALIZE ", "CO-ROUTINE ")):
+                    sub_cost, sub_rows = walk(step["id"], 1)
+                    cost += sub_cost
+                    derived_rows[detail.split(" ", 1)[1]] = max(sub_rows, 1)
+                elif detail.startswith("USE TEMP B-TREE"):
+                    temp_btrees.append(detail)
+                    cost += loop_rows
+                elif detail == "COMPOUND QUERY":
+                    total_rows = 0.0
+                    for part in children.get(step["id"], []):
+                        sub_cost, sub_rows = walk(part["id"], 1)
+                        cost += sub_cost
+                        total_rows += sub_rows
+                    loop_rows = total_rows
+                elif detail.startswith("CORRELATED"):
+                    # 相关子查询对外层每一行执行一次
+                    cost += walk(step["id"], 1)[0] * loop_rows
+                else:
+                    cost += walk(step["id"], 1)[0]
+            return cost, loop_rows
+        
+        total_cost, _ = walk(0, 1)
+        return {
+            "估算代价": int(total_cost),
+            "全表扫描": scans,
+            "缺失索引": missing_indexes,
+            "临时B树": temp_btrees,
+            "查询计划": [row["detail"] for row in rows]
+        }
+    
+    def check_query_admission(self, query: str, params: Tuple = ()) -> Dict[str, Any]:
+        """
+        执行前的准入控制：根据估算代价决定执行、降级或拒绝
+        
+        Args:
+            query: SQL查询语句
+            params: 查询参数
+            
+        Returns:
+            包含决策（执行/降级/拒绝）、估算代价和说明的字典
+        """
+        estimate = self.estimate_query_cost(query, params)
+        cost = estimate["估算代价"]
+        max_cost = ADMISSION_CONTROL_CONFIG["max_cost"]
+        downgrade_cost = ADMISSION_CONTROL_CONFIG["downgrade_cost"]
+        
+        if cost > max_cost:
+            decision = "拒绝"
+        elif cost > downgrade_cost:
+            decision = "降级"
+        else:
+            decision = "执行"
+        
+        reasons = []
+        for scan in sorted(estimate["全表扫描"], key=lambda x: x["代价"], reverse=True):
+            with self._lock:
+                cursor = self.connection.cursor()
+                cursor.execute(f'PRAGMA index_list("{scan["表"]}")')
+                indexes = [row["name"] for row in cursor.fetchall()]
+            nested = f"，嵌套在外层约 {scan['外层循环行数']} 行的循环中" if scan["外层循环行数"] > 1 else ""
+            reasons.append(
+                f"全表扫描 {scan['表']}（约 {scan['表行数']} 行{nested}，计划步骤 '{scan['步骤']}'，"
+                f"现有索引: {', '.join(indexes) or '无'}）"
+            )
+        for index in estimate["缺失索引"]:
+            reasons.append(f"缺少索引 {index}，SQLite需为每次查询临时建立自动索引")
+        if estimate["临时B树"]:
+            reasons.append(f"使用临时B树排序/分组 {len(estimate['临时B树'])} 次")
+        
+        message = ""
+        if decision == "拒绝":
+            message = (
+                f"查询估算代价 {cost} 超过预算 {max_cost}，已拒绝执行。"
+                f"主要开销: {'; '.join(reasons) or '未知'}。"
+                f"请添加WHERE条件（如按load_time_str限定时间范围）、避免无连接条件的多表笛卡尔积，"
+                f"或改用预定义工具后重试"
+            )
+        elif decision == "降级":
+            message = (
+                f"查询估算代价 {cost} 超过 {downgrade_cost}，已降级执行："
+                f"最多返回 {ADMISSION_CONTROL_CONFIG['downgrade_max_rows']} 行，"
+                f"超时 {ADMISSION_CONTROL_CONFIG['downgrade_timeout']} 秒。"
+                f"主要开销: {'; '.join(reasons) or '未知'}"
+            )
+        
+        return {
+            "决策": decision,
+            "估算代价": cost,
+            "代价预算": max_cost,
+            "说明": message,
+            **estimate
+        }
+    
+    def _log_slow_query(self, query: str, params: Tuple, elapsed_ms: float,
+                        row_count: Optional[int], source: str, status: str = "成功"):
+        """将慢查询及其执行计划写入滚动日志文件，调用方需持有连接锁"""
+        try:
+            plan = self.explain_query_plan(query, params)
+        except Exception as e:
+            plan = {"查询计划": [], "全表扫描": [], "临时B树": [], "计划获取失败": str(e)}
+        
+        entry = {
+            "记录时间": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            "来源": source,
+            "SQL": " ".join(query.split()),
+            "参数": list(params),
+            "耗时毫秒": round(elapsed_ms, 2),
+            "返回行数": row_count,
+            "执行状态": status,
+            **plan
+        }
+        
+        try:
+            if self._slow_query_handler is None:
+                self._slow_query_handler = logging.handlers.RotatingFileHandler(
+                    self.slow_query_log_path,
+                    maxBytes=SLOW_QUERY_CONFIG["max_bytes"],
+                    backupCount=SLOW_QUERY_CONFIG["backup_count"],
+                    encoding="utf-8"
+                )
+            record = logging.makeLogRecord({
+                "msg": json.dumps(entry, ensure_ascii=False, default=str),
+                "levelno": logging.WARNING,
+                "levelname": "WARNING"
+            })
+            self._slow_query_handler.handle(record)
+        except Exception as e:
+            logger.error(f"写入慢查询日志失败: {e}")
+        
+        logger.warning(f"慢查询 ({entry['耗时毫秒']} ms, 来源: {source}): {entry['SQL'][:200]}")
+    
+    def get_slow_queries(self, limit: int = 10) -> Dict[str, Any]:
+        """
+        汇总慢查询日志，返回总耗时最高的查询
+        
+        Args:
+            limit: 返回的查询条数
+            
+        Returns:
+            按SQL语句聚合的慢查询排行
+        """
+        paths = [self.slow_query_log_path] + [
+            f"{self.slow_query_log_path}.{i}" for i in range(1, SLOW_QUERY_CONFIG["backup_count"] + 1)
+        ]
+        
+        offenders: Dict[str, Dict[str, Any]] = {}
+        total_entries = 0
+        for path in paths:
+            if not os.path.exists(path):
+                continue
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    total_entries += 1
+                    item = offenders.setdefault(entry["SQL"], {
+                        "SQL": entry["SQL"],
+                        "来源": entry["来源"],
+                        "次数": 0,
+                        "总耗时毫秒": 0.0,
+                        "最大耗时毫秒": 0.0,
+                        "超时次数": 0,
+                        "最近记录时间": ""
+                    })
+                    item["次数"] += 1
+                    item["总耗时毫秒"] += entry["耗时毫秒"]
+                    if entry.get("执行状态") == "超时":
+                        item["超时次数"] += 1
+                    if entry["耗时毫秒"] >= item["最大耗时毫秒"]:
+                        # 保留最慢一次的参数、返回行数和执行计划
+                        item.update({
+                            "最大耗时毫秒": entry["耗时毫秒"],
+                            "最慢一次参数": entry["参数"],
+                            "返回行数": entry["返回行数"],
+                            "查询计划": entry["查询计划"],
+                            "全表扫描": entry["全表扫描"],
+                            "临时B树": entry["临时B树"]
+                        })
+                    item["最近记录时间"] = max(item["最近记录时间"], entry["记录时间"])
+        
+        ranked = sorted(offenders.values(), key=lambda x: x["总耗时毫秒"], reverse=True)[:limit]
+        for item in ranked:
+            item["平均耗时毫秒"] = round(item["总耗时毫秒"] / item["次数"], 2)
+            item["总耗时毫秒"] = round(item["总耗时毫秒"], 2)
+        
+        return {
+            "慢查询阈值毫秒": self.slow_query_threshold_ms,
+            "日志记录数": total_entries,
+            "慢查询排行": ranked,
+            "查询时间": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        }
+    
+    # ========== 生活垃圾监管功能 ==========
+    
+    def get_realtime_clearance_data(self, date: Optional[str] = None,
+                                    approximate: bool = False) -> Dict[str, Any]:
+        """
+        功能1: 展示全区清运实时数据
+        
+        Args:
+            date: 查询日期，默认为今天 (YYYY-MM-DD格式)
+            approximate: 参与车辆数是否由预先计算的HyperLogLog草图近似给出，
+                         省去按组去重的临时B树
+            
+        Returns:
+            包含清运概览和明细的数据
+        """
+        if date is None:
+            date = datetime.now().strftime('%Y-%m-%d')
+        
+        # 查询清运概览
+        overview_query = f"""
+        SELECT 
+            street_name AS 街道,
+            type_name AS 垃圾类型,
+            COUNT(*) AS 清运次数,
+            SUM(CAST(garbage_weight AS FLOAT)) AS 总清运量,
+            {'NULL' if approximate else 'COUNT(DISTINCT vehicle_license_num)'} AS 参与车辆数,
+            MAX(load_time_str) AS 最新清运时间
+        FROM garbage_data 
+        WHERE DATE(load_time_str) = ?
+        GROUP BY street_name, type_name
         ORDER BY 总清运量 DESC
         """
         
@@ -333,22 +2677,211 @@ class GarbageMonitoringDB:
         LIMIT 100
         """
         
-        overview = self.execute_query(overview_query, (date,))
-        details = self.execute_query(detail_query, (date,))
+        cache = self._get_analytics_cache()
+        if cache and cache.covers(day=date):
+            overview = [
+                {
+                    "街道": group["street_name"],
+                    "垃圾类型": group["type_name"],
+                    "清运次数": group["trips"],
+                    "总清运量": group["total_weight"],
+                    "参与车辆数": group["distinct_vehicle_license_num"],
+                    "最新清运时间": group["max_time"]
+                }
+                for group in cache.aggregate(
+                    ["street_name", "type_name"], day=date, distinct=["vehicle_license_num"]
+                )
+            ]
+            overview.sort(key=lambda x: (x["总清运量"] is None, -(x["总清运量"] or 0)))
+            approximate = False
+        else:
+            overview = self.execute_query(overview_query, (date,), date_range=(date, date),
+                                          source="get_realtime_clearance_data")
+            if approximate:
+                estimates = self.estimate_distinct_counts("garbage_data", "vehicle_license_num", {
+                    (row["街道"], row["垃圾类型"]): [(date, row["街道"], row["垃圾类型"])]
+                    for row in overview
+                })
+                for row in overview:
+                    row["参与车辆数"] = estimates[(row["街道"], row["垃圾类型"])]
+        details = self.execute_query(detail_query, (date,), date_range=(date, date),
+                                     source="get_realtime_clearance_data")
+        
+        result = {
+            "查询日期": date,
+            "清运概览": overview,
+            "清运明细": details,
+            "统计时间": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        }
+        if approximate:
+            result["去重计数方式"] = self._approximate_distinct_note()
+        return result
+    
+    def get_street_clearance_statistics(self, start_date: str, end_date: str, 
+                                      street_name: Optional[str] = None,
+                                      dimensions: Optional[List[str]] = None,
+                                      approximate: bool = False) -> Dict[str, Any]:
+        """
+        功能2: 筛选查询各街道清运数量
+        
+        统计和趋势由同一次分组扫描得到：按(街道, 垃圾类型, 附加维度, 日期)分组，
+        再在Python中分别汇总为街道×类型统计和街道×日期趋势。
+        
+        Args:
+            start_date: 开始日期 (YYYY-MM-DD)
+            end_date: 结束日期 (YYYY-MM-DD)
+            street_name: 指定街道名称，为None时查询所有街道
+            dimensions: 附加统计维度，可选 community_type_name、car_group_name
+            approximate: 是否改用导入时预计算的汇总：清运次数、清运量和趋势由小时桶合并，
+                         涉及小区数由按日HyperLogLog草图合并近似给出，不扫描garbage_data，
+                         耗时只随时间跨度内的小时桶和草图个数增长；时间边界按小时桶对齐，
+                         草图按整天计算，不按附加维度拆分，指定dimensions时仍精确计算
+            
+        Returns:
+            街道清运统计数据
+        """
+        dimensions = dimensions or []
+        unknown = [d for d in dimensions if d not in self.CLEARANCE_EXTRA_DIMENSIONS]
+        if unknown:
+            raise ValueError(
+                f"不支持的统计维度: {unknown}，可选值: {list(self.CLEARANCE_EXTRA_DIMENSIONS)}"
+            )
+        
+        cache = self._get_analytics_cache()
+        if cache and not dimensions and cache.covers(start=start_date, end=end_date):
+            return self._street_clearance_statistics_from_cache(
+                cache, start_date, end_date, street_name
+            )
+        
+        approximate = approximate and not dimensions
+        group_columns = ["street_name", "type_name"] + dimensions
+        
+        if approximate:
+            rows = self._clearance_rows_from_buckets(start_date, end_date, street_name)
+        else:
+            # 基础查询语句：最细粒度的单次分组扫描
+            base_query = f"""
+            SELECT 
+                {', '.join(group_columns)},
+                DATE(load_time_str) AS day,
+                COUNT(*) AS trips,
+                SUM(CAST(garbage_weight AS FLOAT)) AS total_weight,
+                COUNT(garbage_weight) AS weighed_trips,
+                json_group_array(DISTINCT community_name) AS communities
+            FROM garbage_data 
+            WHERE load_time_str BETWEEN ? AND ?
+            """
+            
+            params = [start_date, end_date]
+            
+            # 如果指定了街道，添加过滤条件
+            if street_name:
+                base_query += " AND street_name = ?"
+                params.append(street_name)
+            
+            base_query += f"""
+            GROUP BY {', '.join(group_columns)}, DATE(load_time_str)
+            """
+            
+            rows = self.execute_query(base_query, tuple(params), date_range=(start_date, end_date),
+                                      source="get_street_clearance_statistics")
+        
+        # 汇总为街道×类型（×附加维度）统计
+        groups: Dict[Tuple, Dict[str, Any]] = {}
+        trend_totals: Dict[Tuple, Optional[float]] = {}
+        for row in rows:
+            key = tuple(row[c] for c in group_columns)
+            group = groups.setdefault(key, {
+                "trips": 0, "total_weight": None, "weighed_trips": 0, "communities": set(),
+                "days": []
+            })
+            group["days"].append((row["day"], row["street_name"], row["type_name"]))
+            group["trips"] += row["trips"]
+            group["weighed_trips"] += row["weighed_trips"]
+            if row["total_weight"] is not None:
+                group["total_weight"] = (group["total_weight"] or 0) + row["total_weight"]
+            group["communities"].update(c for c in json.loads(row["communities"]) if c is not None)
+            
+            # 汇总为街道×日期趋势
+            trend_key = (row["street_name"], row["day"])
+            trend_totals.setdefault(trend_key, None)
+            if row["total_weight"] is not None:
+                trend_totals[trend_key] = (trend_totals[trend_key] or 0) + row["total_weight"]
+        
+        if approximate:
+            community_counts = self.estimate_distinct_counts(
+                "garbage_data", "community_name",
+                {key: group["days"] for key, group in groups.items()}
+            )
         
-        return {
-            "查询日期": date,
-            "清运概览": overview,
-            "清运明细": details,
-            "统计时间": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        statistics = []
+        for key, group in groups.items():
+            entry = {"街道": key[0], "垃圾类型": key[1]}
+            for dimension, value in zip(dimensions, key[2:]):
+                entry[self.CLEARANCE_EXTRA_DIMENSIONS[dimension]] = value
+            entry.update({
+                "清运次数": group["trips"],
+                "总清运量": group["total_weight"],
+                "平均清运量": group["total_weight"] / group["weighed_trips"]
+                if group["total_weight"] is not None and group["weighed_trips"] else None,
+                "涉及小区数": community_counts[key] if approximate else len(group["communities"])
+            })
+            statistics.append(entry)
+        # 与原SQL一致：按街道升序、总清运量降序（NULL排在最后）
+        statistics.sort(key=lambda x: (x["总清运量"] is None, -(x["总清运量"] or 0)))
+        statistics.sort(key=lambda x: _sqlite_sort_key(x["街道"]))
+        
+        trends = [
+            {"街道": street, "日期": day, "日清运量": total}
+            for (street, day), total in sorted(
+                trend_totals.items(),
+                key=lambda x: (_sqlite_sort_key(x[0][0]), _sqlite_sort_key(x[0][1]))
+            )
+        ]
+        
+        result = {
+            "查询时间段": f"{start_date} 至 {end_date}",
+            "指定街道": street_name or "全部街道",
+            "清运统计": statistics,
+            "清运趋势": trends
         }
+        if approximate:
+            result["去重计数方式"] = self._approximate_distinct_note()
+        return result
     
-    def get_street_clearance_statistics(self, start_date: str, end_date: str, 
-                                      street_name: Optional[str] = None) -> Dict[str, Any]:
+    def _clearance_rows_from_buckets(self, start_date: str, end_date: str,
+                                     street_name: Optional[str]) -> List[Dict[str, Any]]:
         """
-        功能2: 筛选查询各街道清运数量
+        由garbage_data的小时桶合并出按(街道, 垃圾类型, 日期)分组的清运次数和清运量
+        
+        小时桶标识与起止时间按文本比较，与明细查询的 load_time_str BETWEEN 边界一致（精确到小时）；
+        小时桶中没有小区，communities固定为空数组，涉及小区数另由草图估计。
+        """
+        self._ensure_hourly_buckets("garbage_data")
+        dimensions = list(self.TIME_SERIES_SOURCES["garbage_data"]["dimensions"])
+        street, type_name = (f"d{dimensions.index(c)}" for c in ("street_name", "type_name"))
+        query = f"""
+        SELECT {street} AS street_name, {type_name} AS type_name, substr(hour, 1, 10) AS day,
+               SUM(event_count) AS trips, SUM(measure_sum) AS total_weight,
+               SUM(measure_count) AS weighed_trips, '[]' AS communities
+        FROM meta_hourly_buckets
+        WHERE table_name = 'garbage_data' AND hour BETWEEN ? AND ?
+        """
+        params = [start_date, end_date]
+        if street_name:
+            query += f" AND {street} = ?"
+            params.append(street_name)
+        query += f" GROUP BY {street}, {type_name}, substr(hour, 1, 10)"
+        return self.execute_query(query, tuple(params), source="get_street_clearance_statistics")
+    
+    def _street_clearance_statistics_from_cache(self, cache: "GarbageAnalyticsCache",
+                                                start_date: str, end_date: str,
+                                                street_name: Optional[str]) -> Dict[str, Any]:
+        """
+        用分析缓存计算街道清运统计，结果与SQL路径一致
         
         Args:
+            cache: 已加载的分析缓存
             start_date: 开始日期 (YYYY-MM-DD)
             end_date: 结束日期 (YYYY-MM-DD)
             street_name: 指定街道名称，为None时查询所有街道
@@ -356,103 +2889,351 @@ class GarbageMonitoringDB:
         Returns:
             街道清运统计数据
         """
-        # 基础查询语句
-        base_query = """
-        SELECT 
-            street_name AS 街道,
-            type_name AS 垃圾类型,
-            COUNT(*) AS 清运次数,
-            SUM(CAST(garbage_weight AS FLOAT)) AS 总清运量,
-            AVG(CAST(garbage_weight AS FLOAT)) AS 平均清运量,
-            COUNT(DISTINCT community_name) AS 涉及小区数
-        FROM garbage_data 
-        WHERE load_time_str BETWEEN ? AND ?
-        """
+        filters = {"street_name": street_name} if street_name else None
         
-        params = [start_date, end_date]
+        statistics = [
+            {
+                "街道": group["street_name"],
+                "垃圾类型": group["type_name"],
+                "清运次数": group["trips"],
+                "总清运量": group["total_weight"],
+                "平均清运量": group["total_weight"] / group["weighed_trips"]
+                if group["total_weight"] is not None and group["weighed_trips"] else None,
+                "涉及小区数": group["distinct_community_name"]
+            }
+            for group in cache.aggregate(
+                ["street_name", "type_name"], start=start_date, end=end_date,
+                filters=filters, distinct=["community_name"]
+            )
+        ]
+        statistics.sort(key=lambda x: (x["总清运量"] is None, -(x["总清运量"] or 0)))
+        statistics.sort(key=lambda x: _sqlite_sort_key(x["街道"]))
         
-        # 如果指定了街道，添加过滤条件
-        if street_name:
-            base_query += " AND street_name = ?"
-            params.append(street_name)
+        trends = [
+            {"街道": group["street_name"], "日期": group["day"], "日清运量": group["total_weight"]}
+            for group in cache.aggregate(
+                ["street_name"], start=start_date, end=end_date, filters=filters, by_day=True
+            )
+        ]
+        trends.sort(key=lambda x: (_sqlite_sort_key(x["街道"]), _sqlite_sort_key(x["日期"])))
         
-        base_query += """
-        GROUP BY street_name, type_name
-        ORDER BY street_name, 总清运量 DESC
+        return {
+            "查询时间段": f"{start_date} 至 {end_date}",
+            "指定街道": street_name or "全部街道",
+            "清运统计": statistics,
+            "清运趋势": trends
+        }
+    
+    @_writes_to_disk
+    def update_community_ewma(self, rebuild: bool = False) -> Dict[str, Any]:
         """
+        用新导入日期的日清运量增量更新各小区的EWMA均值和方差
         
-        # 查询趋势数据
-        trend_query = """
-        SELECT 
-            street_name AS 街道,
-            DATE(load_time_str) AS 日期,
-            SUM(CAST(garbage_weight AS FLOAT)) AS 日清运量
-        FROM garbage_data 
-        WHERE load_time_str BETWEEN ? AND ?
+        只处理晚于已处理最后一天的日期，历史数据不会重复扫描累计。
+        已处理日期的行数和清运量合计记录在meta_community_ewma_days中；
+        某个已处理日期的记录发生变化（补录迟到数据、表被重新导入）时，
+        滚动统计依赖此后每一天的结果，因此清空后从最早日期重新计算。
+        小区首次出现之后没有清运记录的日期按0计入，以便发现漏收。
+        每天先用更新前的均值和方差计算偏离度z，再更新滚动统计。
+        
+        Args:
+            rebuild: 是否清空滚动统计，从最早日期重新计算
+            
+        Returns:
+            本次处理的日期数、小区数，以及是否因已处理日期变化而重新计算
         """
+        alpha = ANOMALY_CONFIG["alpha"]
+        min_relative_std = ANOMALY_CONFIG["min_relative_std"]
         
-        trend_params = [start_date, end_date]
-        if street_name:
-            trend_query += " AND street_name = ?"
-            trend_params.append(street_name)
+        valid = "community_name IS NOT NULL AND community_name != ''"
+        with self._lock:
+            cursor = self.connection.cursor()
+            cursor.execute(f"""
+            SELECT DATE(load_time_str) AS day, COUNT(*) AS n,
+                   TOTAL(CAST(garbage_weight AS FLOAT)) AS weight
+            FROM garbage_data
+            WHERE {valid}
+            GROUP BY DATE(load_time_str)
+            HAVING day IS NOT NULL
+            """)
+            fingerprints = {row["day"]: (row["n"], row["weight"]) for row in cursor.fetchall()}
+            cursor.execute("SELECT day, row_count, weight_sum FROM meta_community_ewma_days")
+            processed = {row["day"]: (row["row_count"], row["weight_sum"]) for row in cursor.fetchall()}
+            cursor.execute("SELECT MAX(last_day) FROM meta_community_ewma")
+            watermark = cursor.fetchone()[0] or ""
+            # 已处理日期的记录被修改或删除，或在已处理范围内新出现了日期
+            changed = [
+                day for day in sorted(set(processed) | set(fingerprints))
+                if day <= watermark and (
+                    day not in processed or day not in fingerprints
+                    or fingerprints[day][0] != processed[day][0]
+                    or not math.isclose(fingerprints[day][1], processed[day][1],
+                                        rel_tol=1e-9, abs_tol=1e-6))
+            ]
+            if changed and not rebuild:
+                logger.info(f"已处理日期 {changed[0]} 起的清运记录发生变化，重新计算小区清运量滚动统计")
+                rebuild = True
+            if rebuild:
+                cursor.execute("DELETE FROM meta_community_ewma")
+                cursor.execute("DELETE FROM meta_community_ewma_days")
+                watermark = ""
+            cursor.execute("SELECT * FROM meta_community_ewma")
+            states = {row["community_name"]: dict(row) for row in cursor.fetchall()}
+            
+            cursor.execute(f"""
+            SELECT community_name, MAX(street_name) AS street_name,
+                   DATE(load_time_str) AS day,
+                   SUM(CAST(garbage_weight AS FLOAT)) AS weight
+            FROM garbage_data
+            WHERE DATE(load_time_str) > ? AND {valid}
+            GROUP BY community_name, DATE(load_time_str)
+            """, (watermark,))
+            daily: Dict[str, Dict[str, Tuple[Any, float]]] = {}
+            for row in cursor.fetchall():
+                daily.setdefault(row["day"], {})[row["community_name"]] = (
+                    row["street_name"], row["weight"] or 0.0
+                )
+            
+            days = sorted(daily)
+            for day in days:
+                observed = daily[day]
+                for community in set(states) | set(observed):
+                    street, weight = observed.get(community, (None, 0.0))
+                    state = states.get(community)
+                    if state is None:
+                        states[community] = {
+                            "community_name": community, "street_name": street,
+                            "first_day": day, "last_day": day, "days_observed": 1,
+                            "ewma_mean": weight, "ewma_var": 0.0, "last_weight": weight,
+                            "expected_weight": None, "expected_std": None, "z_score": None
+                        }
+                        continue
+                    
+                    mean, var = state["ewma_mean"], state["ewma_var"]
+                    std = max(var ** 0.5, abs(mean) * min_relative_std, 1e-9)
+                    state["expected_weight"] = mean
+                    state["expected_std"] = std
+                    state["z_score"] = (weight - mean) / std
+                    # 增量EWMA方差：var' = (1 - a) * (var + a * d^2)
+                    diff = weight - mean
+                    state["ewma_mean"] = mean + alpha * diff
+                    state["ewma_var"] = (1 - alpha) * (var + alpha * diff * diff)
+                    state["last_weight"] = weight
+                    state["last_day"] = day
+                    state["days_observed"] += 1
+                    if street is not None:
+                        state["street_name"] = street
+            
+            if days:
+                updated_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                cursor.executemany("""
+                INSERT OR REPLACE INTO meta_community_ewma (
+                    community_name, street_name, first_day, last_day, days_observed,
+                    ewma_mean, ewma_var, last_weight, expected_weight, expected_std, z_score, updated_at
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """, [
+                    (s["community_name"], s["street_name"], s["first_day"], s["last_day"],
+                     s["days_observed"], s["ewma_mean"], s["ewma_var"], s["last_weight"],
+                     s["expected_weight"], s["expected_std"], s["z_score"], updated_at)
+                    for s in states.values()
+                ])
+                cursor.executemany("""
+                INSERT OR REPLACE INTO meta_community_ewma_days (day, row_count, weight_sum)
+                VALUES (?, ?, ?)
+                """, [(day,) + fingerprints[day] for day in days])
+            if days or rebuild:
+                self.connection.commit()
+        
+        logger.info(f"小区清运量滚动统计已更新，新增 {len(days)} 天，共 {len(states)} 个小区")
+        return {"新增日期数": len(days), "小区数": len(states), "重新计算": rebuild}
+    
+    def get_clearance_anomalies(self, z_threshold: Optional[float] = None,
+                                limit: int = 50) -> Dict[str, Any]:
+        """
+        功能: 识别最近一天日清运量骤降或骤增的小区
         
-        trend_query += """
-        GROUP BY street_name, DATE(load_time_str)
-        ORDER BY 街道, 日期
+        直接读取导入时维护的EWMA滚动统计，不扫描历史数据。
+        
+        Args:
+            z_threshold: 偏离度阈值，默认取配置
+            limit: 最多返回的小区数
+            
+        Returns:
+            最近一天的异常小区，按偏离程度降序
         """
+        if z_threshold is None:
+            z_threshold = ANOMALY_CONFIG["z_threshold"]
         
-        statistics = self.execute_query(base_query, tuple(params))
-        trends = self.execute_query(trend_query, tuple(trend_params))
+        with self._lock:
+            has_state = self.connection.execute(
+                "SELECT 1 FROM meta_community_ewma LIMIT 1"
+            ).fetchone()
+        # 只读连接不能写入滚动统计，由可写连接在导入或启动工作进程前补齐
+        if not has_state and not self.read_only:
+            self.update_community_ewma()
+        
+        latest = self.execute_query("SELECT MAX(last_day) AS day FROM meta_community_ewma",
+                                    source="get_clearance_anomalies")[0]["day"]
+        anomalies = self.execute_query("""
+        SELECT 
+            community_name AS 小区,
+            street_name AS 街道,
+            last_day AS 日期,
+            last_weight AS 当日清运量,
+            expected_weight AS 预期清运量,
+            expected_std AS 标准差,
+            z_score AS 偏离度,
+            CASE WHEN z_score < 0 THEN '骤降' ELSE '骤增' END AS 异常类型,
+            days_observed AS 观测天数
+        FROM meta_community_ewma
+        WHERE last_day = ? AND days_observed > ? AND ABS(z_score) >= ?
+        ORDER BY ABS(z_score) DESC
+        LIMIT ?
+        """, (latest, ANOMALY_CONFIG["min_periods"], z_threshold, limit), source="get_clearance_anomalies")
         
         return {
-            "查询时间段": f"{start_date} 至 {end_date}",
-            "指定街道": street_name or "全部街道",
-            "清运统计": statistics,
-            "清运趋势": trends
+            "检测日期": latest,
+            "判定阈值": z_threshold,
+            "平滑系数": ANOMALY_CONFIG["alpha"],
+            "异常小区数": len(anomalies),
+            "异常小区": anomalies
         }
     
-    def get_overdue_issues(self) -> Dict[str, Any]:
+    @_writes_to_disk
+    def refresh_open_issues(self, table_name: str):
+        """
+        重新生成一张事件表在问题状态表中的记录
+        
+        每个事件保存发生时间（opened_at）和处置时间（closed_at，未处置为NULL），
+        查询时按截至时间判断事件当时是否仍未处置。
+        
+        Args:
+            table_name: 表格名称，需在OPEN_ISSUE_SOURCES中
+        """
+        opened_column = self.OPEN_ISSUE_SOURCES[table_name]
+        take_minutes = "take_minutes" if table_name == "small_package_garbage" else "NULL"
+        with self._lock:
+            cursor = self.connection.cursor()
+            cursor.execute("DELETE FROM meta_open_issues WHERE source = ?", (table_name,))
+            cursor.execute(f"""
+            INSERT OR REPLACE INTO meta_open_issues (
+                source, event_id, station_name, division_name, community_name,
+                opened_at, closed_at, is_handle, is_timeout, take_minutes
+            )
+            SELECT ?, event_id, station_name, division_name, community_name,
+                   NULLIF({opened_column}, ''), NULLIF(handle_time, ''), is_handle, is_timeout,
+                   {take_minutes}
+            FROM "{table_name}"
+            """, (table_name,))
+            self.connection.commit()
+            self._overdue_cache.clear()
+        logger.info(f"已更新表 {table_name} 的问题状态，共 {cursor.rowcount} 条")
+    
+    @staticmethod
+    def _normalize_as_of(as_of: Optional[str]) -> str:
+        """
+        规范化统计截至时间
+        
+        Args:
+            as_of: YYYY-MM-DD 或 YYYY-MM-DD HH:MM[:SS]，只有日期时取当天结束，为None时取当前时间
+            
+        Returns:
+            YYYY-MM-DD HH:MM:SS 格式的时间
+        """
+        if as_of is None:
+            return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        value = as_of.strip()
+        for fmt, suffix in (('%Y-%m-%d %H:%M:%S', None), ('%Y-%m-%d %H:%M', None),
+                            ('%Y-%m-%d', '23:59:59')):
+            try:
+                parsed = datetime.strptime(value, fmt)
+            except ValueError:
+                continue
+            normalized = parsed.strftime('%Y-%m-%d %H:%M:%S')
+            return normalized[:11] + suffix if suffix else normalized
+        raise ValueError(f"as_of格式应为 YYYY-MM-DD 或 YYYY-MM-DD HH:MM:SS: {as_of}")
+    
+    def get_overdue_issues(self, as_of: Optional[str] = None) -> Dict[str, Any]:
         """
         功能3: 整治逾期混运等问题
         
+        读取导入时维护的问题状态表，按截至时间判断事件当时的处置情况，
+        只为返回的问题计算处置耗时。指定as_of时结果可复现并会被缓存。
+        
+        Args:
+            as_of: 统计截至时间 (YYYY-MM-DD 或 YYYY-MM-DD HH:MM:SS)，默认为当前时间
+            
         Returns:
             包含小包垃圾超时和垃圾桶满溢超时问题的数据
         """
+        cacheable = as_of is not None
+        as_of = self._normalize_as_of(as_of)
+        
+        with self._lock:
+            version = self.connection.execute("PRAGMA data_version").fetchone()[0]
+            cached = self._overdue_cache.get(as_of) if cacheable else None
+            if cached is not None and cached[0] == version:
+                self._overdue_cache.move_to_end(as_of)
+                return dict(self._copy_overdue_result(cached[1]),
+                            查询时间=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+            
+            missing = [
+                table_name for table_name in self.OPEN_ISSUE_SOURCES
+                if not self.connection.execute(
+                    "SELECT 1 FROM meta_open_issues WHERE source = ? LIMIT 1", (table_name,)
+                ).fetchone()
+                and self.connection.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table_name,)
+                ).fetchone()
+            ]
+        for table_name in missing:
+            self.refresh_open_issues(table_name)
+        
+        # 截至as_of已处置：标记为已处置，且处置时间未知或不晚于as_of
+        handled = "(is_handle = 'TRUE' AND (closed_at IS NULL OR closed_at <= ?))"
+        opened = "(opened_at IS NULL OR opened_at <= ?)"
+        
         # 小包垃圾超时未处置问题
-        small_package_query = """
+        small_package_query = f"""
         SELECT 
             station_name AS 垃圾房名称,
             division_name AS 区划名称,
             community_name AS 小区名称,
-            drop_time AS 落地时间,
-            handle_time AS 处置时间,
+            opened_at AS 落地时间,
+            CASE WHEN {handled} THEN closed_at END AS 处置时间,
             CASE WHEN is_timeout = 'TRUE' THEN '超时' ELSE '正常' END AS 处置状态,
-            CASE WHEN is_handle = 'TRUE' THEN '已处置' ELSE '未处置' END AS 处置情况,
+            CASE WHEN {handled} THEN '已处置' ELSE '未处置' END AS 处置情况,
             take_minutes AS 处置耗时分钟
-        FROM small_package_garbage 
-        WHERE is_timeout = 'TRUE' OR is_handle = 'FALSE'
-        ORDER BY drop_time DESC
+        FROM meta_open_issues 
+        WHERE source = 'small_package_garbage' AND {opened}
+          AND (is_timeout = 'TRUE' OR NOT {handled})
+        ORDER BY opened_at DESC
         """
         
-        # 垃圾桶满溢超时问题
-        overflow_query = """
+        # 垃圾桶满溢超时问题，耗时计算到处置时间或as_of
+        overflow_query = f"""
         SELECT 
             station_name AS 垃圾房名称,
             division_name AS 区划名称,
             community_name AS 小区名称,
-            full_time AS 满溢时间,
-            handle_time AS 处置时间,
-            CASE WHEN is_handle = 'TRUE' THEN '已处置' ELSE '未处置' END AS 处置状态,
-            ROUND((JULIANDAY(COALESCE(handle_time, datetime('now'))) - JULIANDAY(full_time)) * 24, 2) AS 处置耗时小时
-        FROM garbage_bin_overflow 
-        WHERE is_handle = 'FALSE' OR handle_time IS NULL
-        ORDER BY full_time DESC
+            opened_at AS 满溢时间,
+            CASE WHEN {handled} THEN closed_at END AS 处置时间,
+            CASE WHEN {handled} THEN '已处置' ELSE '未处置' END AS 处置状态,
+            ROUND((JULIANDAY(CASE WHEN {handled} AND closed_at IS NOT NULL THEN closed_at
+                                  ELSE ? END) - JULIANDAY(opened_at)) * 24, 2) AS 处置耗时小时
+        FROM meta_open_issues 
+        WHERE source = 'garbage_bin_overflow' AND {opened}
+          AND (NOT {handled} OR closed_at IS NULL)
+        ORDER BY opened_at DESC
         """
         
-        small_package_issues = self.execute_query(small_package_query)
-        overflow_issues = self.execute_query(overflow_query)
+        # 所有占位符都是as_of
+        small_package_issues = self.execute_query(
+            small_package_query, (as_of,) * small_package_query.count("?"), source="get_overdue_issues")
+        overflow_issues = self.execute_query(overflow_query, (as_of,) * overflow_query.count("?"),
+                                             source="get_overdue_issues")
         
-        return {
+        result = {
             "小包垃圾超时问题": {
                 "问题数量": len(small_package_issues),
                 "问题详情": small_package_issues
@@ -461,8 +3242,26 @@ class GarbageMonitoringDB:
                 "问题数量": len(overflow_issues),
                 "问题详情": overflow_issues
             },
+            "统计截至": as_of,
             "查询时间": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         }
+        
+        if cacheable:
+            with self._lock:
+                self._overdue_cache[as_of] = (version, result)
+                while len(self._overdue_cache) > self.OVERDUE_CACHE_SIZE:
+                    self._overdue_cache.popitem(last=False)
+            return self._copy_overdue_result(result)
+        return result
+    
+    @staticmethod
+    def _copy_overdue_result(result: Dict[str, Any]) -> Dict[str, Any]:
+        """复制逾期问题结果，调用方修改返回值不影响缓存"""
+        return {
+            key: {**value, "问题详情": [dict(row) for row in value["问题详情"]]}
+            if isinstance(value, dict) else value
+            for key, value in result.items()
+        }
     
     # ========== 装修垃圾监管功能 ==========
     
@@ -533,8 +3332,12 @@ class GarbageMonitoringDB:
         WHERE DATE(create_order_time) >= ?
         """
         
-        appointments = self.execute_query(integrated_query, (cutoff_date, cutoff_date))
-        statistics = self.execute_query(stats_query, (cutoff_date, cutoff_date))
+        appointments = self.execute_query(integrated_query, (cutoff_date, cutoff_date),
+                                          date_range=(cutoff_date, None),
+                                          source="get_decoration_appointments_data")
+        statistics = self.execute_query(stats_query, (cutoff_date, cutoff_date),
+                                        date_range=(cutoff_date, None),
+                                        source="get_decoration_appointments_data")
         
         return {
             "查询天数": days_back,
@@ -543,232 +3346,736 @@ class GarbageMonitoringDB:
             "数据总数": len(appointments)
         }
     
+    def _build_order_status_plan(self, status: Optional[str],
+                                 mode: Optional[str]) -> List[Tuple[str, Dict[str, str], str, List[Any]]]:
+        """
+        生成工单查询计划：需要扫描的模式表及各自的过滤条件
+        
+        统计和明细共用同一个计划，只扫描被请求的模式表。
+        
+        Args:
+            status: 筛选特定状态的工单
+            mode: 筛选模式，为None时包含两种模式
+            
+        Returns:
+            (模式名, 模式定义, WHERE子句, 参数列表) 的列表
+        """
+        if mode is not None and mode not in self.ORDER_MODE_SPECS:
+            raise ValueError(f"未知模式: {mode}，可选值: {'、'.join(self.ORDER_MODE_SPECS)}")
+        
+        plan = []
+        for mode_name, spec in self.ORDER_MODE_SPECS.items():
+            if mode is not None and mode_name != mode:
+                continue
+            conditions, params = [], []
+            if status:
+                conditions.append(f"{spec['status_column']} = ?")
+                params.append(status)
+            where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+            plan.append((mode_name, spec, where, params))
+        return plan
+    
     def get_order_status_details(self, status: Optional[str] = None, 
-                               mode: Optional[str] = None) -> Dict[str, Any]:
+                               mode: Optional[str] = None,
+                               page: int = 1, page_size: int = 100) -> Dict[str, Any]:
         """
         功能5: 查看各状态工单详情
         
         Args:
             status: 筛选特定状态的工单
             mode: 筛选模式 ('老模式' 或 '新模式')
+            page: 工单详情的页码，从1开始
+            page_size: 每页工单数
             
         Returns:
             工单状态统计和详情
         """
-        # 工单状态统计
-        status_stats_query = """
-        SELECT 
-            '老模式' AS 模式,
-            order_state_desc AS 状态,
-            COUNT(*) AS 工单数量,
-            COUNT(CASE WHEN is_over_time = '是' THEN 1 END) AS 超时数量
-        FROM decoration_garbage_old
-        GROUP BY order_state_desc
-        UNION ALL
-        SELECT 
-            '新模式' AS 模式,
-            order_state AS 状态,
-            COUNT(*) AS 工单数量,
-            NULL AS 超时数量
-        FROM decoration_garbage_new
-        GROUP BY order_state
-        ORDER BY 模式, 工单数量 DESC
-        """
-        
-        # 工单详情查询
-        detail_query = """
-        SELECT 
-            '老模式' AS 模式,
-            CAST(bg_order_id AS TEXT) AS 订单号,
-            street_name AS 街道,
-            community_name AS 小区,
-            order_state_desc AS 状态,
-            create_time_str AS 创建时间,
-            estimate_clear_time_str AS 预约时间,
-            finish_time_str AS 完成时间,
-            CASE WHEN is_over_time = '是' THEN '是' ELSE '否' END AS 是否超时
-        FROM decoration_garbage_old
-        WHERE 1=1
-        """
-        
-        detail_params = []
+        page = max(page, 1)
+        page_size = max(page_size, 1)
+        plan = self._build_order_status_plan(status, mode)
         
-        # 添加筛选条件
-        if status:
-            detail_query += " AND order_state_desc = ?"
-            detail_params.append(status)
-        
-        if mode == '老模式':
-            pass  # 已经只查询老模式
-        elif mode == '新模式':
-            detail_query = """
+        # 工单状态统计
+        stats_parts, stats_params = [], []
+        for mode_name, spec, where, params in plan:
+            stats_parts.append(f"""
             SELECT 
-                '新模式' AS 模式,
-                appointment_order_id AS 订单号,
-                street_name AS 街道,
-                community_name AS 小区,
-                order_state AS 状态,
-                create_order_time AS 创建时间,
-                resident_appointment_time AS 预约时间,
-                NULL AS 完成时间,
-                NULL AS 是否超时
-            FROM decoration_garbage_new
-            WHERE 1=1
-            """
-            detail_params = []
-            if status:
-                detail_query += " AND order_state = ?"
-                detail_params.append(status)
-        elif mode is None:
-            # 查询两种模式
-            new_mode_query = """
-            UNION ALL
+                '{mode_name}' AS 模式,
+                {spec['status_column']} AS 状态,
+                COUNT(*) AS 工单数量,
+                {spec['overtime_count']} AS 超时数量
+            FROM {spec['table']}
+            {where}
+            GROUP BY {spec['status_column']}
+            """)
+            stats_params.extend(params)
+        status_stats_query = " UNION ALL ".join(stats_parts) + " ORDER BY 模式, 工单数量 DESC"
+        
+        # 工单详情查询（分页）
+        detail_parts, detail_params = [], []
+        for mode_name, spec, where, params in plan:
+            detail_parts.append(f"""
             SELECT 
-                '新模式' AS 模式,
-                appointment_order_id AS 订单号,
-                street_name AS 街道,
-                community_name AS 小区,
-                order_state AS 状态,
-                create_order_time AS 创建时间,
-                resident_appointment_time AS 预约时间,
-                NULL AS 完成时间,
-                NULL AS 是否超时
-            FROM decoration_garbage_new
-            WHERE 1=1
-            """
-            if status:
-                new_mode_query += " AND order_state = ?"
-                detail_params.append(status)
-            
-            detail_query += new_mode_query
+                '{mode_name}' AS 模式,
+                {spec['detail_columns']}
+            FROM {spec['table']}
+            {where}
+            """)
+            detail_params.extend(params)
+        # 创建时间相同的工单按其余字段排序，分页时不会重复或遗漏（表没有唯一键，
+        # 所有字段都相同的行彼此无法区分）
+        detail_query = " UNION ALL ".join(detail_parts) + """
+        ORDER BY 创建时间 DESC, 模式, 订单号, 街道, 小区, 状态, 预约时间, 完成时间, 是否超时
+        LIMIT ? OFFSET ?"""
+        detail_params.extend([page_size, (page - 1) * page_size])
         
-        detail_query += " ORDER BY 创建时间 DESC"
+        status_stats = self.execute_query(status_stats_query, tuple(stats_params),
+                                          source="get_order_status_details")
+        order_details = self.execute_query(detail_query, tuple(detail_params),
+                                           source="get_order_status_details")
         
-        status_stats = self.execute_query(status_stats_query)
-        order_details = self.execute_query(detail_query, tuple(detail_params))
+        # 统计结果与明细使用相同的过滤条件，总条数可直接由统计得出
+        total = sum(row["工单数量"] for row in status_stats)
         
         return {
             "筛选条件": {
                 "状态": status or "全部状态",
                 "模式": mode or "全部模式"
             },
-            "状态统计": [e for e in status_stats if e['模式'] == mode],
+            "状态统计": status_stats,
             "工单详情": order_details,
-            "查询结果数": len(order_details)
+            "查询结果数": len(order_details),
+            "分页": {
+                "页码": page,
+                "每页条数": page_size,
+                "总条数": total,
+                "总页数": (total + page_size - 1) // page_size
+            }
         }
     
     # ========== 辅助功能 ==========
     
-    def check_data_quality(self) -> Dict[str, Any]:
+    def _list_data_tables(self) -> List[str]:
+        """列出所有业务数据表（不含SQLite内部表和元数据表）"""
+        with self._lock:
+            cursor = self.connection.cursor()
+            cursor.execute("""
+            SELECT name FROM sqlite_master
+            WHERE type = 'table' AND name NOT LIKE 'sqlite_%' AND name NOT LIKE ?
+            ORDER BY name
+            """, (f"{self.META_TABLE_PREFIX}%",))
+            return [row[0] for row in cursor.fetchall()]
+    
+    def _table_display_name(self, table_name: str) -> str:
+        """获取表格的中文显示名称"""
+        for display_name, name in self.TABLE_NAME_MAPPING.items():
+            if name == table_name:
+                return display_name
+        return table_name
+    
+    def _store_table_profile(self, table_name: str, profiles: List[Dict[str, Any]],
+                             column_comments: Optional[Dict[str, str]] = None):
+        """保存表的数据画像，未提供注释时保留已有的字段注释"""
+        with self._lock:
+            cursor = self.connection.cursor()
+            if column_comments is None:
+                cursor.execute(
+                    "SELECT column_name, column_comment FROM meta_column_profile WHERE table_name = ?",
+                    (table_name,)
+                )
+                column_comments = {row[0]: row[1] for row in cursor.fetchall()}
+            
+            profiled_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            cursor.execute("DELETE FROM meta_column_profile WHERE table_name = ?", (table_name,))
+            cursor.executemany("""
+            INSERT INTO meta_column_profile (
+                table_name, column_name, column_type, column_comment, total_rows,
+                null_count, empty_count, distinct_count, duplicate_kinds, duplicate_rows,
+                min_value, max_value, profiled_at
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, [
+                (table_name, p["column_name"], p["column_type"],
+                 column_comments.get(p["column_name"], ''), p["total_rows"],
+                 p["null_count"], p["empty_count"], p["distinct_count"],
+                 p["duplicate_kinds"], p["duplicate_rows"],
+                 p["min_value"], p["max_value"], profiled_at)
+                for p in profiles
+            ])
+            self.connection.commit()
+    
+    def _profile_table_isolated(self, table_name: str) -> List[Dict[str, Any]]:
+        """
+        在独立的只读连接上计算一张表的画像，扫描期间不占用服务连接的锁
+        
+        连接与服务连接一样设置进度回调，调用方的截止时间和取消标记同样生效。
+        """
+        if self.partitioned:
+            # 分区表由服务连接上的临时视图合并，独立连接读不到分区数据
+            with self._lock:
+                self._route_partitions()
+                return _profile_table(self.connection, table_name)
+        connection = self._open_isolated_connection()
+        try:
+            connection.row_factory = None
+            return _profile_table(connection, table_name)
+        finally:
+            connection.close()
+    
+    def check_data_quality(self, refresh: bool = False,
+                           include_markdown: bool = False) -> Dict[str, Any]:
         """
         检查数据质量
         
+        画像在数据导入时按表计算并保存，这里直接读取；
+        尚无画像或要求刷新的表在独立的只读连接上逐表依次计算（不并行），每张表只扫描一遍，
+        受调用方的截止时间和取消标记约束。唯一值数量和重复值为估计值，
+        报告的“估计值字段”列出这些字段。
+        只读连接不计算画像，尚无画像的表在报告中标注错误。
+        
+        Args:
+            refresh: 是否重新计算所有表的画像
+            include_markdown: 是否附带与shanghaichengdi.md格式一致的Markdown表格
+            
         Returns:
             数据质量报告
+            
+        Raises:
+            ValueError: 在只读连接上要求刷新画像
         """
-        quality_checks = []
-        
-        # 检查各表的数据完整性
-        tables_to_check = [
-            ("garbage_data", "干湿垃圾数据", ["street_name", "garbage_weight"]),
-            ("small_package_garbage", "小包垃圾落地", ["division_name", "drop_time"]),
-            ("garbage_bin_overflow", "垃圾桶满溢", ["station_name", "full_time"]),
-            ("decoration_garbage_old", "装修垃圾老模式", ["street_name", "create_time_str"]),
-            ("decoration_garbage_new", "装修垃圾新模式", ["street_name", "create_order_time"])
-        ]
+        tables = self._list_data_tables()
+        with self._lock:
+            cursor = self.connection.cursor()
+            cursor.execute("SELECT DISTINCT table_name FROM meta_column_profile")
+            profiled = {row[0] for row in cursor.fetchall()}
         
-        for table_name, display_name, key_fields in tables_to_check:
+        pending = [t for t in tables if refresh or t not in profiled]
+        errors = {}
+        if pending and self.read_only:
+            # 只读连接不能保存画像，需在可写连接上刷新（MCP服务器在主进程中执行刷新）
+            if refresh:
+                raise ValueError("只读连接不能刷新数据画像")
+            errors = {t: "尚无数据画像，只读连接不能计算" for t in pending}
+            pending = []
+        if pending:
+            logger.info(f"计算 {len(pending)} 张表的数据画像")
+        for table_name in pending:
+            self._local.abort_reason = None
             try:
-                # 总行数
-                count_query = f"SELECT COUNT(*) as total FROM {table_name}"
-                total_result = self.execute_query(count_query)
-                total_count = total_result[0]['total'] if total_result else 0
-                
-                # 检查关键字段缺失
-                missing_data = {}
-                for field in key_fields:
-                    missing_query = f"""
-                    SELECT COUNT(*) as missing 
-                    FROM {table_name} 
-                    WHERE {field} IS NULL OR {field} = ''
-                    """
-                    missing_result = self.execute_query(missing_query)
-                    missing_count = missing_result[0]['missing'] if missing_result else 0
-                    missing_data[field] = {
-                        "缺失数量": missing_count,
-                        "缺失率": f"{(missing_count/total_count*100):.2f}%" if total_count > 0 else "0%"
-                    }
-                
-                quality_checks.append({
-                    "表名": display_name,
-                    "总行数": total_count,
-                    "字段缺失情况": missing_data
-                })
-                
+                profiles = self._profile_table_isolated(table_name)
+            except sqlite3.OperationalError as e:
+                # 超时或取消时中止整个检查，其他错误只影响该表
+                self._raise_if_aborted()
+                errors[table_name] = str(e)
+                continue
             except Exception as e:
+                errors[table_name] = str(e)
+                continue
+            self._store_table_profile(table_name, profiles)
+        
+        with self._lock:
+            cursor = self.connection.cursor()
+            cursor.execute("SELECT * FROM meta_column_profile ORDER BY table_name, rowid")
+            stored = [dict(row) for row in cursor.fetchall()]
+        
+        quality_checks = []
+        for table_name in tables:
+            if table_name in errors:
                 quality_checks.append({
-                    "表名": display_name,
-                    "错误": str(e)
+                    "表名": self._table_display_name(table_name),
+                    "错误": errors[table_name]
+                })
+                continue
+            
+            rows = [r for r in stored if r["table_name"] == table_name]
+            total_rows = rows[0]["total_rows"] if rows else 0
+            column_profiles = []
+            for r in rows:
+                missing = r["null_count"] + r["empty_count"]
+                column_profiles.append({
+                    "字段名": r["column_name"],
+                    "数据类型": r["column_type"],
+                    "备注": r["column_comment"],
+                    "缺失值数量": missing,
+                    "缺失率(%)": round(missing / total_rows * 100, 2) if total_rows else 0,
+                    "唯一值数量": r["distinct_count"],
+                    "重复值种类": r["duplicate_kinds"],
+                    "重复值总行数": r["duplicate_rows"],
+                    "重复率(%)": round(r["duplicate_rows"] / total_rows * 100, 2) if total_rows else 0,
+                    "最小值": r["min_value"],
+                    "最大值": r["max_value"]
                 })
+            
+            entry = {
+                "表名": self._table_display_name(table_name),
+                "数据表": table_name,
+                "总行数": total_rows,
+                "画像时间": rows[0]["profiled_at"] if rows else None,
+                "字段画像": column_profiles
+            }
+            if include_markdown:
+                entry["Markdown"] = self._format_profile_markdown(entry)
+            quality_checks.append(entry)
         
+        error = 1.04 / math.sqrt(1 << DATA_QUALITY_CONFIG["hll_precision"])
         return {
             "数据质量检查": quality_checks,
-            "检查时间": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            "检查时间": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            "估计值字段": list(self.PROFILE_ESTIMATED_FIELDS),
+            "说明": f"缺失值和最小/最大值为精确值；唯一值数量为HyperLogLog估计（相对标准误差约{error:.1%}），"
+                    f"重复值由Bloom过滤器估计，取值种类很多时略有高估"
         }
     
+    @staticmethod
+    def _format_profile_markdown(entry: Dict[str, Any]) -> str:
+        """将单表画像格式化为shanghaichengdi.md中的Markdown表格"""
+        headers = ["字段名", "数据类型", "备注", "缺失值数量", "缺失率(%)", "唯一值数量",
+                   "重复值种类", "重复值总行数", "重复率(%)"]
+        lines = [
+            f"- {entry['表名']}",
+            "",
+            "| " + " | ".join(headers) + " |",
+            "| " + " | ".join("---" for _ in headers) + " |"
+        ]
+        for profile in entry["字段画像"]:
+            lines.append("| " + " | ".join(str(profile[h]) for h in headers) + " |")
+        lines += ["", f"注：{'、'.join(GarbageMonitoringDB.PROFILE_ESTIMATED_FIELDS)}为估计值"]
+        return "\n".join(lines)
+    
     def get_available_date_range(self) -> Dict[str, Any]:
         """
         获取可用的数据日期范围
         
+        直接读取导入时维护的元数据目录，不扫描数据表。
+        
         Returns:
-            各表的数据日期范围
+            各表的行数和数据日期范围
         """
         date_ranges = {}
         
-        # 检查干湿垃圾数据日期范围
-        garbage_query = """
-        SELECT 
-            MIN(DATE(load_time_str)) as min_date,
-            MAX(DATE(load_time_str)) as max_date,
-            COUNT(DISTINCT DATE(load_time_str)) as date_count
-        FROM garbage_data
-        WHERE load_time_str IS NOT NULL
+        try:
+            catalog = self.get_table_catalog()
+            for table_name in self._list_data_tables():
+                entry = catalog.get(table_name)
+                if entry is None:
+                    continue
+                date_ranges[self._table_display_name(table_name)] = {
+                    "min_date": entry["min_time"][:10] if entry["min_time"] else None,
+                    "max_date": entry["max_time"][:10] if entry["max_time"] else None,
+                    "date_count": entry["distinct_days"],
+                    "row_count": entry["row_count"],
+                    "time_column": entry["time_column"],
+                    "min_time": entry["min_time"],
+                    "max_time": entry["max_time"]
+                }
+        except Exception as e:
+            logger.error(f"获取日期范围失败: {e}")
+        
+        return {
+            "数据日期范围": date_ranges,
+            "查询时间": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        }
+    
+    # ========== 统计分析功能 ==========
+    
+    @_writes_to_disk
+    def refresh_hourly_buckets(self, table_name: str):
         """
+        重新计算一张事件表按(小时, 各维度)分组的计数和度量汇总
         
-        # 检查装修垃圾老模式日期范围
-        old_decoration_query = """
-        SELECT 
-            MIN(DATE(create_time_str)) as min_date,
-            MAX(DATE(create_time_str)) as max_date,
-            COUNT(DISTINCT DATE(create_time_str)) as date_count
-        FROM decoration_garbage_old
-        WHERE create_time_str IS NOT NULL
+        Args:
+            table_name: 表格名称，需在TIME_SERIES_SOURCES中
         """
+        source = self.TIME_SERIES_SOURCES[table_name]
+        time_column = self.TABLE_TIME_COLUMNS[table_name]
+        dimensions = list(source["dimensions"])
+        dimension_columns = dimensions + ["NULL"] * (3 - len(dimensions))
+        measure = source["measure"][0] if source["measure"] else "NULL"
+        hour = f"strftime('%Y-%m-%d %H:00', {time_column})"
         
-        # 检查装修垃圾新模式日期范围
-        new_decoration_query = """
-        SELECT 
-            MIN(DATE(create_order_time)) as min_date,
-            MAX(DATE(create_order_time)) as max_date,
-            COUNT(DISTINCT DATE(create_order_time)) as date_count
-        FROM decoration_garbage_new
-        WHERE create_order_time IS NOT NULL
+        with self._lock:
+            cursor = self.connection.cursor()
+            cursor.execute("DELETE FROM meta_hourly_buckets WHERE table_name = ?", (table_name,))
+            cursor.execute(f"""
+            INSERT INTO meta_hourly_buckets (
+                table_name, hour, d0, d1, d2, event_count, measure_sum, measure_count
+            )
+            SELECT ?, {hour}, {', '.join(dimension_columns)},
+                   COUNT(*), SUM({measure}), COUNT({measure})
+            FROM "{table_name}"
+            WHERE {hour} IS NOT NULL
+            GROUP BY {hour}, {', '.join(dimensions)}
+            """, (table_name,))
+            self.connection.commit()
+            logger.info(f"已更新表 {table_name} 的小时桶，共 {cursor.rowcount} 个")
+    
+    def _ensure_hourly_buckets(self, table_name: str):
+        """一张表还没有小时桶时先计算，写入前不持有连接锁"""
+        with self._lock:
+            has_buckets = self.connection.execute(
+                "SELECT 1 FROM meta_hourly_buckets WHERE table_name = ? LIMIT 1", (table_name,)
+            ).fetchone()
+        if not has_buckets:
+            self.refresh_hourly_buckets(table_name)
+    
+    @staticmethod
+    def _normalize_hour(value: str, end: bool = False) -> str:
         """
+        将日期或日期时间转换为小时桶标识
         
+        Args:
+            value: YYYY-MM-DD 或 YYYY-MM-DD HH[:MM[:SS]]
+            end: 是否为结束时间，只有日期时取当天最后一个小时
+            
+        Returns:
+            YYYY-MM-DD HH:00 格式的小时
+        """
+        value = value.strip()
         try:
-            garbage_range = self.execute_query(garbage_query)
-            date_ranges["干湿垃圾数据"] = garbage_range[0] if garbage_range else {}
+            if len(value) <= 10:
+                parsed = datetime.strptime(value, '%Y-%m-%d')
+                if end:
+                    parsed = parsed.replace(hour=23)
+            else:
+                parsed = datetime.strptime(value[:13], '%Y-%m-%d %H')
+        except ValueError:
+            raise ValueError(f"时间格式应为 YYYY-MM-DD 或 YYYY-MM-DD HH:MM:SS: {value}")
+        return parsed.strftime('%Y-%m-%d %H:00')
+    
+    def get_time_series(self, table_name: str, metric: str = "count", bucket: str = "day",
+                        group_by: Optional[List[str]] = None,
+                        start_time: Optional[str] = None, end_time: Optional[str] = None,
+                        filters: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        按时间粒度和维度统计事件表的时间序列
+        
+        由导入时预先计算的小时桶合并得到，不扫描原始数据、不重复解析时间字段。
+        
+        Args:
+            table_name: 表格名称，可选 TIME_SERIES_SOURCES 中的表
+            metric: 统计指标，count（事件数）、sum（度量合计）或 avg（度量平均值）
+            bucket: 时间粒度，hour、day、week（以周一日期标识）或 month
+            group_by: 分组维度，取自该表支持的维度
+            start_time: 开始时间（含），YYYY-MM-DD 或 YYYY-MM-DD HH:MM:SS
+            end_time: 结束时间（含），只有日期时包含当天全部时段
+            filters: 维度的等值过滤条件，如 {"street_name": "龙华街道"}
+            
+        Returns:
+            按时间和维度排序的时间序列
+        """
+        source = self.TIME_SERIES_SOURCES.get(table_name)
+        if source is None:
+            raise ValueError(f"不支持的数据表: {table_name}，可选值: {list(self.TIME_SERIES_SOURCES)}")
+        if bucket not in self.TIME_SERIES_BUCKETS:
+            raise ValueError(f"不支持的时间粒度: {bucket}，可选值: {list(self.TIME_SERIES_BUCKETS)}")
+        metrics = ["count", "sum", "avg"] if source["measure"] else ["count"]
+        if metric not in metrics:
+            raise ValueError(f"数据表 {table_name} 不支持的统计指标: {metric}，可选值: {metrics}")
+        
+        dimensions = list(source["dimensions"])
+        group_by = group_by or []
+        filters = filters or {}
+        unknown = [d for d in list(group_by) + list(filters) if d not in dimensions]
+        if unknown:
+            raise ValueError(f"数据表 {table_name} 不支持的维度: {unknown}，可选值: {dimensions}")
+        
+        self._ensure_hourly_buckets(table_name)
+        
+        bucket_expr = self.TIME_SERIES_BUCKETS[bucket]
+        value_expr = {
+            "count": "SUM(event_count)",
+            "sum": "SUM(measure_sum)",
+            "avg": "SUM(measure_sum) / NULLIF(SUM(measure_count), 0)"
+        }[metric]
+        select_dimensions = [
+            f'd{dimensions.index(d)} AS "{source["dimensions"][d]}"' for d in group_by
+        ]
+        group_columns = [f"d{dimensions.index(d)}" for d in group_by]
+        
+        conditions = ["table_name = ?"]
+        params: List[Any] = [table_name]
+        if start_time:
+            conditions.append("hour >= ?")
+            params.append(self._normalize_hour(start_time))
+        if end_time:
+            conditions.append("hour <= ?")
+            params.append(self._normalize_hour(end_time, end=True))
+        for dimension, value in filters.items():
+            conditions.append(f"d{dimensions.index(dimension)} = ?")
+            params.append(value)
+        
+        query = f"""
+        SELECT {bucket_expr} AS 时间,
+               {''.join(c + ', ' for c in select_dimensions)}{value_expr} AS 值
+        FROM meta_hourly_buckets
+        WHERE {' AND '.join(conditions)}
+        GROUP BY {', '.join([bucket_expr] + group_columns)}
+        ORDER BY {', '.join([bucket_expr] + group_columns)}
+        """
+        series = self.execute_query(query, tuple(params), source="get_time_series")
+        
+        metric_labels = {"count": "事件数"}
+        if source["measure"]:
+            metric_labels["sum"] = f"{source['measure'][1]}合计"
+            metric_labels["avg"] = f"平均{source['measure'][1]}"
+        
+        return {
+            "数据表": self._table_display_name(table_name),
+            "统计指标": metric_labels[metric],
+            "时间粒度": bucket,
+            "分组维度": [source["dimensions"][d] for d in group_by],
+            "时间范围": f"{start_time or '最早'} 至 {end_time or '最新'}",
+            "数据点数": len(series),
+            "时间序列": series
+        }
+    
+    @_writes_to_disk
+    def refresh_topk_counters(self, table_name: str):
+        """
+        重新计算一张事件表各排名字段的计数和度量汇总
+        
+        每个排名字段有一份不截断的全部汇总，以及按(细分值, 日期)的按日汇总。
+        按日汇总只保留事件数或度量合计位于前daily_capacity的对象，
+        被截断的日期在meta_topk_thresholds中记录被丢弃对象的最大计数和合计。
+        
+        Args:
+            table_name: 表格名称，需在TOP_K_SOURCES中
+        """
+        source = self.TOP_K_SOURCES[table_name]
+        time_column = self.TABLE_TIME_COLUMNS[table_name]
+        measure = self.TIME_SERIES_SOURCES[table_name]["measure"]
+        measure_expr = measure[0] if measure else "NULL"
+        key_columns = list(source["keys"])
+        segments = ["'*'"] + (["COALESCE(segment, '')"] if source["segment"] else [])
+        capacity = TOP_K_CONFIG["daily_capacity"]
+        
+        with self._lock:
+            cursor = self.connection.cursor()
+            cursor.execute("DELETE FROM meta_topk_counters WHERE table_name = ?", (table_name,))
+            cursor.execute("DELETE FROM meta_topk_thresholds WHERE table_name = ?", (table_name,))
             
-            old_decoration_range = self.execute_query(old_decoration_query)
-            date_ranges["装修垃圾老模式"] = old_decoration_range[0] if old_decoration_range else {}
+            # 只扫描一次原表，先按(细分值, 日期, 全部排名字段)汇总，各排名字段的计数由此再汇总
+            cursor.execute("DROP TABLE IF EXISTS temp.topk_base")
+            cursor.execute(f"""
+            CREATE TEMP TABLE topk_base AS
+            SELECT {source["segment"] or 'NULL'} AS segment, DATE({time_column}) AS day,
+                   {', '.join(key_columns)}, COUNT(*) AS n, SUM({measure_expr}) AS s
+            FROM "{table_name}"
+            GROUP BY 1, 2, {', '.join(key_columns)}
+            """)
             
-            new_decoration_range = self.execute_query(new_decoration_query)
-            date_ranges["装修垃圾新模式"] = new_decoration_range[0] if new_decoration_range else {}
+            for key_column in key_columns:
+                valid = f"{key_column} IS NOT NULL AND {key_column} != ''"
+                for segment in segments:
+                    cursor.execute(f"""
+                    INSERT INTO meta_topk_counters (
+                        table_name, key_column, segment, day, key_value, event_count, measure_sum
+                    )
+                    SELECT ?, ?, {segment}, '*', {key_column}, SUM(n), SUM(s)
+                    FROM temp.topk_base
+                    WHERE {valid}
+                    GROUP BY {segment}, {key_column}
+                    """, (table_name, key_column))
+                    
+                    cursor.execute("DROP TABLE IF EXISTS temp.topk_daily")
+                    cursor.execute(f"""
+                    CREATE TEMP TABLE topk_daily AS
+                    SELECT {segment} AS segment, day, {key_column} AS key_value,
+                           SUM(n) AS event_count, SUM(s) AS measure_sum,
+                           ROW_NUMBER() OVER (
+                               PARTITION BY {segment}, day ORDER BY SUM(n) DESC, {key_column}
+                           ) AS count_rank,
+                           ROW_NUMBER() OVER (
+                               PARTITION BY {segment}, day ORDER BY SUM(s) DESC, {key_column}
+                           ) AS sum_rank
+                    FROM temp.topk_base
+                    WHERE {valid} AND day IS NOT NULL
+                    GROUP BY {segment}, day, {key_column}
+                    """)
+                    cursor.execute("""
+                    INSERT INTO meta_topk_counters (
+                        table_name, key_column, segment, day, key_value, event_count, measure_sum
+                    )
+                    SELECT ?, ?, segment, day, key_value, event_count, measure_sum
+                    FROM temp.topk_daily
+                    WHERE count_rank <= ? OR sum_rank <= ?
+                    """, (table_name, key_column, capacity, capacity))
+                    cursor.execute("""
+                    INSERT INTO meta_topk_thresholds (
+                        table_name, key_column, segment, day, max_dropped_count, max_dropped_sum
+                    )
+                    SELECT ?, ?, segment, day, MAX(event_count), MAX(measure_sum)
+                    FROM temp.topk_daily
+                    WHERE count_rank > ? AND sum_rank > ?
+                    GROUP BY segment, day
+                    """, (table_name, key_column, capacity, capacity))
+                    cursor.execute("DROP TABLE temp.topk_daily")
+            cursor.execute("DROP TABLE temp.topk_base")
+            self.connection.commit()
+        logger.info(f"已更新表 {table_name} 的Top-K计数")
+    
+    def get_top_k(self, table_name: str, key: str, k: int = 10, metric: str = "count",
+                  type_name: Optional[str] = None, start_date: Optional[str] = None,
+                  end_date: Optional[str] = None) -> Dict[str, Any]:
+        """
+        查询事件表中计数或度量最高的K个对象
+        
+        由导入时维护的计数表得到；不限时间范围时沿索引只读取前K条，
+        限定时间范围时只合并范围内的按日计数。
+        
+        Args:
+            table_name: 表格名称，可选 TOP_K_SOURCES 中的表
+            key: 排名字段，如 community_name、station_name
+            k: 返回的条数，默认10
+            metric: 排序指标，count（事件数）或 sum（度量合计，仅有度量的表）
+            type_name: 垃圾类型（仅garbage_data），如 湿垃圾
+            start_date: 开始日期（含），YYYY-MM-DD
+            end_date: 结束日期（含），YYYY-MM-DD
             
-        except Exception as e:
-            logger.error(f"获取日期范围失败: {e}")
+        Returns:
+            排行结果
+        """
+        source = self.TOP_K_SOURCES.get(table_name)
+        if source is None:
+            raise ValueError(f"不支持的数据表: {table_name}，可选值: {list(self.TOP_K_SOURCES)}")
+        if key not in source["keys"]:
+            raise ValueError(f"数据表 {table_name} 不支持的排名字段: {key}，可选值: {list(source['keys'])}")
+        measure = self.TIME_SERIES_SOURCES[table_name]["measure"]
+        metrics = ["count", "sum"] if measure else ["count"]
+        if metric not in metrics:
+            raise ValueError(f"数据表 {table_name} 不支持的统计指标: {metric}，可选值: {metrics}")
+        if type_name is not None and source["segment"] is None:
+            raise ValueError(f"数据表 {table_name} 不支持按垃圾类型筛选")
+        if k <= 0:
+            raise ValueError("k必须为正整数")
         
-        return {
-            "数据日期范围": date_ranges,
-            "查询时间": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        } 
\ No newline at end of file
+        with self._lock:
+            has_counters = self.connection.execute(
+                "SELECT 1 FROM meta_topk_counters WHERE table_name = ? LIMIT 1", (table_name,)
+            ).fetchone()
+        if not has_counters:
+            self.refresh_topk_counters(table_name)
+        
+        count_label = "事件数"
+        sum_label = f"{measure[1]}合计" if measure else None
+        order_column = "event_count" if metric == "count" else "measure_sum"
+        params: List[Any] = [table_name, key, type_name or '*']
+        
+        # 不限时间范围：全部汇总未截断，结果精确
+        missed_count = missed_sum = 0
+        if start_date is None and end_date is None:
+            query = f"""
+            SELECT key_value, event_count, measure_sum, 0 AS present_count, 0 AS present_sum
+            FROM meta_topk_counters
+            WHERE table_name = ? AND key_column = ? AND segment = ? AND day = '*'
+            ORDER BY {order_column} DESC, key_value
+            LIMIT ?
+            """
+            params.append(k)
+        else:
+            def range_filter(column: str) -> str:
+                conditions = [f"{column} != '*'"]
+                if start_date:
+                    conditions.append(f"{column} >= ?")
+                if end_date:
+                    conditions.append(f"{column} <= ?")
+                return " AND ".join(conditions)
+            range_params = [d[:10] for d in (start_date, end_date) if d]
+            
+            # 对象在某日被截断时，其当日计数不超过当日阈值，据此计算误差上限
+            with self._lock:
+                missed_count, missed_sum = self.connection.execute(f"""
+                SELECT COALESCE(SUM(max_dropped_count), 0), COALESCE(SUM(max_dropped_sum), 0)
+                FROM meta_topk_thresholds
+                WHERE table_name = ? AND key_column = ? AND segment = ? AND {range_filter('day')}
+                """, tuple(params + range_params)).fetchone()
+            
+            query = f"""
+            SELECT c.key_value, SUM(c.event_count) AS event_count, SUM(c.measure_sum) AS measure_sum,
+                   COALESCE(SUM(t.max_dropped_count), 0) AS present_count,
+                   COALESCE(SUM(t.max_dropped_sum), 0) AS present_sum
+            FROM meta_topk_counters c
+            LEFT JOIN meta_topk_thresholds t
+              ON t.table_name = c.table_name AND t.key_column = c.key_column
+             AND t.segment = c.segment AND t.day = c.day
+            WHERE c.table_name = ? AND c.key_column = ? AND c.segment = ?
+              AND {range_filter('c.day')}
+            GROUP BY c.key_value
+            ORDER BY {order_column} DESC, c.key_value
+            LIMIT ?
+            """
+            # 多取一条，用于判断排行之外的对象能否进入前K
+            params += range_params + [k + 1]
+        rows = self.execute_query(query, tuple(params), source="get_top_k")
+        
+        missed = missed_count if metric == "count" else missed_sum
+        if missed > 0:
+            # 排行之外的对象（包括只出现在截断部分、没有按日计数的对象）真实值不超过
+            # 第K+1名的下限加全部截断阈值之和；可能超过第K名的下限时改用原表精确计算
+            outside = (rows[k][order_column] or 0) if len(rows) > k else 0
+            if len(rows) < k or (rows[k - 1][order_column] or 0) < outside + missed:
+                rows = self._top_k_exact(table_name, key, k, metric, type_name, start_date, end_date)
+                missed_count = missed_sum = 0
+        rows = rows[:k]
+        
+        ranking = []
+        approximate = False
+        for rank, row in enumerate(rows, 1):
+            entry = {"排名": rank, source["keys"][key]: row["key_value"], count_label: row["event_count"]}
+            if sum_label:
+                entry[sum_label] = row["measure_sum"]
+            # 未计入的截断日期贡献的上限
+            count_error = missed_count - row["present_count"]
+            sum_error = missed_sum - row["present_sum"]
+            if count_error > 0 or sum_error > 0:
+                approximate = True
+                entry["误差上限"] = count_error if metric == "count" else sum_error
+            ranking.append(entry)
+        
+        result = {
+            "数据表": self._table_display_name(table_name),
+            "排名字段": source["keys"][key],
+            "排序指标": count_label if metric == "count" else sum_label,
+            "垃圾类型": type_name or "全部",
+            "时间范围": f"{start_date or '最早'} 至 {end_date or '最新'}",
+            "排行": ranking
+        }
+        if approximate:
+            result["说明"] = ("部分日期的按日计数只保留了排名靠前的对象，"
+                            "排行中的数值为下限，真实值不超过数值加误差上限")
+        return result
+    
+    def _top_k_exact(self, table_name: str, key: str, k: int, metric: str,
+                     type_name: Optional[str], start_date: Optional[str],
+                     end_date: Optional[str]) -> List[Dict[str, Any]]:
+        """
+        直接在原表上分组计算时间范围内的前K个对象，按日计数被截断且无法确定排行时使用
+        
+        Returns:
+            与计数表查询相同字段的结果行，误差为0
+        """
+        source = self.TOP_K_SOURCES[table_name]
+        time_column = self.TABLE_TIME_COLUMNS[table_name]
+        measure = self.TIME_SERIES_SOURCES[table_name]["measure"]
+        conditions = [f"{key} IS NOT NULL", f"{key} != ''"]
+        params: List[Any] = []
+        if type_name is not None:
+            conditions.append(f"COALESCE({source['segment']}, '') = ?")
+            params.append(type_name)
+        if start_date:
+            conditions.append(f"DATE({time_column}) >= ?")
+            params.append(start_date[:10])
+        if end_date:
+            conditions.append(f"DATE({time_column}) <= ?")
+            params.append(end_date[:10])
+        query = f"""
+        SELECT {key} AS key_value, COUNT(*) AS event_count,
+               SUM({measure[0] if measure else 'NULL'}) AS measure_sum,
+               0 AS present_count, 0 AS present_sum
+        FROM "{table_name}"
+        WHERE {' AND '.join(conditions)}
+        GROUP BY {key}
+        ORDER BY {"event_count" if metric == "count" else "measure_sum"} DESC, key_value
+        LIMIT ?
+        """
+        params.append(k)
+        return self.execute_query(query, tuple(params), date_range=(start_date, end_date),
+                                  source="get_top_k")
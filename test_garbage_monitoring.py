@@ -3,16 +3,24 @@
 垃圾监管系统数据库操作测试文件
 专门测试sqlite_operations.py中GarbageMonitoringDB类的功能
 """
+import json
 import sqlite3
+import subprocess
+import sys
 import pytest
 import tempfile
 import os
 import logging
+import threading
+import time
 # 删除csv依赖
 from unittest.mock import patch
 from datetime import datetime
 
-from sqlite_operations import GarbageMonitoringDB
+from config import (DATABASE_CONFIG, MEMORY_SERVING_CONFIG, RESULT_SUMMARY_CONFIG, STORAGE_PROFILES,
+                    TOP_K_CONFIG)
+from hyperloglog import HyperLogLog
+from sqlite_operations import GarbageMonitoringDB, QueryCancelledError, QueryTimeoutError
 
 # 配置测试日志
 logging.basicConfig(level=logging.INFO)
@@ -203,6 +211,33 @@ class TestGarbageMonitoringDB:
         result_all = self.db.get_street_clearance_statistics("2025-06-16", "2025-06-17")
         assert result_all["指定街道"] == "全部街道"
         
+        # 统计与趋势由同一次扫描汇总，二者的总量应一致
+        expected = self.db.execute_query("""
+        SELECT COUNT(*) AS trips, SUM(CAST(garbage_weight AS FLOAT)) AS total_weight
+        FROM garbage_data WHERE load_time_str BETWEEN ? AND ?
+        """, ("2025-06-16", "2025-06-17"))[0]
+        assert sum(row["清运次数"] for row in result_all["清运统计"]) == expected["trips"]
+        if expected["trips"]:
+            stats_total = sum(row["总清运量"] or 0 for row in result_all["清运统计"])
+            trend_total = sum(row["日清运量"] or 0 for row in result_all["清运趋势"])
+            assert stats_total == pytest.approx(expected["total_weight"])
+            assert trend_total == pytest.approx(expected["total_weight"])
+        
+        # 测试附加统计维度
+        result_dims = self.db.get_street_clearance_statistics(
+            "2025-06-16", "2025-06-17", dimensions=["car_group_name"]
+        )
+        assert sum(row["清运次数"] for row in result_dims["清运统计"]) == expected["trips"]
+        if result_dims["清运统计"]:
+            assert "车队" in result_dims["清运统计"][0]
+        assert len(result_dims["清运趋势"]) == len(result_all["清运趋势"])
+        for with_dims, without_dims in zip(result_dims["清运趋势"], result_all["清运趋势"]):
+            assert with_dims["日期"] == without_dims["日期"]
+            assert with_dims["日清运量"] == pytest.approx(without_dims["日清运量"])
+        
+        with pytest.raises(ValueError):
+            self.db.get_street_clearance_statistics("2025-06-16", "2025-06-17", dimensions=["id"])
+        
         logger.info("✓ get_street_clearance_statistics函数测试通过")
     
     def test_get_overdue_issues(self):
@@ -244,6 +279,50 @@ class TestGarbageMonitoringDB:
             assert "满溢时间" in issue
             assert "处置状态" in issue
         
+        # 指定as_of时结果可复现，耗时按as_of计算
+        as_of = "2025-06-14 12:00:00"
+        first = self.db.get_overdue_issues(as_of)
+        second = self.db.get_overdue_issues(as_of)
+        assert first["统计截至"] == as_of
+        first.pop("查询时间"), second.pop("查询时间")
+        assert first == second
+        # 返回值是缓存的副本，调用方修改不影响后续结果
+        first["垃圾桶满溢问题"]["问题详情"].clear()
+        third = self.db.get_overdue_issues(as_of)
+        third.pop("查询时间")
+        assert third == second and third["垃圾桶满溢问题"]["问题详情"] is not second["垃圾桶满溢问题"]["问题详情"]
+        first = third
+        # 处置耗时分钟保持数据表中的取值类型
+        assert self.db.execute_query("""
+        SELECT COUNT(*) AS n FROM meta_open_issues m JOIN small_package_garbage s ON m.event_id = s.event_id
+        WHERE m.source = 'small_package_garbage' AND typeof(m.take_minutes) != typeof(s.take_minutes)
+        """)[0]["n"] == 0
+        
+        for issue in first["垃圾桶满溢问题"]["问题详情"]:
+            assert issue["满溢时间"] is None or issue["满溢时间"] <= as_of
+            if issue["处置状态"] == "未处置" and issue["满溢时间"]:
+                opened = datetime.strptime(issue["满溢时间"], "%Y-%m-%d %H:%M:%S")
+                expected_hours = (datetime.strptime(as_of, "%Y-%m-%d %H:%M:%S") - opened).total_seconds() / 3600
+                assert issue["处置耗时小时"] == pytest.approx(expected_hours, abs=0.01)
+        
+        # as_of之后才处置的满溢事件在as_of时仍是未处置问题
+        handled_later = self.db.execute_query("""
+        SELECT COUNT(*) AS n FROM garbage_bin_overflow
+        WHERE full_time <= ? AND is_handle = 'TRUE' AND handle_time > ?
+        """, (as_of, as_of))[0]["n"]
+        open_at_as_of = self.db.execute_query("""
+        SELECT COUNT(*) AS n FROM garbage_bin_overflow
+        WHERE full_time <= ? AND (is_handle = 'FALSE' OR handle_time = '' OR handle_time > ?)
+        """, (as_of, as_of))[0]["n"]
+        assert first["垃圾桶满溢问题"]["问题数量"] == open_at_as_of
+        assert handled_later == 0 or any(
+            issue["处置状态"] == "未处置" and issue["处置时间"] is None
+            for issue in first["垃圾桶满溢问题"]["问题详情"]
+        )
+        
+        with pytest.raises(ValueError):
+            self.db.get_overdue_issues("2025/06/14")
+        
         logger.info("✓ get_overdue_issues函数测试通过")
     
     def test_get_decoration_appointments_data(self):
@@ -326,10 +405,49 @@ class TestGarbageMonitoringDB:
             assert "状态" in order
             assert "创建时间" in order
         
+        # 不指定模式时统计包含两种模式
+        assert {row["模式"] for row in result["状态统计"]} <= {"老模式", "新模式"}
+        total = sum(row["工单数量"] for row in result["状态统计"])
+        assert result["分页"]["总条数"] == total
+        
         # 测试带筛选条件查询
         result_filtered = self.db.get_order_status_details(status="已完成", mode="老模式")
         assert result_filtered["筛选条件"]["状态"] == "已完成"
         assert result_filtered["筛选条件"]["模式"] == "老模式"
+        assert all(row["模式"] == "老模式" and row["状态"] == "已完成"
+                   for row in result_filtered["状态统计"])
+        assert all(row["模式"] == "老模式" and row["状态"] == "已完成"
+                   for row in result_filtered["工单详情"])
+        
+        # 测试分页
+        page_1 = self.db.get_order_status_details(mode="新模式", page=1, page_size=5)
+        page_2 = self.db.get_order_status_details(mode="新模式", page=2, page_size=5)
+        assert len(page_1["工单详情"]) <= 5
+        assert page_1["分页"]["总条数"] == page_2["分页"]["总条数"]
+        ids_1 = {row["订单号"] for row in page_1["工单详情"]}
+        ids_2 = {row["订单号"] for row in page_2["工单详情"]}
+        assert not ids_1 & ids_2
+        
+        # 创建时间相同的工单跨页时既不重复也不遗漏
+        tied = [(f"TIE-{i:02d}", "2099-01-01 00:00:00") for i in range(12)]
+        with self.db._lock:
+            self.db.connection.executemany(
+                "INSERT INTO decoration_garbage_new (appointment_order_id, create_order_time) VALUES (?, ?)",
+                tied)
+            self.db.connection.commit()
+        try:
+            pages = [self.db.get_order_status_details(mode="新模式", page=page, page_size=5)["工单详情"]
+                     for page in range(1, 4)]
+            paged_ids = [row["订单号"] for rows in pages for row in rows]
+            assert sorted(paged_ids[:12]) == [order_id for order_id, _ in tied]
+        finally:
+            with self.db._lock:
+                self.db.connection.execute(
+                    "DELETE FROM decoration_garbage_new WHERE appointment_order_id LIKE 'TIE-%'")
+                self.db.connection.commit()
+        
+        with pytest.raises(ValueError):
+            self.db.get_order_status_details(mode="未知模式")
         
         logger.info("✓ get_order_status_details函数测试通过")
     
@@ -349,6 +467,1107 @@ class TestGarbageMonitoringDB:
         
         logger.info("✓ 辅助方法测试通过")
 
+    def test_query_timeout_and_cancel(self):
+        """测试查询超时与取消"""
+        runaway_query = """
+        WITH RECURSIVE n(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM n)
+        SELECT COUNT(*) AS total FROM n
+        """
+        
+        # 超过截止时间的查询被SQLite中止
+        start = time.monotonic()
+        with pytest.raises(QueryTimeoutError):
+            self.db.execute_query(runaway_query, timeout=0.2)
+        assert time.monotonic() - start < 5
+        
+        # 取消标记被设置后查询被中止
+        cancel_event = threading.Event()
+        threading.Timer(0.2, cancel_event.set).start()
+        with pytest.raises(QueryCancelledError):
+            with self.db.query_deadline(None, cancel_event):
+                self.db.execute_query(runaway_query)
+        
+        # 中止后连接仍可正常使用
+        result = self.db.execute_query("SELECT 1 AS ok", timeout=1)
+        assert result[0]['ok'] == 1
+        
+        logger.info("✓ 查询超时与取消测试通过")
+
+    def test_slow_query_log(self):
+        """测试慢查询日志与执行计划记录"""
+        self.db.slow_query_log_path = os.path.join(tempfile.mkdtemp(), "slow_queries.log")
+        self.db.slow_query_threshold_ms = 0  # 记录所有查询
+        
+        self.db.get_street_clearance_statistics("2025-06-16", "2025-06-17")
+        self.db.execute_query(
+            "SELECT street_name, COUNT(*) AS n FROM garbage_data GROUP BY street_name ORDER BY n DESC",
+            source="execute_any_sql_query"
+        )
+        
+        report = self.db.get_slow_queries(limit=5)
+        assert report["日志记录数"] >= 2
+        assert len(report["慢查询排行"]) <= 5
+        
+        sources = {item["来源"] for item in report["慢查询排行"]}
+        assert "get_street_clearance_statistics" in sources
+        assert "execute_any_sql_query" in sources
+        
+        adhoc = next(item for item in report["慢查询排行"] if item["来源"] == "execute_any_sql_query")
+        assert adhoc["查询计划"]
+        assert any("garbage_data" in step for step in adhoc["全表扫描"])
+        assert adhoc["临时B树"]
+        assert adhoc["返回行数"] >= 1
+        
+        # 等待连接锁的时间不计入耗时：排队的快查询不记为慢查询
+        self.db.slow_query_threshold_ms = 300
+        released = threading.Event()
+        
+        def hold_lock():
+            with self.db._lock:
+                released.wait(0.5)
+        
+        holder = threading.Thread(target=hold_lock)
+        holder.start()
+        time.sleep(0.05)
+        before = self.db.get_slow_queries()["日志记录数"]
+        self.db.execute_query("SELECT 1 AS queued", source="queued_query")
+        holder.join()
+        assert self.db.get_slow_queries()["日志记录数"] == before
+        
+        logger.info("✓ 慢查询日志测试通过")
+
+    def test_query_admission_control(self):
+        """测试基于执行计划的准入控制"""
+        # 普通的单表聚合直接放行
+        cheap = self.db.check_query_admission(
+            "SELECT street_name, COUNT(*) FROM garbage_data WHERE load_time_str >= ? GROUP BY street_name",
+            ("2025-06-16",)
+        )
+        assert cheap["决策"] == "执行"
+        assert cheap["估算代价"] > 0
+        
+        # 无连接条件的三表笛卡尔积被拒绝，说明中点名全表扫描
+        runaway = self.db.check_query_admission(
+            "SELECT COUNT(*) FROM garbage_data g, garbage_bin_overflow o, small_package_garbage s"
+        )
+        assert runaway["决策"] == "拒绝"
+        assert runaway["估算代价"] > runaway["代价预算"]
+        assert "全表扫描" in runaway["说明"]
+        assert runaway["全表扫描"]
+        
+        # 连接列缺少索引时给出缺失的索引
+        join = self.db.check_query_admission(
+            "SELECT * FROM garbage_data g JOIN garbage_bin_overflow o ON g.community_name = o.community_name"
+        )
+        assert "garbage_bin_overflow(community_name)" in join["缺失索引"]
+        
+        logger.info("✓ 准入控制测试通过")
+
+    def test_read_snapshot(self):
+        """测试多条查询共享同一个读事务"""
+        with self.db.read_snapshot():
+            assert self.db.connection.in_transaction
+            date_range = self.db.execute_query(
+                "SELECT MIN(load_time_str) AS min_time, MAX(load_time_str) AS max_time FROM garbage_data"
+            )
+            total = self.db.execute_query("SELECT COUNT(*) AS total FROM garbage_data")
+            # 快照内的单条查询失败不影响后续查询
+            with pytest.raises(sqlite3.OperationalError):
+                self.db.execute_query("SELECT no_such_column FROM garbage_data")
+            top = self.db.execute_query(
+                "SELECT street_name, COUNT(*) AS n FROM garbage_data GROUP BY street_name ORDER BY n DESC LIMIT 3"
+            )
+        assert not self.db.connection.in_transaction
+        
+        assert date_range[0]["min_time"] <= date_range[0]["max_time"]
+        assert sum(row["n"] for row in top) <= total[0]["total"]
+        
+        # 缺失的目录记录在开始事务前补齐，快照内的准入控制不提交写入
+        self.db.connection.execute("DELETE FROM meta_table_catalog WHERE table_name = 'garbage_data'")
+        self.db.connection.commit()
+        with self.db.read_snapshot():
+            assert "garbage_data" in self.db.get_table_catalog()
+            self.db.check_query_admission("SELECT * FROM garbage_data")
+            assert self.db.connection.in_transaction
+        
+        logger.info("✓ 读快照测试通过")
+
+    def test_data_quality_profile(self):
+        """测试单次扫描的数据质量画像"""
+        result = self.db.check_data_quality(refresh=True, include_markdown=True)
+        checks = {entry["数据表"]: entry for entry in result["数据质量检查"] if "数据表" in entry}
+        
+        # 覆盖所有业务表，不包含元数据表
+        for table_name in ["garbage_data", "small_package_garbage", "garbage_bin_overflow",
+                           "decoration_garbage_old", "decoration_garbage_new"]:
+            assert table_name in checks
+        assert not any(name.startswith("meta_") for name in checks)
+        
+        garbage = checks["garbage_data"]
+        total = self.db.execute_query("SELECT COUNT(*) AS n FROM garbage_data")[0]["n"]
+        assert garbage["总行数"] == total
+        
+        # 每个字段都有画像，且与直接SQL统计一致
+        columns = {p["字段名"]: p for p in garbage["字段画像"]}
+        table_columns = self.db.execute_query("PRAGMA table_info(garbage_data)")
+        assert set(columns) == {c["name"] for c in table_columns}
+        
+        expected = self.db.execute_query("""
+        SELECT
+            SUM(CASE WHEN street_name IS NULL OR street_name = '' THEN 1 ELSE 0 END) AS missing,
+            COUNT(DISTINCT NULLIF(street_name, '')) AS distinct_count,
+            MIN(NULLIF(load_time_str, '')) AS min_time,
+            MAX(load_time_str) AS max_time
+        FROM garbage_data
+        """)[0]
+        assert columns["street_name"]["缺失值数量"] == expected["missing"]
+        assert columns["street_name"]["唯一值数量"] == expected["distinct_count"]
+        assert columns["load_time_str"]["最小值"] == expected["min_time"]
+        assert columns["load_time_str"]["最大值"] == expected["max_time"]
+        assert columns["id"]["重复值种类"] == 0
+        
+        # 唯一值数量和重复值为估计值，与精确统计的误差在几个百分点内
+        exact = self.db.execute_query("""
+        SELECT COUNT(*) AS kinds, SUM(n) AS rows, (SELECT COUNT(DISTINCT NULLIF(community_name, ''))
+                                                  FROM garbage_data) AS distinct_count
+        FROM (SELECT COUNT(*) AS n FROM garbage_data WHERE community_name <> ''
+              GROUP BY community_name HAVING n > 1)
+        """)[0]
+        community = columns["community_name"]
+        assert community["唯一值数量"] == pytest.approx(exact["distinct_count"], rel=0.05)
+        assert community["重复值种类"] == pytest.approx(exact["kinds"], rel=0.05)
+        assert community["重复值总行数"] == pytest.approx(exact["rows"] or 0, rel=0.05)
+        assert "说明" in result
+        assert result["估计值字段"] == ["唯一值数量", "重复值种类", "重复值总行数", "重复率(%)"]
+        
+        # 画像扫描在独立连接上进行，同样受截止时间约束
+        with pytest.raises(QueryTimeoutError):
+            with self.db.query_deadline(0):
+                self.db.check_data_quality(refresh=True)
+        
+        assert garbage["Markdown"].splitlines()[2].startswith("| 字段名 | 数据类型 | 备注 |")
+        assert garbage["Markdown"].splitlines()[-1].endswith("为估计值")
+        
+        # 不刷新时直接读取已保存的画像
+        cached = self.db.check_data_quality()
+        assert len(cached["数据质量检查"]) == len(result["数据质量检查"])
+        
+        logger.info("✓ 数据质量画像测试通过")
+
+    def test_analytics_cache(self):
+        """测试NumPy分析缓存与SQL路径结果一致并能增量刷新"""
+        # 在数据库副本上测试，避免追加的数据影响其他用例
+        copy_path = os.path.join(tempfile.mkdtemp(), "analytics_cache.db")
+        with sqlite3.connect(copy_path) as target:
+            self.db.connection.backup(target)
+        db = GarbageMonitoringDB(copy_path)
+        try:
+            def rounded(rows):
+                return [{k: round(v, 6) if isinstance(v, float) else v for k, v in row.items()}
+                        for row in rows]
+            
+            sql_stats = db.get_street_clearance_statistics("2025-06-10", "2025-06-20")
+            sql_realtime = db.get_realtime_clearance_data("2025-06-16")
+            
+            status = db.enable_analytics_cache()
+            assert status["已加载"]
+            assert status["缓存行数"] == db.get_table_row_count("garbage_data")
+            
+            cache_stats = db.get_street_clearance_statistics("2025-06-10", "2025-06-20")
+            assert rounded(cache_stats["清运统计"]) == rounded(sql_stats["清运统计"])
+            assert rounded(cache_stats["清运趋势"]) == rounded(sql_stats["清运趋势"])
+            cache_realtime = db.get_realtime_clearance_data("2025-06-16")
+            assert sorted(rounded(cache_realtime["清运概览"]), key=str) == \
+                sorted(rounded(sql_realtime["清运概览"]), key=str)
+            
+            # 其他连接追加数据后，缓存按rowid增量同步
+            with sqlite3.connect(copy_path) as writer:
+                writer.execute("""
+                INSERT INTO garbage_data (id, street_name, type_name, community_name,
+                                          load_time_str, vehicle_license_num, garbage_weight)
+                VALUES ('cache-1', '新增街道', '湿垃圾', '新增小区', '2025-06-16 08:00:00', '沪A99999', '2.5')
+                """)
+            refreshed = db.get_street_clearance_statistics("2025-06-16", "2025-06-17", "新增街道")
+            assert refreshed["清运统计"] == [{
+                "街道": "新增街道", "垃圾类型": "湿垃圾", "清运次数": 1,
+                "总清运量": 2.5, "平均清运量": 2.5, "涉及小区数": 1
+            }]
+            assert db.analytics_cache.get_status()["缓存行数"] == status["缓存行数"] + 1
+
+            # 清运时间不规范的行：SQL按字符串比较仍会选中时，改由SQL统计
+            with sqlite3.connect(copy_path) as writer:
+                writer.executemany("""
+                INSERT INTO garbage_data (id, street_name, type_name, community_name,
+                                          load_time_str, vehicle_license_num, garbage_weight)
+                VALUES (?, '新增街道', '湿垃圾', '新增小区', ?, '沪A99999', '1.5')
+                """, [("cache-2", "2025-06-16T09:00:00"), ("cache-3", "2025-6-16 10:00:00")])
+            irregular = db.get_street_clearance_statistics("2025-06-16", "2025-06-17", "新增街道")
+            assert irregular["清运统计"][0]["清运次数"] == 2
+            assert irregular["清运统计"][0]["总清运量"] == 4.0
+            assert db.analytics_cache.get_status()["清运时间不规范行数"] == 2
+            assert not db.analytics_cache.covers(day="2025-06-16")
+            assert db.analytics_cache.covers(start="2025-06-10", end="2025-06-15")
+            overview = db.get_realtime_clearance_data("2025-06-16")["清运概览"]
+            assert [row["清运次数"] for row in overview if row["街道"] == "新增街道"] == [2]
+
+            # 超出内存预算时不启用缓存，统计回退到SQL
+            assert not db.enable_analytics_cache(max_memory_mb=0.001)["已加载"]
+            assert db.analytics_cache is None
+            fallback = db.get_street_clearance_statistics("2025-06-16", "2025-06-17", "新增街道")
+            assert rounded(fallback["清运统计"]) == rounded(irregular["清运统计"])
+        finally:
+            db.close()
+        
+        logger.info("✓ 分析缓存测试通过")
+
+    def test_approximate_distinct_counts(self):
+        """测试HyperLogLog草图与近似去重计数"""
+        # 草图合并等价于对并集建草图
+        left, right, union = HyperLogLog(11), HyperLogLog(11), HyperLogLog(11)
+        left.update(f"小区{i}" for i in range(0, 6000))
+        right.update(f"小区{i}" for i in range(4000, 10000))
+        union.update(f"小区{i}" for i in range(0, 10000))
+        left.merge(right)
+        assert left.count() == union.count()
+        assert abs(union.count() - 10000) <= 10000 * union.standard_error * 4
+        restored = HyperLogLog.from_bytes(union.to_bytes(), 11)
+        assert restored.count() == union.count()
+        
+        # 导入时已生成按日草图
+        sketches = self.db.execute_query(
+            "SELECT COUNT(*) AS n FROM meta_distinct_sketch WHERE table_name = 'garbage_data'"
+        )[0]["n"]
+        assert sketches > 0
+        
+        exact = self.db.get_street_clearance_statistics("2025-06-10", "2025-06-20")
+        approx = self.db.get_street_clearance_statistics("2025-06-10", "2025-06-20", approximate=True)
+        assert "去重计数方式" in approx
+        assert [(t["街道"], t["日期"]) for t in approx["清运趋势"]] == \
+            [(t["街道"], t["日期"]) for t in exact["清运趋势"]]
+        for e, a in zip(exact["清运趋势"], approx["清运趋势"]):
+            assert a["日清运量"] == pytest.approx(e["日清运量"])
+        assert len(approx["清运统计"]) == len(exact["清运统计"])
+        for e, a in zip(exact["清运统计"], approx["清运统计"]):
+            assert (e["街道"], e["垃圾类型"], e["清运次数"]) == (a["街道"], a["垃圾类型"], a["清运次数"])
+            assert a["总清运量"] == pytest.approx(e["总清运量"])
+            assert abs(a["涉及小区数"] - e["涉及小区数"]) <= max(2, e["涉及小区数"] * 0.1)
+        
+        # 近似模式只读取小时桶和草图，不扫描garbage_data
+        traced = []
+        self.db.connection.set_trace_callback(traced.append)
+        try:
+            self.db.get_street_clearance_statistics("2025-06-10", "2025-06-20", approximate=True)
+        finally:
+            self.db.connection.set_trace_callback(None)
+        assert traced and not any("FROM garbage_data" in sql for sql in traced)
+        
+        exact_rt = self.db.get_realtime_clearance_data("2025-06-16")
+        approx_rt = self.db.get_realtime_clearance_data("2025-06-16", approximate=True)
+        exact_vehicles = {(r["街道"], r["垃圾类型"]): r["参与车辆数"] for r in exact_rt["清运概览"]}
+        for row in approx_rt["清运概览"]:
+            expected = exact_vehicles[(row["街道"], row["垃圾类型"])]
+            assert abs(row["参与车辆数"] - expected) <= max(2, expected * 0.1)
+        
+        # 指定附加维度时草图无法拆分，仍精确计算
+        with_dims = self.db.get_street_clearance_statistics(
+            "2025-06-10", "2025-06-20", dimensions=["car_group_name"], approximate=True
+        )
+        assert "去重计数方式" not in with_dims
+        
+        logger.info("✓ 近似去重计数测试通过")
+
+    def test_time_series(self):
+        """测试由小时桶合并的时间序列"""
+        result = self.db.get_time_series(
+            "garbage_data", "sum", "day", ["street_name"], "2025-06-16", "2025-06-17"
+        )
+        assert result["统计指标"] == "清运量合计"
+        assert result["分组维度"] == ["街道"]
+        expected = self.db.execute_query("""
+        SELECT DATE(load_time_str) AS day, street_name, SUM(CAST(garbage_weight AS FLOAT)) AS total
+        FROM garbage_data
+        WHERE DATE(load_time_str) BETWEEN '2025-06-16' AND '2025-06-17'
+        GROUP BY day, street_name
+        ORDER BY day, street_name
+        """)
+        assert result["数据点数"] == len(expected)
+        for point, row in zip(result["时间序列"], expected):
+            assert (point["时间"], point["街道"]) == (row["day"], row["street_name"])
+            assert point["值"] == pytest.approx(row["total"])
+        
+        # 各粒度由同一组小时桶合并，总数与原表一致
+        for table_name in self.db.TIME_SERIES_SOURCES:
+            total = self.db.execute_query(f"""
+            SELECT COUNT(*) AS n FROM {table_name}
+            WHERE strftime('%Y-%m-%d %H', {self.db.TABLE_TIME_COLUMNS[table_name]}) IS NOT NULL
+            """)[0]["n"]
+            for bucket in ["hour", "day", "week", "month"]:
+                series = self.db.get_time_series(table_name, "count", bucket)["时间序列"]
+                assert sum(point["值"] for point in series) == total
+        
+        weeks = self.db.get_time_series("garbage_bin_overflow", bucket="week")["时间序列"]
+        assert all(datetime.strptime(p["时间"], "%Y-%m-%d").weekday() == 0 for p in weeks)
+        
+        filtered = self.db.get_time_series(
+            "small_package_garbage", "avg", "month", ["is_timeout"], filters={"is_handle": "TRUE"}
+        )
+        assert all("是否超时" in p for p in filtered["时间序列"])
+        
+        with pytest.raises(ValueError):
+            self.db.get_time_series("garbage_bin_overflow", "sum")
+        with pytest.raises(ValueError):
+            self.db.get_time_series("garbage_data", bucket="year")
+        with pytest.raises(ValueError):
+            self.db.get_time_series("garbage_data", group_by=["id"])
+        
+        logger.info("✓ 时间序列测试通过")
+
+    def test_top_k(self):
+        """测试基于预聚合计数的Top-K排行"""
+        result = self.db.get_top_k("garbage_data", "community_name", 5, "sum", "湿垃圾")
+        expected = self.db.execute_query("""
+        SELECT community_name, COUNT(*) AS n, SUM(CAST(garbage_weight AS FLOAT)) AS total
+        FROM garbage_data
+        WHERE type_name = '湿垃圾' AND community_name != ''
+        GROUP BY community_name
+        ORDER BY total DESC, community_name
+        LIMIT 5
+        """)
+        assert result["排序指标"] == "清运量合计"
+        assert [(r["小区"], r["事件数"]) for r in result["排行"]] == \
+            [(e["community_name"], e["n"]) for e in expected]
+        for r, e in zip(result["排行"], expected):
+            assert r["清运量合计"] == pytest.approx(e["total"])
+        
+        # 不限时间范围时沿索引读取，无需排序
+        plan = self.db.explain_query_plan("""
+        SELECT key_value FROM meta_topk_counters
+        WHERE table_name = 'garbage_data' AND key_column = 'community_name' AND segment = '*' AND day = '*'
+        ORDER BY event_count DESC, key_value LIMIT 10
+        """)
+        assert not plan["临时B树"] and not plan["全表扫描"]
+        
+        overflow = self.db.get_top_k("garbage_bin_overflow", "station_name", 3,
+                                     start_date="2025-06-12", end_date="2025-06-14")
+        expected = self.db.execute_query("""
+        SELECT station_name, COUNT(*) AS n FROM garbage_bin_overflow
+        WHERE DATE(full_time) BETWEEN '2025-06-12' AND '2025-06-14' AND station_name != ''
+        GROUP BY station_name ORDER BY n DESC, station_name LIMIT 3
+        """)
+        assert [(r["垃圾房"], r["事件数"]) for r in overflow["排行"]] == \
+            [(e["station_name"], e["n"]) for e in expected]
+        assert "说明" not in overflow
+        
+        # 按日计数被截断时，排行值为下限，真实值不超过下限加误差上限
+        try:
+            with patch.dict(TOP_K_CONFIG, {"daily_capacity": 3}):
+                self.db.refresh_topk_counters("garbage_data")
+            truncated = self.db.get_top_k("garbage_data", "community_name", 10,
+                                          start_date="2025-06-10", end_date="2025-06-20")
+            exact = self.db.execute_query("""
+            SELECT community_name, COUNT(*) AS n FROM garbage_data
+            WHERE DATE(load_time_str) BETWEEN '2025-06-10' AND '2025-06-20' AND community_name != ''
+            GROUP BY community_name ORDER BY n DESC, community_name LIMIT 10
+            """)
+            # 截断部分的对象可能进入前K，改用原表精确计算
+            assert [(r["小区"], r["事件数"]) for r in truncated["排行"]] == \
+                [(e["community_name"], e["n"]) for e in exact]
+            assert "说明" not in truncated
+        finally:
+            self.db.refresh_topk_counters("garbage_data")
+        
+        # 前K名的下限足以排除其他对象时沿用计数表，真实值不超过下限加误差上限
+        copy_path = os.path.join(tempfile.mkdtemp(), "top_k.db")
+        with sqlite3.connect(copy_path) as target:
+            self.db.connection.backup(target)
+        db = GarbageMonitoringDB(copy_path)
+        try:
+            db.connection.executemany(
+                "INSERT INTO garbage_bin_overflow (station_name, full_time) VALUES (?, ?)",
+                [("热点垃圾房", f"2025-06-{day} 08:00:00") for day in (12, 13, 14) for _ in range(30)]
+            )
+            db.connection.commit()
+            with patch.dict(TOP_K_CONFIG, {"daily_capacity": 3}):
+                db.refresh_topk_counters("garbage_bin_overflow")
+            hot = db.get_top_k("garbage_bin_overflow", "station_name", 1,
+                               start_date="2025-06-12", end_date="2025-06-14")
+            exact_hot = db.execute_query("""
+            SELECT COUNT(*) AS n FROM garbage_bin_overflow
+            WHERE station_name = '热点垃圾房' AND DATE(full_time) BETWEEN '2025-06-12' AND '2025-06-14'
+            """)[0]["n"]
+            assert hot["排行"][0]["垃圾房"] == "热点垃圾房"
+            top = hot["排行"][0]
+            assert top["事件数"] <= exact_hot <= top["事件数"] + top.get("误差上限", 0)
+        finally:
+            db.close()
+        
+        with pytest.raises(ValueError):
+            self.db.get_top_k("garbage_bin_overflow", "station_name", metric="sum")
+        with pytest.raises(ValueError):
+            self.db.get_top_k("garbage_bin_overflow", "station_name", type_name="湿垃圾")
+        with pytest.raises(ValueError):
+            self.db.get_top_k("garbage_data", "id")
+        
+        logger.info("✓ Top-K排行测试通过")
+
+    def test_clearance_anomalies(self):
+        """测试小区日清运量EWMA滚动统计与异常识别"""
+        result = self.db.get_clearance_anomalies(z_threshold=2.0)
+        latest = self.db.execute_query("SELECT MAX(DATE(load_time_str)) AS day FROM garbage_data")[0]["day"]
+        assert result["检测日期"] == latest
+        for item in result["异常小区"]:
+            assert abs(item["偏离度"]) >= 2.0
+            assert item["异常类型"] == ("骤降" if item["偏离度"] < 0 else "骤增")
+            assert item["偏离度"] == pytest.approx(
+                (item["当日清运量"] - item["预期清运量"]) / item["标准差"])
+        
+        # 分批导入时的增量更新与一次性重算结果一致
+        copy_path = os.path.join(tempfile.mkdtemp(), "anomaly.db")
+        with sqlite3.connect(copy_path) as target:
+            self.db.connection.backup(target)
+        db = GarbageMonitoringDB(copy_path)
+        try:
+            full = db.update_community_ewma(rebuild=True)
+            expected = {row["community_name"]: row for row in db.execute_query(
+                "SELECT * FROM meta_community_ewma")}
+            
+            db.connection.execute("CREATE TABLE later_rows AS SELECT * FROM garbage_data WHERE DATE(load_time_str) > '2025-06-14'")
+            db.connection.execute("DELETE FROM garbage_data WHERE DATE(load_time_str) > '2025-06-14'")
+            first = db.update_community_ewma(rebuild=True)
+            db.connection.execute("INSERT INTO garbage_data SELECT * FROM later_rows")
+            db.connection.commit()
+            second = db.update_community_ewma()
+            assert first["新增日期数"] + second["新增日期数"] == full["新增日期数"]
+            
+            # 已处理的日期不会重复累计
+            assert db.update_community_ewma()["新增日期数"] == 0
+            
+            actual = {row["community_name"]: row for row in db.execute_query(
+                "SELECT * FROM meta_community_ewma")}
+            assert actual.keys() == expected.keys()
+            for community, row in expected.items():
+                for column in ["days_observed", "last_day", "ewma_mean", "ewma_var", "z_score"]:
+                    assert actual[community][column] == pytest.approx(row[column])
+
+            # 已处理日期补录迟到数据后从最早日期重新计算，与一次性重算一致
+            db.connection.execute("""
+            INSERT INTO garbage_data (id, street_name, community_name, load_time_str, garbage_weight)
+            SELECT 'late-1', street_name, community_name, '2025-06-12 23:59:00', '50'
+            FROM garbage_data WHERE community_name != '' LIMIT 1
+            """)
+            db.connection.commit()
+            late = db.update_community_ewma()
+            assert late["重新计算"] and late["新增日期数"] == full["新增日期数"]
+            incremental = {row["community_name"]: row for row in db.execute_query(
+                "SELECT * FROM meta_community_ewma")}
+            db.update_community_ewma(rebuild=True)
+            for row in db.execute_query("SELECT * FROM meta_community_ewma"):
+                for column in ["days_observed", "ewma_mean", "ewma_var", "z_score"]:
+                    assert incremental[row["community_name"]][column] == pytest.approx(row[column])
+            assert not db.update_community_ewma()["重新计算"]
+        finally:
+            db.close()
+        
+        logger.info("✓ 清运量异常检测测试通过")
+
+    def test_partitioned_storage(self):
+        """测试按月分区存储：查询只附加覆盖时间范围的分区，结果与单库一致"""
+        partitioned_dir = tempfile.mkdtemp()
+        db = GarbageMonitoringDB(os.path.join(partitioned_dir, "partitioned.db"), partitioned=True)
+        try:
+            partitions = db.list_partitions()
+            assert partitions and os.path.isdir(os.path.join(partitioned_dir, "partitions"))
+            # 数据全部移入分区，主库中的同名表为空
+            assert db.execute_query("SELECT COUNT(*) AS n FROM main.garbage_data")[0]["n"] == 0
+            assert db.get_table_row_count("garbage_data") == self.db.get_table_row_count("garbage_data")
+            
+            stats = db.get_street_clearance_statistics("2025-06-10", "2025-06-16")
+            expected = self.db.get_street_clearance_statistics("2025-06-10", "2025-06-16")
+            assert stats["清运统计"] == expected["清运统计"]
+            assert stats["清运趋势"] == pytest.approx(expected["清运趋势"])
+            assert db.get_decoration_appointments_data(60)["统计信息"] == \
+                self.db.get_decoration_appointments_data(60)["统计信息"]
+            
+            # 一周的查询只读取覆盖该周的一个分区；之后相同范围的查询不再重建视图
+            week = db.partitions_for_range("2025-06-10", "2025-06-16")
+            assert len(week) == 1
+            alias = db._partition_alias(week[0])
+            statements = []
+            db.connection.set_trace_callback(statements.append)
+            db.get_street_clearance_statistics("2025-06-10", "2025-06-16")
+            db.get_street_clearance_statistics("2025-06-10", "2025-06-16")
+            db.connection.set_trace_callback(None)
+            assert statements.count(f"CREATE TEMP VIEW garbage_data AS SELECT * FROM {alias}.garbage_data") == 1
+            
+            # 分区只读附加；重复导入同一批数据不会产生重复行
+            with pytest.raises(sqlite3.OperationalError):
+                db.connection.execute(f"DELETE FROM {alias}.garbage_data")
+            row_count = db.get_table_row_count("decoration_garbage_old")
+            db.create_table_from_csv(os.path.join(db.data_dir, "装修垃圾预约-老模式.csv"),
+                                     "decoration_garbage_old")
+            assert db.get_table_row_count("decoration_garbage_old") == row_count
+            
+            # 分区模式下不启用分析缓存
+            assert not db.enable_analytics_cache()["已加载"]
+            
+            # 月份数超过可同时附加的上限：较早的月份合并到历史库，不限时间的查询仍覆盖全部数据
+            count_query = "SELECT COUNT(*) AS n FROM garbage_data"
+            before = db.execute_query(count_query)[0]["n"]
+            months = [f"{2023 + i // 12}-{i % 12 + 1:02d}" for i in range(14)]
+            insert = """
+            INSERT INTO main.garbage_data (id, street_name, community_name, load_time_str, garbage_weight)
+            VALUES (?, '分区街道', '分区小区', ?, '1')
+            """
+            with db._lock:
+                db.connection.executemany(insert, [
+                    (f"{month}-{i}", f"{month}-1{i} 08:00:00") for month in months for i in range(3)
+                ])
+                db.connection.commit()
+                db._move_to_partitions("garbage_data")
+            limit = db.connection.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+            assert len(db.list_partitions()) <= limit - 1
+            assert months[0] not in db.list_partitions()
+            assert db.execute_query(count_query)[0]["n"] == before + 3 * len(months)
+            assert db.execute_query(count_query + " WHERE load_time_str LIKE '2023-03%'",
+                                    date_range=("2023-03-01", "2023-03-31"))[0]["n"] == 3
+            
+            # 已合并到历史库的月份补录迟到数据，写入历史库而不是被丢弃
+            with db._lock:
+                db.connection.execute(insert, ("late-1", "2023-02-20 09:00:00"))
+                db.connection.commit()
+                db._move_to_partitions("garbage_data")
+            assert db.execute_query(count_query)[0]["n"] == before + 3 * len(months) + 1
+            assert db.execute_query(count_query + " WHERE load_time_str LIKE '2023-02%'",
+                                    date_range=("2023-02-01", "2023-02-28"))[0]["n"] == 4
+            
+            # 分区模式没有归档数据，显式合并历史时报错而不是静默忽略
+            with pytest.raises(ValueError):
+                with db.include_history():
+                    pass
+        finally:
+            db.close()
+        
+        logger.info("✓ 分区存储测试通过")
+
+    def test_archive_cold_data(self):
+        """测试冷数据归档：已结束的旧记录移入压缩归档库，显式合并时可查询"""
+        archive_dir = tempfile.mkdtemp()
+        copy_path = os.path.join(archive_dir, "archive.db")
+        with sqlite3.connect(copy_path) as target:
+            self.db.connection.backup(target)
+        db = GarbageMonitoringDB(copy_path)
+        try:
+            cutoff = "2025-06-14"
+            min_age_days = (datetime.now() - datetime.strptime(cutoff, "%Y-%m-%d")).days
+            count_query = "SELECT COUNT(*) AS n FROM {}"
+            totals = {t: db.execute_query(count_query.format(t))[0]["n"]
+                      for t in ["garbage_data", "small_package_garbage"]}
+            unweighed = db.execute_query("SELECT id FROM garbage_data WHERE load_time_str < ? LIMIT 1",
+                                         (cutoff,))[0]["id"]
+            with db._lock:
+                db.connection.execute("UPDATE garbage_data SET garbage_weight = '' WHERE id = ?",
+                                      (unweighed,))
+                db.connection.commit()
+            
+            result = db.archive_cold_data(min_age_days=min_age_days,
+                                          tables=["garbage_data", "small_package_garbage"])
+            assert result["归档截止日期"] == cutoff
+            archived = result["归档明细"]["garbage_data"]
+            assert archived["归档行数"] > 0
+            assert archived["压缩后字节"] < archived["原始字节"]
+            
+            # 在线表只保留截止日期之后或未结束的记录，元数据随之更新
+            live = db.execute_query(count_query.format("garbage_data"))[0]["n"]
+            assert live == totals["garbage_data"] - archived["归档行数"]
+            assert db.get_table_row_count("garbage_data") == live
+            assert db.execute_query("""
+            SELECT MIN(load_time_str) AS t FROM garbage_data
+            WHERE garbage_weight IS NOT NULL AND garbage_weight != ''
+            """)[0]["t"] >= cutoff
+            # 未称重的清运记录可能补录重量，不参与归档
+            assert db.execute_query("SELECT COUNT(*) AS n FROM garbage_data WHERE id = ?",
+                                    (unweighed,))[0]["n"] == 1
+            assert db.execute_query("""
+            SELECT COUNT(*) AS n FROM small_package_garbage
+            WHERE drop_time < ? AND is_handle = 'TRUE'
+            """, (cutoff,))[0]["n"] == 0
+            
+            # 显式合并时可查询归档数据，退出后恢复只查在线表
+            with db.include_history():
+                for table_name, total in totals.items():
+                    assert db.execute_query(count_query.format(table_name))[0]["n"] == total
+            assert db.execute_query(count_query.format("garbage_data"))[0]["n"] == live
+            
+            # 已归档的记录不会重复归档
+            again = db.archive_cold_data(min_age_days=min_age_days, tables=["garbage_data"])
+            assert again["归档明细"]["garbage_data"]["归档行数"] == 0
+
+            # 重新导入时已归档的记录不再写回在线表，合并查询不会重复计数
+            db.create_table_from_csv(os.path.join(db.data_dir, "干湿垃圾数据2025-06-16.csv"),
+                                     "garbage_data")
+            assert db.execute_query(count_query.format("garbage_data"))[0]["n"] == live
+            with db.include_history():
+                assert db.execute_query(count_query.format("garbage_data"))[0]["n"] == \
+                    totals["garbage_data"]
+
+            # 归档之后才结束的旧记录在下次归档时补上
+            pending = db.execute_query("""
+            SELECT event_id FROM small_package_garbage
+            WHERE drop_time < ? AND is_handle != 'TRUE' LIMIT 1
+            """, (cutoff,))
+            assert pending
+            with db._lock:
+                db.connection.execute(
+                    "UPDATE small_package_garbage SET is_handle = 'TRUE' WHERE event_id = ?",
+                    (pending[0]["event_id"],))
+                db.connection.commit()
+            late = db.archive_cold_data(min_age_days=min_age_days, tables=["small_package_garbage"])
+            assert late["归档明细"]["small_package_garbage"]["归档行数"] == 1
+            with db.include_history():
+                assert db.execute_query(count_query.format("small_package_garbage"))[0]["n"] == \
+                    totals["small_package_garbage"]
+            
+            # 在线表已删除时仍可读取归档数据
+            archived_rows = sum(chunk[0] for chunk in sqlite3.connect(db.archive_path).execute(
+                "SELECT row_count FROM archive_chunks WHERE table_name = 'small_package_garbage'"))
+            with db._lock:
+                db.connection.execute("DROP TABLE small_package_garbage")
+                db.connection.commit()
+            db._archive_loaded.clear()
+            with db.include_history():
+                assert db.execute_query(count_query.format("small_package_garbage"))[0]["n"] == \
+                    archived_rows
+        finally:
+            db.close()
+        
+        logger.info("✓ 冷数据归档测试通过")
+
+    def test_serve_from_memory(self):
+        """测试内存服务模式：查询读取内存快照，磁盘库更新后原子地切换到新快照"""
+        memory_dir = tempfile.mkdtemp()
+        copy_path = os.path.join(memory_dir, "memory.db")
+        with sqlite3.connect(copy_path) as target:
+            self.db.connection.backup(target)
+        db = GarbageMonitoringDB(copy_path, serve_from_memory=True)
+        try:
+            # 服务连接为内存库，结果与磁盘库一致
+            assert db.connection.execute("PRAGMA database_list").fetchone()["file"] == ""
+            stats = db.get_street_clearance_statistics("2025-06-10", "2025-06-16")
+            expected = self.db.get_street_clearance_statistics("2025-06-10", "2025-06-16")
+            assert stats["清运统计"] == expected["清运统计"]
+            count_query = "SELECT COUNT(*) AS n FROM garbage_data"
+            total = db.execute_query(count_query)[0]["n"]
+            
+            # 其他连接提交修改后，到达检查间隔时重新做快照
+            with sqlite3.connect(copy_path) as writer:
+                writer.execute("DELETE FROM garbage_data WHERE rowid = 1")
+            with patch.dict(MEMORY_SERVING_CONFIG, {"check_interval_seconds": 3600}):
+                assert db.execute_query(count_query)[0]["n"] == total
+            with patch.dict(MEMORY_SERVING_CONFIG, {"check_interval_seconds": 0}):
+                assert db.execute_query(count_query)[0]["n"] == total - 1
+            
+            # 本进程的导入写入磁盘库，完成后切换到新快照
+            snapshot_count = db._snapshot_count
+            db.create_table_from_csv(os.path.join(db.data_dir, "干湿垃圾数据2025-06-16.csv"),
+                                     "garbage_data")
+            assert db._snapshot_count == snapshot_count + 1
+            assert db.execute_query(count_query)[0]["n"] == total
+            with sqlite3.connect(copy_path) as reader:
+                assert reader.execute(count_query).fetchone()[0] == total
+            
+            # 读取时补齐缺失的目录和草图会切换快照，之后的读取使用新的快照连接
+            day = db.execute_query("SELECT MIN(DATE(load_time_str)) AS d FROM garbage_data")[0]["d"]
+            with sqlite3.connect(copy_path) as writer:
+                writer.execute("DELETE FROM meta_table_catalog WHERE table_name = 'garbage_data'")
+                writer.execute("DELETE FROM meta_distinct_sketch")
+            with patch.dict(MEMORY_SERVING_CONFIG, {"check_interval_seconds": 0}):
+                db.execute_query(count_query)
+            with patch.dict(MEMORY_SERVING_CONFIG, {"check_interval_seconds": 3600}):
+                snapshot_count = db._snapshot_count
+                assert db.get_table_catalog()["garbage_data"]["row_count"] == total
+                streets = {row["street_name"] for row in db.execute_query(
+                    "SELECT DISTINCT street_name FROM garbage_data WHERE DATE(load_time_str) = ?", (day,))}
+                estimates = db.estimate_distinct_counts("garbage_data", "vehicle_license_num", {
+                    "all": [(day, street, type_name) for street in streets
+                            for type_name in ("湿垃圾", "干垃圾")]
+                })
+                assert estimates["all"] > 0
+                assert db._snapshot_count == snapshot_count + 2
+        finally:
+            db.close()
+        
+        logger.info("✓ 内存服务模式测试通过")
+
+    def test_storage_profile(self):
+        """测试存储配置档应用到连接上并可通过诊断信息查看"""
+        diagnostics = self.db.get_storage_diagnostics()
+        assert diagnostics["配置档"] == DATABASE_CONFIG["storage_profile"]
+        profile = STORAGE_PROFILES[diagnostics["配置档"]]
+        assert diagnostics["生效值"]["mmap_size"] == profile["mmap_size"]
+        assert diagnostics["生效值"]["cache_size"] == profile["cache_size"]
+        assert diagnostics["生效值"]["busy_timeout"] == DATABASE_CONFIG["connection_timeout"] * 1000
+        assert diagnostics["服务模式"] == "磁盘"
+        
+        # 新建的数据库按配置档的page_size建库
+        profile_dir = tempfile.mkdtemp()
+        db = GarbageMonitoringDB(os.path.join(profile_dir, "large.db"), storage_profile="large_box")
+        try:
+            effective = db.get_storage_diagnostics()["生效值"]
+            assert effective["page_size"] == STORAGE_PROFILES["large_box"]["page_size"]
+            assert effective["temp_store"] == STORAGE_PROFILES["large_box"]["temp_store"]
+            assert db.get_table_row_count("garbage_data") == self.db.get_table_row_count("garbage_data")
+        finally:
+            db.close()
+        
+        # 已有数据库打开时不改变page_size，VACUUM时按配置档重建
+        existing_path = os.path.join(profile_dir, "existing.db")
+        with sqlite3.connect(existing_path) as target:
+            self.db.connection.backup(target)
+        db = GarbageMonitoringDB(existing_path, storage_profile="large_box")
+        try:
+            diagnostics = db.get_storage_diagnostics()
+            assert diagnostics["生效值"]["page_size"] == self.db.get_storage_diagnostics()["生效值"]["page_size"]
+            assert any("VACUUM" in note for note in diagnostics["说明"])
+            db._vacuum()
+            assert db.get_storage_diagnostics()["生效值"]["page_size"] == \
+                STORAGE_PROFILES["large_box"]["page_size"]
+        finally:
+            db.close()
+        
+        with pytest.raises(ValueError):
+            GarbageMonitoringDB(os.path.join(profile_dir, "unknown.db"), storage_profile="unknown")
+        
+        logger.info("✓ 存储配置档测试通过")
+
+    def test_read_worker_pool(self):
+        """测试只读工作进程：工具调用分发到子进程执行，结果与本进程一致"""
+        import asyncio
+        import mcp_server_fast
+
+        reader = GarbageMonitoringDB(self.db_path, read_only=True)
+        try:
+            assert reader.get_table_row_count("garbage_data") == \
+                self.db.get_table_row_count("garbage_data")
+            with pytest.raises(sqlite3.OperationalError):
+                reader.execute_query("DELETE FROM garbage_data")
+        finally:
+            reader.close()
+        with pytest.raises(FileNotFoundError):
+            GarbageMonitoringDB(os.path.join(tempfile.mkdtemp(), "missing.db"), read_only=True)
+
+        # 只读连接不计算也不保存画像
+        reader = GarbageMonitoringDB(self.db_path, read_only=True)
+        try:
+            with pytest.raises(ValueError):
+                reader.check_data_quality(refresh=True)
+        finally:
+            reader.close()
+
+        # 按需写入的元数据缺失时，启动工作进程前在服务器进程中补齐
+        copy_path = os.path.join(tempfile.mkdtemp(), "workers.db")
+        with sqlite3.connect(copy_path) as target:
+            self.db.connection.backup(target)
+            target.execute("DELETE FROM meta_community_ewma")
+            target.execute("DELETE FROM meta_column_profile WHERE table_name = 'garbage_data'")
+
+        async def call_tools():
+            return await asyncio.gather(
+                mcp_server_fast.get_overdue_issues(),
+                mcp_server_fast.execute_any_sql_query("SELECT COUNT(*) AS n FROM garbage_data"),
+                mcp_server_fast.execute_sql_batch([{"query": "SELECT 1 AS a"},
+                                                   {"query": "SELECT * FROM missing_table"}]),
+                mcp_server_fast.clearance_anomalies(),
+                mcp_server_fast.check_data_quality(refresh=True)
+            )
+
+        mcp_server_fast.configure_database_instance(copy_path)
+        try:
+            mcp_server_fast.start_worker_pool(2)
+            overdue, query, batch, anomalies, quality = asyncio.run(call_tools())
+        finally:
+            mcp_server_fast.stop_worker_pool()
+            if mcp_server_fast.db is not None:
+                mcp_server_fast.db.close()
+                mcp_server_fast.db = None
+
+        # 未处置问题的耗时按当前时间计算，只比较各类问题数量
+        expected = self.db.get_overdue_issues()
+        assert {k: v.get("问题数量") for k, v in overdue.items() if isinstance(v, dict)} == \
+            {k: v.get("问题数量") for k, v in expected.items() if isinstance(v, dict)}
+        assert query["查询结果"].to_python() == [{"n": self.db.get_table_row_count("garbage_data")}]
+        assert batch["成功数量"] == 1
+        assert batch["批量结果"]["1"]["执行状态"] == "失败"
+        assert anomalies["检测日期"] == self.db.get_clearance_anomalies()["检测日期"]
+        assert all("错误" not in table for table in quality["数据质量检查"])
+
+        logger.info("✓ 只读工作进程测试通过")
+
+    def test_pre_encoded_json(self):
+        """测试结果行从游标直接编码为JSON，并在响应编码时原样拼接"""
+        import mcp_server_fast
+
+        queries = [
+            "SELECT * FROM garbage_data ORDER BY id LIMIT 50",
+            "SELECT street_name, COUNT(*) AS n FROM garbage_data GROUP BY street_name ORDER BY n DESC -- 注释",
+            "WITH t AS (SELECT 1 AS x, 2 AS y) SELECT x, y AS x FROM t",
+            "SELECT x'00ff' AS blob_value",
+            "PRAGMA table_info(garbage_data)",
+            "SELECT street_name, id AS __exact FROM garbage_data ORDER BY garbage_weight DESC, id LIMIT 30",
+        ]
+        for query in queries:
+            count, data = self.db.execute_query_json(query)
+            expected = self.db.execute_query(query)
+            assert count == len(expected)
+            assert json.loads(data) == json.loads(json.dumps(expected, default=str))
+            columns, rows = self.db.execute_query_json_rows(query)
+            assert [json.loads(row) for row in rows] == json.loads(data)
+            assert columns == list(expected[0])
+
+        # REAL按完整精度编码，溢出的Inf不产生非法JSON
+        columns, rows = self.db.execute_query_json_rows(
+            "SELECT 0.1 + 0.2 AS x, 0.5 AS y, 'a' AS z UNION ALL SELECT 9e999, -9e999, NULL"
+        )
+        assert [json.loads(row) for row in rows] == [
+            {"x": 0.1 + 0.2, "y": 0.5, "z": "a"}, {"x": None, "y": None, "z": None}
+        ]
+        assert "Infinity" not in rows[1]
+        count, data = self.db.execute_query_json("SELECT 1.0801696101857391e+273 AS x")
+        assert json.loads(data) == [{"x": 1.0801696101857391e+273}]
+
+        # 片段原样拼接，与编码解码后的对象一致；各编码器输出等价
+        count, data = self.db.execute_query_json(queries[0])
+        columns, rows = self.db.execute_query_json_rows(queries[0])
+        fragment = mcp_server_fast.PreEncodedJSON(rows, columns)
+        assert fragment.data == data
+        response = {"结果数量": count, "批量结果": {"0": {"查询结果": fragment}},
+                    "统计时间": datetime(2025, 6, 16, 8, 0)}
+        decoded = {"结果数量": count, "批量结果": {"0": {"查询结果": json.loads(data)}},
+                   "统计时间": "2025-06-16T08:00:00"}
+        for encoder in ["pydantic", "pydantic_indent", "json"]:
+            encoded = mcp_server_fast.encode_json(response, encoder)
+            result = json.loads(encoded)
+            if encoder == "json":
+                result["统计时间"] = result["统计时间"].replace(" ", "T")
+            assert result == decoded
+        assert b"\n" not in mcp_server_fast.encode_json(response, "pydantic")
+
+        logger.info("✓ 预编码JSON测试通过")
+
+    def test_result_summary(self):
+        """测试结果摘要：一次遍历得到总行数、字段统计和代表性样本"""
+        import asyncio
+        import mcp_server_fast
+
+        query = "SELECT id, street_name, garbage_weight FROM garbage_data"
+        rows = self.db.execute_query(query)
+        summary = self.db.execute_query_summary(query)
+        assert summary["总行数"] == len(rows)
+        assert len(summary["代表性样本"]) == min(RESULT_SUMMARY_CONFIG["sample_size"], len(rows))
+        assert all(row in rows for row in summary["代表性样本"])
+
+        weights = [float(r["garbage_weight"]) for r in rows if r["garbage_weight"] not in (None, "")]
+        weight_stats = summary["字段统计"]["garbage_weight"]
+        assert weight_stats["最小值"] == min(weights)
+        assert weight_stats["最大值"] == max(weights)
+        assert weight_stats["平均值"] == pytest.approx(sum(weights) / len(weights), abs=1e-3)
+        street_stats = summary["字段统计"]["street_name"]
+        assert street_stats["去重数"] == len({r["street_name"] for r in rows if r["street_name"]})
+        top_street = max({r["street_name"] for r in rows},
+                         key=lambda s: sum(1 for r in rows if r["street_name"] == s))
+        assert street_stats["高频取值"][0]["取值"] == top_street
+        assert summary["字段统计"]["id"]["高频取值"] == []
+
+        # 超过取值种类上限时去重数为下限，最小/最大值仍然准确
+        with patch.dict(RESULT_SUMMARY_CONFIG, {"max_tracked_values": 10, "fetch_batch_size": 100}):
+            capped = self.db.execute_query_summary(query)
+        ids = [r["id"] for r in rows]
+        assert capped["字段统计"]["id"]["去重数为下限"] is True
+        assert capped["字段统计"]["id"]["最小值"] == min(ids)
+        assert capped["字段统计"]["id"]["最大值"] == max(ids)
+
+        response = asyncio.run(mcp_server_fast.execute_any_sql_query(query, response_mode="summary"))
+        assert response["结果数量"] == len(rows) and "查询结果" not in response
+        assert response["结果摘要"]["字段统计"] == summary["字段统计"]
+        overdue = asyncio.run(mcp_server_fast.get_overdue_issues("2025-06-18", response_mode="summary"))
+        expected = self.db.get_overdue_issues("2025-06-18")["小包垃圾超时问题"]["问题数量"]
+        assert overdue["小包垃圾超时问题"]["问题摘要"]["总行数"] == expected
+        with pytest.raises(ValueError):
+            asyncio.run(mcp_server_fast.get_overdue_issues(response_mode="rows"))
+
+        logger.info("✓ 结果摘要测试通过")
+
+    def test_result_handles(self):
+        """测试大结果保存为服务端句柄，分页读取并直接导出为文件"""
+        import asyncio
+        import csv
+        import mcp_server_fast
+        from config import RESULT_HANDLE_CONFIG
+
+        query = "SELECT id, street_name, garbage_weight FROM garbage_data ORDER BY id"
+        rows = json.loads(json.dumps(self.db.execute_query(query), default=str))
+        assert len(rows) > RESULT_HANDLE_CONFIG["min_rows"]
+        response = asyncio.run(mcp_server_fast.execute_any_sql_query(query))
+        assert "查询结果" not in response and response["结果数量"] == len(rows)
+        assert response["结果预览"].to_python() == rows[:RESULT_HANDLE_CONFIG["preview_rows"]]
+        handle = response["结果句柄"]
+
+        page = asyncio.run(mcp_server_fast.fetch_result(handle, offset=100, limit=50))
+        assert page["查询结果"].to_python() == rows[100:150]
+        assert page["剩余数量"] == len(rows) - 150
+
+        export = asyncio.run(mcp_server_fast.export_result(handle, "csv", "test_result_handle.csv"))
+        try:
+            with open(export["文件路径"], encoding="utf-8-sig", newline="") as f:
+                exported = list(csv.DictReader(f))
+            assert export["行数"] == len(exported) == len(rows)
+            assert exported[0] == {k: "" if v is None else str(v) for k, v in rows[0].items()}
+            assert export["文件大小"] == os.path.getsize(export["文件路径"])
+        finally:
+            os.remove(export["文件路径"])
+        escaped = asyncio.run(mcp_server_fast.export_result(handle, "csv", "../escaped.csv"))
+        assert escaped["执行状态"] == "失败"
+
+        # 未安装pyarrow时Parquet导出给出明确的错误
+        parquet = asyncio.run(mcp_server_fast.export_result(handle, "parquet", "test_result_handle.parquet"))
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            assert parquet["执行状态"] == "失败" and "pyarrow" in parquet["错误信息"]
+        else:
+            try:
+                assert pq.read_table(parquet["文件路径"]).to_pylist() == rows
+            finally:
+                os.remove(parquet["文件路径"])
+
+        # 小结果照常返回全部结果行；句柄过期后读取失败
+        small = asyncio.run(mcp_server_fast.execute_any_sql_query(query + " LIMIT 5"))
+        assert small["查询结果"].to_python() == rows[:5]
+        with patch.object(mcp_server_fast.result_store, "ttl_seconds", 0):
+            mcp_server_fast.result_store.get(handle)
+        assert asyncio.run(mcp_server_fast.fetch_result(handle))["执行状态"] == "失败"
+
+        logger.info("✓ 结果句柄测试通过")
+
+    def test_export_query(self):
+        """测试查询结果分批从游标直接导出为文件"""
+        import asyncio
+        import csv
+        import mcp_server_fast
+        from config import ADMISSION_CONTROL_CONFIG, EXPORT_CONFIG
+        from result_export import export_directory
+
+        query = "SELECT id, street_name, garbage_weight FROM garbage_data WHERE street_name = ? ORDER BY id"
+        street = self.db.execute_query("SELECT street_name FROM garbage_data LIMIT 1")[0]["street_name"]
+        rows = self.db.execute_query(query, (street,))
+        with patch.dict(EXPORT_CONFIG, {"batch_size": 7}):
+            export = asyncio.run(mcp_server_fast.export_query(query, [street], path="test_export.csv"))
+        try:
+            assert export["执行状态"] == "成功" and export["行数"] == len(rows)
+            with open(export["文件路径"], encoding="utf-8-sig", newline="") as f:
+                exported = list(csv.reader(f))
+            assert exported[0] == ["id", "street_name", "garbage_weight"]
+            assert exported[1:] == [["" if v is None else str(v) for v in row.values()] for row in rows]
+            assert export["文件大小"] == os.path.getsize(export["文件路径"])
+        finally:
+            os.remove(export["文件路径"])
+
+        # 未安装pyarrow时Parquet导出给出明确的错误，不留下文件
+        parquet = asyncio.run(mcp_server_fast.export_query(query, [street], "parquet", "test_export.parquet"))
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            assert parquet["执行状态"] == "失败" and "pyarrow" in parquet["错误信息"]
+            assert not any(f.startswith("test_export.parquet") for f in os.listdir(export_directory()))
+        else:
+            try:
+                assert pq.read_table(parquet["文件路径"]).to_pylist() == rows
+            finally:
+                os.remove(parquet["文件路径"])
+
+        escaped = asyncio.run(mcp_server_fast.export_query(query, [street], path="/tmp/escaped.csv"))
+        assert escaped["执行状态"] == "失败"
+        with patch.dict(ADMISSION_CONTROL_CONFIG, {"max_cost": 1, "downgrade_cost": 1}):
+            rejected = asyncio.run(mcp_server_fast.export_query("SELECT * FROM garbage_data"))
+        assert rejected["执行状态"] == "已拒绝" and "文件路径" not in rejected
+
+        # 导出在独立连接上执行，不等待其他线程持有的服务连接锁；截止时间仍然生效
+        target = os.path.join(export_directory(), "test_export_isolated.csv")
+        locked, release = threading.Event(), threading.Event()
+
+        def hold_lock():
+            with self.db._lock:
+                locked.set()
+                release.wait(30)
+
+        holder = threading.Thread(target=hold_lock)
+        holder.start()
+        try:
+            locked.wait(10)
+            assert self.db.export_query(query, target, params=(street,)) == len(rows)
+            with pytest.raises(QueryTimeoutError):
+                self.db.export_query(
+                    "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) "
+                    "SELECT i FROM n", target, timeout=0.2
+                )
+            assert not os.path.exists(target + ".tmp")
+        finally:
+            release.set()
+            holder.join()
+            if os.path.exists(target):
+                os.remove(target)
+        # 历史视图只存在于服务连接上，include_history内的导出仍使用服务连接
+        with self.db.include_history():
+            assert self.db.export_query(query, target, params=(street,)) >= len(rows)
+        os.remove(target)
+
+        logger.info("✓ 查询结果导出测试通过")
+
+    def test_lazy_imports(self):
+        """测试服务路径不导入pandas/numpy，MCP服务器导入时不建立数据库连接"""
+        probe = (
+            "import sys, json, mcp_server_fast; "
+            "print(json.dumps({'heavy': [m for m in ('pandas', 'numpy') if m in sys.modules], "
+            "'db': mcp_server_fast.db is not None}))"
+        )
+        result = subprocess.run([sys.executable, "-c", probe], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+        loaded = json.loads(result.stdout.strip().splitlines()[-1])
+        assert loaded == {"heavy": [], "db": False}
+        
+        logger.info("✓ 延迟导入测试通过")
+
+    def test_table_catalog(self):
+        """测试元数据目录与日期范围"""
+        catalog = self.db.get_table_catalog()
+        for table_name in ["garbage_data", "small_package_garbage", "garbage_bin_overflow",
+                           "decoration_garbage_old", "decoration_garbage_new"]:
+            assert table_name in catalog
+        
+        expected = self.db.execute_query("""
+        SELECT COUNT(*) AS row_count,
+               MIN(DATE(load_time_str)) AS min_date,
+               MAX(DATE(load_time_str)) AS max_date,
+               COUNT(DISTINCT DATE(load_time_str)) AS date_count
+        FROM garbage_data
+        """)[0]
+        assert catalog["garbage_data"]["row_count"] == expected["row_count"]
+        assert catalog["garbage_data"]["distinct_days"] == expected["date_count"]
+        assert self.db.get_table_row_count("garbage_data") == expected["row_count"]
+        
+        ranges = self.db.get_available_date_range()["数据日期范围"]
+        garbage_range = ranges["干湿垃圾数据"]
+        assert garbage_range["min_date"] == expected["min_date"]
+        assert garbage_range["max_date"] == expected["max_date"]
+        assert garbage_range["date_count"] == expected["date_count"]
+        
+        # 目录缺失时自动补齐
+        self.db.connection.execute("DELETE FROM meta_table_catalog WHERE table_name = 'garbage_data'")
+        self.db.connection.commit()
+        self.db._catalog_cache = None
+        assert self.db.get_table_catalog()["garbage_data"]["row_count"] == expected["row_count"]
+        
+        logger.info("✓ 元数据目录测试通过")
+
 def run_tests():
     """运行测试"""
     logger.info("开始运行GarbageMonitoringDB类功能测试...")